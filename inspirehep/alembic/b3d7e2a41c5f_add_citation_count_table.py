@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Add citation count table."""
+
+from __future__ import absolute_import, division, print_function
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b3d7e2a41c5f'
+down_revision = 'f2b5c1e8a9d4'
+branch_labels = ()
+depends_on = None
+
+
+def upgrade():
+    """Upgrade database."""
+    op.create_table(
+        'records_citation_count',
+        sa.Column('recid', sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column('citation_count', sa.Integer, nullable=False, default=0),
+    )
+    # Count the citations of the existing records, as the counts are only
+    # incremented and decremented from now on. Like ``get_cited_recids``,
+    # every record is counted at most once per cited record.
+    op.execute(
+        "INSERT INTO records_citation_count (recid, citation_count) "
+        "SELECT cited_recid, count(*) FROM ("
+        "    SELECT DISTINCT records_metadata.id, CAST(substring("
+        "        reference -> 'record' ->> '$ref' FROM '/([0-9]+)$'"
+        "    ) AS integer) AS cited_recid"
+        "    FROM records_metadata, jsonb_array_elements("
+        "        CASE jsonb_typeof(json -> 'references')"
+        "        WHEN 'array' THEN json -> 'references' ELSE '[]' END"
+        "    ) AS reference"
+        "    WHERE position('hep.json' IN json ->> '$schema') > 0"
+        "    AND coalesce(json ->> 'deleted', 'false') != 'true'"
+        ") AS citations "
+        "WHERE cited_recid IS NOT NULL "
+        "GROUP BY cited_recid"
+    )
+
+
+def downgrade():
+    """Downgrade database."""
+    op.drop_table('records_citation_count')
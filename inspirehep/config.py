@@ -293,6 +293,22 @@ SEARCH_UI_BASE_TEMPLATE = BASE_TEMPLATE
 SEARCH_UI_SEARCH_TEMPLATE = 'search/search.html'
 SEARCH_UI_SEARCH_API = '/api/literature/'
 SEARCH_UI_SEARCH_INDEX = 'records-hep'
+
+SEARCH_QUERY_CACHE_REDIS = False
+"""Share the queries generated from query strings between processes."""
+
+SEARCH_QUERY_CACHE_TIMEOUT = 86400
+"""Seconds during which a generated query is cached in Redis."""
+
+SEARCH_INDEX_SETTINGS = {
+    'refresh_interval': '1s',
+    'number_of_replicas': 1,
+}
+"""Settings given back to the indices after they are loaded in bulk.
+
+They can be overridden for an index in the ``settings`` of its mapping.
+"""
+
 INSPIRE_ENDPOINT_TO_INDEX = {
     'authors': 'records-authors',
     'conferences': 'records-conferences',
@@ -1146,6 +1162,53 @@ Note:
 
 """
 
+RECORDS_INCREMENTAL_CITATION_COUNTS = True
+"""Keep the ``citation_count`` of Literature records up to date.
+
+When a Literature record is inserted, updated or deleted, the counts of the
+records whose citations changed are incremented or decremented in the DB,
+in the same transaction, and then copied to ES. They are also read from the
+DB whenever a record is indexed. ``inspirehep migrator count_citations``
+recomputes all of them.
+
+Note:
+
+  The migration creating the table of the counts fills it from the records
+  in the DB. If this is enabled again after having been disabled, the
+  counts are stale: run ``inspirehep migrator count_citations`` first.
+
+"""
+
+RECORDS_ASYNC_INDEXING = False
+"""Index committed records asynchronously.
+
+Instead of indexing them before the end of the request or task that
+committed them, inserted and updated records are queued in Redis and
+indexed in bulk by a Celery task. A record updated several times while
+queued is indexed only once, at its latest revision.
+"""
+
+RECORDS_ASYNC_INDEXING_WINDOW = 5
+"""Seconds to wait for more records to be queued before indexing them."""
+
+RECORDS_PID_CACHE_TIMEOUT = 3600
+"""Seconds during which the UUID of a PID is cached in Redis."""
+
+RECORDS_DOWNLOAD_WORKERS = 8
+"""Maximum number of documents and figures of a record downloaded at once."""
+
+RECORDS_BRIEF_SOURCE_EXCLUDES = {
+    'records-hep': [
+        'references',
+    ],
+}
+"""Fields of the records not fetched for the brief format of the search results.
+
+The brief serializer drops them from its output anyway: the display fields
+of Literature records are computed at index time, so their references are
+not needed. All the other fields are returned as before.
+"""
+
 JSONSCHEMAS_HOST = "localhost:5000"
 JSONSCHEMAS_REPLACE_REFS = True
 JSONSCHEMAS_LOADER_CLS = 'inspirehep.modules.records.json_ref_loader.SCHEMA_LOADER_CLS'
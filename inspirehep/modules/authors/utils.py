@@ -26,11 +26,12 @@ from __future__ import absolute_import, division, print_function
 
 import re
 
-
 import numpy as np
 from beard.utils.strings import asciify
 from beard.clustering import block_phonetic
 
+from inspirehep.utils.lru import LRUCache
+
 
 _bai_parentheses_cleaner = \
     re.compile(r"(\([^)]*\))|(\[[^\]]*\])|(\{[^\}]*\})", re.UNICODE)
@@ -44,6 +45,45 @@ _bai_particles = ["da", "de", "del", "den", "der",
 split_on_re = re.compile('[\.\s-]')
 single_initial_re = re.compile('^\w\.$')
 
+NAME_CACHE_SIZE = 100000
+
+
+class NameCache(LRUCache):
+    """Bounded LRU cache of values computed from author names.
+
+    Entries are keyed by ``(kind, name)`` so that the BAI and the phonetic
+    blocks of the same name share the cache and its size limit.
+    """
+
+    def __init__(self, maxsize=NAME_CACHE_SIZE):
+        super(NameCache, self).__init__(maxsize)
+
+    def get(self, kind, name, default=None):
+        """Return the cached value, marking it as the most recently used."""
+        return super(NameCache, self).get((kind, name), default)
+
+    def set(self, kind, name, value):
+        """Cache a value, evicting the least recently used ones if full."""
+        super(NameCache, self).set((kind, name), value)
+
+
+_name_cache = NameCache()
+
+
+def normalize_name(name):
+    """Normalize a full name for use as a cache key."""
+    return _bai_spaces.sub(' ', name).strip()
+
+
+def get_name_cache_stats():
+    """Return the statistics of the cache of BAIs and phonetic blocks."""
+    return _name_cache.stats()
+
+
+def clear_name_cache():
+    """Empty the cache of BAIs and phonetic blocks."""
+    _name_cache.clear()
+
 
 def _nonempty(words):
     words = [w.strip() for w in words]
@@ -52,6 +92,17 @@ def _nonempty(words):
 
 
 def bai(name):
+    """Compute the BAI of a full name, caching the result."""
+    key = normalize_name(name)
+    result = _name_cache.get('bai', key)
+    if result is None:
+        result = _bai(key)
+        _name_cache.set('bai', key, result)
+
+    return result
+
+
+def _bai(name):
     # Remove content in parentheses
     name = _bai_parentheses_cleaner.sub("", name)
 
@@ -109,14 +160,40 @@ def bai(name):
 
 
 def phonetic_blocks(full_names, phonetic_algorithm='nysiis'):
-    """Create a dictionary of phonetic blocks for a given list of names."""
+    """Create a dictionary of phonetic blocks for a given list of names.
+
+    Blocks are cached by normalized name, so only the names that were not
+    seen recently are passed, all at once, to the blocking algorithm.
+    """
+    keys = {}
+    blocks = {}
+    missing = []
+    for full_name in full_names:
+        key = keys[full_name] = normalize_name(full_name)
+        if key in blocks:
+            continue
+        block = _name_cache.get(phonetic_algorithm, key)
+        if block is None:
+            blocks[key] = None
+            missing.append(key)
+        else:
+            blocks[key] = block
+
+    if missing:
+        for key, block in zip(missing, _block_names(missing, phonetic_algorithm)):
+            blocks[key] = block
+            _name_cache.set(phonetic_algorithm, key, block)
 
+    return {full_name: blocks[key] for full_name, key in keys.items()}
+
+
+def _block_names(full_names, phonetic_algorithm):
     # The method requires a list of dictionaries with full_name as keys.
     full_names_formatted = [
         {"author_name": i} for i in full_names]
 
     # Create a list of phonetic blocks.
-    phonetic_blocks = list(
+    return list(
         block_phonetic(np.array(
             full_names_formatted,
             dtype=np.object).reshape(-1, 1),
@@ -124,5 +201,3 @@ def phonetic_blocks(full_names, phonetic_algorithm='nysiis'):
             phonetic_algorithm=phonetic_algorithm
         )
     )
-
-    return dict(zip(full_names, phonetic_blocks))
@@ -28,6 +28,7 @@ import os
 import csv
 import traceback
 import sys
+from io import BytesIO
 
 from itertools import dropwhile
 import click
@@ -39,14 +40,19 @@ from flask_cli import with_appcontext
 from inspire_schemas.api import validate
 from inspire_utils.helpers import force_list
 
+from inspirehep.utils.timers import get_stage_stats
+
 from .tasks import (
     add_citation_counts,
+    get_migration_stats,
     migrate,
+    migrate_locally,
     remigrate_records,
     migrate_chunk,
-    split_blob,
+    iterparse_stream,
     create_record,
     marc_create_record,
+    reset_migration_stats,
 )
 from .models import InspireProdRecords
 
@@ -77,26 +83,42 @@ def migrator():
               default=False, help='Remigrate all records')
 @click.option('--wait', '-w', type=bool, default=False,
               help='Wait for migrator to complete.')
+@click.option('--local-workers', '-l', type=int, default=0,
+              help='Migrate the file with N local processes instead of Celery.')
+@click.option('--force', is_flag=True, default=False,
+              help='Migrate also the records whose MARCXML did not change.')
+@click.option('--resume', is_flag=True, default=False,
+              help='Resume the migration of the file from its last checkpoint.')
 def populate(file_input=None,
              remigrate_broken=False,
              remigrate_all=False,
-             wait=False):
+             wait=False,
+             local_workers=0,
+             force=False,
+             resume=False):
     """Populates the system with records from migrator files.
 
     Usage: inveniomanage migrator populate -f prodsync20151117173222.xml.gz
     """
     if remigrate_broken:
         click.echo("Remigrate broken records...")
-        remigrate_records.delay(only_broken=True)
+        remigrate_records.delay(only_broken=True, force=force)
     elif remigrate_all:
         click.echo("Remigrate all records...")
-        remigrate_records.delay(only_broken=False)
+        remigrate_records.delay(only_broken=False, force=force)
     elif file_input and not os.path.isfile(file_input):
         click.echo("{0} is not a file!".format(file_input), err=True)
     elif file_input:
         click.echo("Migrating records from file: {0}".format(file_input))
 
-        migrate(os.path.abspath(file_input), wait_for_results=wait)
+        if local_workers:
+            migrate_locally(
+                os.path.abspath(file_input), local_workers, force=force,
+                resume=resume)
+        else:
+            migrate(
+                os.path.abspath(file_input), wait_for_results=wait, force=force,
+                resume=resume)
 
 
 @migrator.command()
@@ -105,7 +127,7 @@ def one(recid):
     click.echo('Migrating record {recid} from INSPIRE legacy'.format(recid=recid))
     response = requests.get('http://inspirehep.net/record/{recid}/export/xme'.format(recid=recid))
     response.raise_for_status()
-    migrate_chunk(split_blob(response.content))
+    migrate_chunk(iterparse_stream(BytesIO(response.content)), force=True)
 
 
 @migrator.command()
@@ -115,6 +137,62 @@ def count_citations():
     add_citation_counts()
 
 
+@migrator.command()
+@click.option('--reset', is_flag=True, default=False,
+              help="Clear the statistics after printing them.")
+@with_appcontext
+def stats(reset):
+    """Print the time spent in each stage of the migration so far."""
+    totals = get_migration_stats()
+    if not totals:
+        click.echo("No migration statistics recorded.")
+        return
+
+    records = int(totals.get('records', 0))
+    stages = get_stage_stats(totals)
+    total_time = sum(stage_time for _, stage_time, _ in stages)
+    click.echo(
+        "{records} records ({created} created, {updated} updated, "
+        "{skipped} skipped, {failed} failed) in {time:.1f}s".format(
+            records=records,
+            created=int(totals.get('created', 0)),
+            updated=int(totals.get('updated', 0)),
+            skipped=int(totals.get('skipped', 0)),
+            failed=int(totals.get('failed', 0)),
+            time=total_time,
+        )
+    )
+    click.echo("{:<16}{:>12}{:>10}{:>8}{:>12}".format(
+        'stage', 'time (s)', 'calls', 'share', 'records/s'))
+    for stage, stage_time, count in stages:
+        click.echo("{:<16}{:>12.2f}{:>10}{:>8.1%}{:>12.1f}".format(
+            stage,
+            stage_time,
+            count,
+            stage_time / (total_time or 1),
+            records / stage_time if stage_time else 0,
+        ))
+
+    name_cache_hits = int(totals.get('name_cache_hits', 0))
+    name_cache_lookups = name_cache_hits + int(totals.get('name_cache_misses', 0))
+    if name_cache_lookups:
+        click.echo("Author name cache: {:.1%} hits over {} lookups".format(
+            name_cache_hits / name_cache_lookups, name_cache_lookups))
+
+    pid_cache_hits = int(totals.get('pid_cache_queries_saved', 0))
+    pid_cache_lookups = pid_cache_hits + int(totals.get('pid_cache_misses', 0))
+    if pid_cache_lookups:
+        click.echo("PID cache: {:.1%} hits over {} lookups ({} request, {} Redis)".format(
+            pid_cache_hits / pid_cache_lookups,
+            pid_cache_lookups,
+            int(totals.get('pid_cache_request_hits', 0)),
+            int(totals.get('pid_cache_redis_hits', 0)),
+        ))
+
+    if reset:
+        reset_migration_stats()
+
+
 @migrator.command()
 @click.option('--output', '-o', default="/tmp/broken-records.csv",
               help='Specifiy where to report errors.')
@@ -31,23 +31,29 @@ from invenio_db import db
 from sqlalchemy.ext.hybrid import hybrid_property
 
 
+def decompress_marcxml(value):
+    """Decompress a value of the ``marcxml`` column."""
+    try:
+        return decompress(value)
+    except error:
+        # Legacy uncompress data?
+        return value
+
+
 class InspireProdRecords(db.Model):
     __tablename__ = 'inspire_prod_records'
 
     recid = db.Column(db.Integer, primary_key=True, index=True)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     _marcxml = db.Column('marcxml', db.LargeBinary, nullable=False)
+    marcxml_digest = db.Column(db.String(40), nullable=True)
     valid = db.Column(db.Boolean, default=None, nullable=True, index=True)
     errors = db.Column(db.Text(), nullable=True)
 
     @hybrid_property
     def marcxml(self):
         """marcxml column wrapper to compress/decompress on the fly."""
-        try:
-            return decompress(self._marcxml)
-        except error:
-            # Legacy uncompress data?
-            return self._marcxml
+        return decompress_marcxml(self._marcxml)
 
     @marcxml.setter
     def marcxml(self, value):
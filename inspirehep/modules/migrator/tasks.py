@@ -25,42 +25,72 @@
 from __future__ import absolute_import, division, print_function
 
 import gzip
+import hashlib
+import multiprocessing
+import os
 import re
+import resource
+import threading
+import time
 import zlib
-from collections import Counter
-from itertools import chain
+from collections import Counter, deque
+from functools import partial
+from itertools import chain, islice
 
 import click
+import numpy as np
+import pkg_resources
 from celery import group, shared_task
 from celery.utils.log import get_task_logger
 from elasticsearch.helpers import bulk as es_bulk
 from elasticsearch.helpers import scan as es_scan
 from flask import current_app, url_for
-from flask_sqlalchemy import models_committed
+from flask_sqlalchemy import before_models_committed, models_committed
 from jsonschema import ValidationError
+from lxml import etree
 from redis import StrictRedis
 from redis_lock import Lock
-from six import text_type
+from six import iteritems
+from sqlalchemy import tuple_
 
 from dojson.contrib.marc21.utils import create_record as marc_create_record
 from invenio_db import db
-from invenio_indexer.api import RecordIndexer, current_record_to_index
 from invenio_pidstore.errors import PIDDoesNotExistError
 from invenio_pidstore.models import PersistentIdentifier
+from invenio_records.models import RecordMetadata
+from invenio_records.signals import before_record_update
 from invenio_search import current_search_client as es
 from invenio_search.utils import schema_to_index
 
 from inspire_dojson.processors import overdo_marc_dict
 from inspire_dojson.utils import get_recid_from_ref
-from inspire_utils.dedupers import dedupe_list
 from inspire_utils.helpers import force_list
 from inspire_utils.record import get_value
+from inspirehep.modules.authors.utils import get_name_cache_stats
 from inspirehep.modules.pidstore.minters import inspire_recid_minter
 from inspirehep.modules.pidstore.utils import get_pid_type_from_schema
 from inspirehep.modules.records.api import InspireRecord
-from inspirehep.modules.records.receivers import index_after_commit
+from inspirehep.modules.records.models import (
+    CitationCount,
+    add_to_citation_counts,
+)
+from inspirehep.modules.records.receivers import (
+    get_citation_count_deltas,
+    get_cited_recids,
+    index_after_commit,
+    index_citation_counts,
+    snapshot_cited_recids,
+    update_citation_counts_before_commit,
+)
+from inspirehep.modules.records.utils import (
+    get_index_action,
+    prefetched_citation_counts,
+)
+from inspirehep.modules.search.reindex import bulk_index_settings
+from inspirehep.utils.record_getter import get_pid_cache_stats
+from inspirehep.utils.timers import StageTimer, get_stage_stats, timed_stage
 
-from .models import InspireProdRecords
+from .models import InspireProdRecords, decompress_marcxml
 
 
 logger = get_task_logger(__name__)
@@ -68,7 +98,26 @@ logger = get_task_logger(__name__)
 CHUNK_SIZE = 100
 LARGE_CHUNK_SIZE = 2000
 
-split_marc = re.compile('<record.*?>.*?</record>', re.DOTALL)
+READ_BLOCK_SIZE = 1024 * 1024
+
+RECORD_END = b'</record>'
+
+blanks_between_tags = re.compile(br'>\s+<')
+root_start_tag = re.compile(
+    br'(?:\xef\xbb\xbf)?(?:\s+|<\?.*?\?>|<!--.*?-->|<!DOCTYPE[^>]*>)*<[^?!/][^>]*>',
+    re.DOTALL,
+)
+
+MARC21_NS_DECLARATION = b' xmlns="http://www.loc.gov/MARC21/slim"'
+
+
+def get_bulk_indices():
+    """Return the indices written to by a migration.
+
+    They are the indices, or aliases, of the records. A wildcard would also
+    match the indices being built by ``inspirehep index rebuild``.
+    """
+    return sorted(set(current_app.config['INSPIRE_ENDPOINT_TO_INDEX'].values()))
 
 
 def chunker(iterable, chunksize=CHUNK_SIZE):
@@ -82,48 +131,317 @@ def chunker(iterable, chunksize=CHUNK_SIZE):
         yield buf
 
 
-def split_blob(blob):
-    """Split the blob using <record.*?>.*?</record> as pattern."""
-    for match in split_marc.finditer(blob):
-        yield match.group()
+def iterparse_stream(stream):
+    """Incrementally parse the stream, yielding one ``<record>`` element at a time.
 
+    Each element is cleared, together with its already consumed siblings, as
+    soon as the consumer asks for the next one, so that memory usage stays
+    constant regardless of the size of the dump.
+    """
+    for _, element in etree.iterparse(
+            stream, events=('end',), tag='{*}record', huge_tree=True):
+        yield element
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
 
-def split_stream(stream):
-    """Split the stream using <record.*?>.*?</record> as pattern."""
-    buf = []
-    for row in stream:
-        row = text_type(row, 'utf8')
-        index = row.rfind('</record>')
-        if index >= 0:
-            buf.append(row[:index + 9])
-            for blob in split_blob(''.join(buf)):
-                yield blob.encode('utf8')
-            buf = [row[index + 9:]]
+
+def iterparse_stream_with_positions(stream, offset=0, block_size=READ_BLOCK_SIZE):
+    """Incrementally parse the stream, also yielding where to resume after each record.
+
+    The stream is fed to the parser in blocks cut right after a
+    ``</record>``, so the uncompressed offset at the end of each block is a
+    record boundary. Every element is yielded with an ``(offset, skip)``
+    position: seeking the stream to ``offset`` and skipping ``skip``
+    records resumes right after that element.
+
+    Args:
+        stream: file-like object containing the dump.
+        offset(int): a position previously yielded by this function, to
+            resume from.
+    """
+    parser = etree.XMLPullParser(events=('end',), tag='{*}record', huge_tree=True)
+    if offset:
+        # The closing tag of the original root element is still to be read.
+        parser.feed(_read_root_start_tag(stream, block_size))
+        stream.seek(offset)
+
+    # ``(offset, records ended before it)`` of every block boundary not
+    # yet overtaken by the yielded elements.
+    boundaries = deque([(offset, 0)])
+    position = offset
+    pending = b''
+    ended = 0
+    parsed = 0
+
+    while True:
+        block = stream.read(block_size)
+        data = pending + block
+        if not block:
+            end = len(data)
+        elif data.rfind(RECORD_END) != -1:
+            end = data.rfind(RECORD_END) + len(RECORD_END)
+        elif len(data) > 16 * block_size:
+            # No record boundary in sight: go on without one, but hold back
+            # what could be the beginning of a ``</record>``.
+            end = len(data) - len(RECORD_END) + 1
         else:
-            buf.append(row)
+            end = 0
+
+        fed, pending = data[:end], data[end:]
+        ended += fed.count(RECORD_END)
+        position += len(fed)
+        if fed.endswith(RECORD_END):
+            boundaries.append((position, ended))
+
+        parser.feed(fed)
+        if not block:
+            parser.close()
+
+        for _, element in parser.read_events():
+            parsed += 1
+            while len(boundaries) > 1 and boundaries[1][1] <= parsed:
+                boundaries.popleft()
+            boundary, ended_before = boundaries[0]
+
+            yield element, (boundary, parsed - ended_before)
+
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+        if not block:
+            break
+
+
+def _read_root_start_tag(stream, block_size=READ_BLOCK_SIZE):
+    """Return the beginning of the stream, up to the start tag of its root element.
+
+    Feeding it to the parser when resuming keeps the encoding and the
+    namespace declarations of the dump, so that the records are parsed
+    as in a run from its beginning.
+    """
+    stream.seek(0)
+    data = b''
+    while True:
+        block = stream.read(block_size)
+        data += block
+        match = root_start_tag.match(data)
+        if match:
+            return match.group()
+        if not block:
+            raise ValueError('The dump has no root element.')
+
+
+def split_stream_with_positions(stream, offset=0):
+    """Split the stream into serialized ``<record>`` elements and their positions.
+
+    See :func:`iterparse_stream_with_positions`.
+    """
+    for element, position in iterparse_stream_with_positions(stream, offset):
+        raw_record = etree.tostring(element, encoding='utf8', xml_declaration=False)
+        yield raw_record, position
+
+
+class MigrationCheckpoint(object):
+    """Last chunk of a dump that was migrated, stored in Redis.
+
+    Besides the index of the chunk, the checkpoint stores its position as
+    yielded by :func:`iterparse_stream_with_positions` and, for progress
+    reporting, the corresponding offset in the compressed file.
+    """
+
+    def __init__(self, source):
+        redis_url = current_app.config.get('CACHE_REDIS_URL')
+        self.redis = StrictRedis.from_url(redis_url)
+        self.key = 'migrator:checkpoint:{}'.format(os.path.abspath(source))
+        self.completed_key = self.key + ':completed'
+
+    def load(self):
+        """Return the checkpoint, or ``None`` if there isn't any."""
+        checkpoint = self.redis.hgetall(self.key)
+        if not checkpoint:
+            return None
+
+        return {key: int(value) for key, value in checkpoint.items()}
+
+    def save(self, chunk, position, compressed_offset):
+        offset, skip = position
+        self.redis.hmset(self.key, {
+            'chunk': chunk,
+            'offset': offset,
+            'skip': skip,
+            'compressed_offset': compressed_offset,
+        })
+
+    def complete(self, chunk, position, compressed_offset):
+        """Mark a chunk as migrated, in whatever order the chunks complete.
+
+        The checkpoint is moved to the last chunk such that it and all the
+        chunks before it have been migrated.
+        """
+        offset, skip = position
+        with Lock(self.redis, self.key, expire=60):
+            self.redis.hset(self.completed_key, chunk, '{} {} {}'.format(
+                offset, skip, compressed_offset))
+            completed = {
+                int(key): value
+                for key, value in self.redis.hgetall(self.completed_key).items()
+            }
+            checkpoint = self.load()
+            last = checkpoint['chunk'] if checkpoint else -1
+            if last + 1 not in completed:
+                return
+
+            while last + 1 in completed:
+                last += 1
+            offset, skip, compressed_offset = map(int, completed[last].split())
+            self.save(last, (offset, skip), compressed_offset)
+            self.redis.hdel(self.completed_key, *[
+                key for key in completed if key <= last])
+
+    def clear(self):
+        self.redis.delete(self.key, self.completed_key)
+
+
+def get_compressed_offset(fd):
+    """Offset of the underlying file of a possibly gzipped dump."""
+    return getattr(fd, 'fileobj', fd).tell()
+
+
+def read_chunks(source, chunk_size=CHUNK_SIZE, resume=False):
+    """Read a dump in chunks of MARCXML records.
+
+    Yields:
+        tuple: the index of the chunk, the chunk itself and the position
+            after it. If ``resume`` is ``True``, starts from the chunk after
+            the checkpoint of ``source``.
+    """
+    checkpoint = MigrationCheckpoint(source).load() if resume else None
+    if checkpoint:
+        offset, skip = checkpoint['offset'], checkpoint['skip']
+        first_chunk = checkpoint['chunk'] + 1
+        click.echo('Resuming from chunk {} at offset {}.'.format(first_chunk, offset))
+    else:
+        offset, skip, first_chunk = 0, 0, 0
+
+    fd = open_source(source)
+    records = islice(split_stream_with_positions(fd, offset), skip, None)
+    for i, chunk in enumerate(chunker(records, chunk_size), first_chunk):
+        raw_records = [raw_record for raw_record, _ in chunk]
+        yield i, raw_records, chunk[-1][1], get_compressed_offset(fd)
+
+
+def get_marcxml_digest(marcxml):
+    """Digest of the normalized MARCXML of a record.
+
+    The version of ``inspire-dojson`` is part of the digest, so that the
+    records get migrated again when the conversion rules change.
+    """
+    normalized = blanks_between_tags.sub(b'><', marcxml.strip())
+    normalized = normalized.replace(MARC21_NS_DECLARATION, b'')
+
+    digest = hashlib.sha1(
+        pkg_resources.get_distribution('inspire-dojson').version.encode('ascii'))
+    digest.update(normalized)
+
+    return digest.hexdigest()
+
+
+def get_unchanged_recids(prod_records):
+    """Recids of the records migrated successfully from the same MARCXML."""
+    digests = {
+        prod_record.recid: prod_record.marcxml_digest
+        for prod_record in prod_records
+    }
+    if not digests:
+        return set()
+
+    query = db.session.query(
+        InspireProdRecords.recid,
+        InspireProdRecords.marcxml_digest,
+    ).filter(
+        InspireProdRecords.recid.in_(digests.keys()),
+        InspireProdRecords.valid == True,  # noqa: E712
+    )
+
+    return {
+        recid for recid, marcxml_digest in query
+        if marcxml_digest == digests[recid]
+    }
 
 
 @shared_task(ignore_result=True)
-def remigrate_records(only_broken=True):
+def remigrate_records(only_broken=True, force=False):
     """Remigrate records.
 
     Directly migrates the records (declared as broken), e.g. if the dojson
     conversion script have been corrected.
+
+    Only the bounds of each chunk of recids are sent to the workers, which
+    read the MARCXML of the records themselves.
     """
-    query = db.session.query(InspireProdRecords).filter_by(valid=False) if only_broken else db.session.query(InspireProdRecords)
-    for i, chunk in enumerate(chunker(query.yield_per(CHUNK_SIZE))):
-        records = [record.marcxml for record in chunk]
+    query = _get_prod_records_query(
+        InspireProdRecords.recid, only_broken=only_broken
+    ).order_by(InspireProdRecords.recid)
+    recids = (recid for recid, in query.yield_per(LARGE_CHUNK_SIZE))
+    for i, chunk in enumerate(chunker(recids)):
         logger.info("Processed {} records".format(i * CHUNK_SIZE))
-        migrate_chunk.delay(records)
+        migrate_recid_range.delay(chunk[0], chunk[-1], only_broken=only_broken, force=force)
 
 
-@shared_task(ignore_result=True)
-def migrate(source, wait_for_results=False):
-    """Main migration function."""
+def _get_prod_records_query(*columns, **kwargs):
+    query = db.session.query(*columns)
+    if kwargs.get('only_broken'):
+        query = query.filter(InspireProdRecords.valid.is_(False))
+    return query
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def migrate_recid_range(first_recid, last_recid, only_broken=True, force=False):
+    """Remigrate the records with a recid between ``first_recid`` and ``last_recid``.
+
+    The MARCXML is streamed from the database with a server-side cursor
+    and decompressed here rather than by the dispatcher.
+    """
+    query = _get_prod_records_query(
+        InspireProdRecords._marcxml, only_broken=only_broken
+    ).filter(
+        InspireProdRecords.recid.between(first_recid, last_recid)
+    ).execution_options(stream_results=True)
+    chunk = [
+        decompress_marcxml(marcxml)
+        for marcxml, in query.yield_per(CHUNK_SIZE)
+    ]
+    db.session.close()
+
+    return migrate_chunk(chunk, force=force)
+
+
+def open_source(source):
+    """Open a MARCXML dump, transparently decompressing gzipped ones."""
     if source.endswith('.gz'):
-        fd = gzip.open(source)
-    else:
-        fd = open(source)
+        return gzip.open(source)
+    return open(source)
+
+
+@shared_task(ignore_result=True)
+def checkpoint_chunk(source, chunk, position, compressed_offset):
+    """Record that a chunk of a dump was migrated by :func:`migrate_chunk`."""
+    MigrationCheckpoint(source).complete(chunk, position, compressed_offset)
+
+
+@shared_task(ignore_result=True)
+def migrate(source, wait_for_results=False, force=False, resume=False):
+    """Main migration function.
+
+    The checkpoint is advanced as the chunks are migrated successfully, so
+    that the migration can be resumed with ``resume=True``. Chunks migrated
+    twice are idempotent.
+    """
+    checkpoint = MigrationCheckpoint(source)
+    if not resume:
+        checkpoint.clear()
 
     if wait_for_results:
         # if the wait_for_results is true we enable returning results from migrate_chunk task
@@ -132,107 +450,485 @@ def migrate(source, wait_for_results=False):
         tasks = []
         migrate_chunk.ignore_result = False
 
-    for i, chunk in enumerate(chunker(split_stream(fd), CHUNK_SIZE)):
+    chunks = read_chunks(source, CHUNK_SIZE, resume=resume)
+    for i, chunk, position, compressed_offset in chunks:
         print("Processed {} records".format(i * CHUNK_SIZE))
+        task = migrate_chunk.s(chunk, force=force)
+        task.link(checkpoint_chunk.si(source, i, position, compressed_offset))
         if wait_for_results:
-            tasks.append(migrate_chunk.s(chunk))
+            tasks.append(task)
         else:
-            migrate_chunk.delay(chunk)
+            task.delay()
 
     if wait_for_results:
         job = group(tasks)
-        result = job.apply_async()
-        result.join()
+        with bulk_index_settings(*get_bulk_indices()):
+            result = job.apply_async()
+            result.join()
         migrate_chunk.ignore_result = True
         print('All migration tasks have been completed.')
+        checkpoint.clear()
+
+
+def _init_local_worker():
+    """Give each local migration worker its own app, DB session and ES client."""
+    from inspirehep.factory import create_app
+
+    app = create_app()
+    app.app_context().push()
+
+
+def _migrate_chunk_locally(args, force=False):
+    i, chunk = args
+    return i, migrate_chunk(chunk, force=force)
+
+
+def migrate_locally(source, workers, chunk_size=CHUNK_SIZE, force=False, resume=False):
+    """Migrate a dump with a local pool of processes instead of Celery.
+
+    The parent process splits the dump and hands chunks to ``workers``
+    processes, each running the whole :func:`migrate_chunk` pipeline, and
+    reports progress and per-stage throughput as the chunks complete.
+
+    A checkpoint is saved whenever all the chunks up to a given one have
+    completed, so that the migration can be resumed with ``resume=True``.
+    """
+    # Don't let the workers inherit the connections of the parent.
+    db.session.close()
+    db.engine.dispose()
+
+    # ``imap_unordered`` consumes its input eagerly: make sure that only a
+    # bounded number of chunks is read from the dump ahead of the workers.
+    pending = threading.BoundedSemaphore(workers * 2)
+
+    checkpoint = MigrationCheckpoint(source)
+    # Positions of the chunks sent to the workers but not yet checkpointed.
+    positions = {}
+    positions_lock = threading.Lock()
+
+    def _throttled(chunks):
+        for i, chunk, position, compressed_offset in chunks:
+            pending.acquire()
+            with positions_lock:
+                positions[i] = position, compressed_offset
+            yield i, chunk
+
+    def _checkpoint(completed):
+        with positions_lock:
+            i = min(positions)
+            if i not in completed:
+                return
+            while i + 1 in completed:
+                i += 1
+            checkpoint.save(i, *positions[i])
+            for j in range(min(positions), i + 1):
+                del positions[j]
+                completed.remove(j)
+
+    totals = Counter()
+    start = time.time()
+    pool = multiprocessing.Pool(workers, initializer=_init_local_worker)
+    try:
+        with bulk_index_settings(*get_bulk_indices()):
+            chunks = _throttled(read_chunks(source, chunk_size, resume=resume))
+            migrate = partial(_migrate_chunk_locally, force=force)
+            completed = set()
+            for i, stats in pool.imap_unordered(migrate, chunks):
+                pending.release()
+                completed.add(i)
+                _checkpoint(completed)
+                totals.update(stats)
+                click.echo(
+                    'Processed {records} records ({rate:.1f} rec/s): '
+                    '{created} created, {updated} updated, {skipped} skipped, '
+                    '{failed} failed; per worker: {stages}'.format(
+                        records=totals['records'],
+                        rate=totals['records'] / (time.time() - start),
+                        created=totals['created'],
+                        updated=totals['updated'],
+                        skipped=totals['skipped'],
+                        failed=totals['failed'],
+                        stages=', '.join(
+                            '{} {:.1f}/s'.format(stage, count / (stage_time or 1))
+                            for stage, stage_time, count in get_stage_stats(totals)
+                        ),
+                    ))
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    checkpoint.clear()
+    click.echo('All {} records have been processed in {:.0f}s.'.format(
+        totals['records'], time.time() - start))
+
+    return totals
 
 
 @shared_task(ignore_result=True)
-def continuous_migration():
-    """Task to continuously migrate what is pushed up by Legacy."""
+def continuous_migration(batch_size=CHUNK_SIZE):
+    """Task to continuously migrate what is pushed up by Legacy.
+
+    The queue is drained ``batch_size`` records at a time: each batch is
+    fetched with a single pipelined round-trip, migrated in one transaction
+    and bulk-indexed by :func:`migrate_chunk`, and only then trimmed from
+    the queue. The queue depth and the drain rate are logged and stored in
+    the ``legacy_records:stats`` hash.
+
+    If a batch cannot be migrated, its records are migrated one by one,
+    and the ones that still fail are moved to the ``legacy_records:errors``
+    list, so that they do not block the queue.
+    """
     redis_url = current_app.config.get('CACHE_REDIS_URL')
     r = StrictRedis.from_url(redis_url)
     lock = Lock(r, 'continuous_migration', expire=120, auto_renewal=True)
     if lock.acquire(blocking=False):
+        totals = Counter()
+        start = time.time()
         try:
-            while r.llen('legacy_records'):
-                raw_record = r.lrange('legacy_records', 0, 0)
-                if raw_record:
-                    migrate_and_insert_record(zlib.decompress(raw_record[0]))
-                    db.session.commit()
-                r.lpop('legacy_records')
+            while True:
+                pipeline = r.pipeline(transaction=False)
+                pipeline.llen('legacy_records')
+                pipeline.lrange('legacy_records', 0, batch_size - 1)
+                queue_depth, raw_records = pipeline.execute()
+                if not raw_records:
+                    break
+
+                stats = _migrate_legacy_batch(r, raw_records)
+                r.ltrim('legacy_records', len(raw_records), -1)
+
+                totals.update(stats)
+                drain_rate = totals['records'] / (time.time() - start)
+                r.hmset('legacy_records:stats', {
+                    'queue_depth': queue_depth - len(raw_records),
+                    'drain_rate': drain_rate,
+                    'last_batch_size': len(raw_records),
+                    'last_batch_at': time.time(),
+                })
+                logger.info(
+                    'Continuous migration: {records} records processed '
+                    '({drain_rate:.1f} rec/s), {queue_depth} left in the '
+                    'queue.'.format(
+                        records=totals['records'],
+                        drain_rate=drain_rate,
+                        queue_depth=queue_depth - len(raw_records),
+                    ))
         finally:
             lock.release()
+            logger.info(
+                'Continuous migration: {created} created, {updated} updated, '
+                '{skipped} skipped, {failed} failed.'.format(
+                    created=totals['created'],
+                    updated=totals['updated'],
+                    skipped=totals['skipped'],
+                    failed=totals['failed'],
+                ))
     else:
         logger.info("Continuous_migration already executed. Skipping.")
 
 
-def create_index_op(record):
-    index, doc_type = current_record_to_index(record)
+def _migrate_legacy_batch(r, raw_records):
+    """Migrate a batch of the queue, setting aside the records that make it fail."""
+    try:
+        return migrate_chunk([zlib.decompress(raw_record) for raw_record in raw_records])
+    except Exception:
+        db.session.rollback()
+        logger.exception(
+            'Continuous migration: cannot migrate a batch of {} records, '
+            'migrating them one by one.'.format(len(raw_records)))
 
-    return {
-        '_op_type': 'index',
-        '_index': index,
-        '_type': doc_type,
-        '_id': str(record.id),
-        '_version': record.revision_id,
-        '_version_type': 'external_gte',
-        '_source': RecordIndexer._prepare_record(record, index, doc_type),
-    }
+    stats = Counter()
+    for raw_record in raw_records:
+        try:
+            stats.update(migrate_chunk([zlib.decompress(raw_record)]))
+        except Exception:
+            db.session.rollback()
+            logger.exception(
+                'Continuous migration: cannot migrate a record, moving it '
+                'to legacy_records:errors.')
+            r.rpush('legacy_records:errors', raw_record)
+            stats.update(records=1, failed=1)
+
+    return stats
+
+
+def create_index_op(record):
+    return get_index_action(record)
 
 
 @shared_task(ignore_result=False, compress='zlib', acks_late=True)
-def migrate_chunk(chunk):
-    models_committed.disconnect(index_after_commit)
+def migrate_chunk(chunk, force=False):
+    """Migrate a chunk of MARCXML records.
 
+    Records whose MARCXML did not change since they were last migrated
+    successfully are skipped, unless ``force`` is ``True``.
+    """
     index_queue = []
+    stats = Counter()
+    timer = StageTimer()
+    name_cache_stats = get_name_cache_stats()
+    pid_cache_stats = get_pid_cache_stats()
 
+    # The chunk is indexed and its citation counts are updated in bulk.
+    models_committed.disconnect(index_after_commit)
+    before_record_update.disconnect(snapshot_cited_recids)
+    before_models_committed.disconnect(update_citation_counts_before_commit)
     try:
-        for raw_record in chunk:
+        with timer.activate():
+            digests = _migrate_chunk(chunk, force, index_queue, stats)
+
+            with timed_stage('index'):
+                req_timeout = current_app.config['INDEXER_BULK_REQUEST_TIMEOUT']
+                stats['indexed'], errors = es_bulk(
+                    es,
+                    index_queue,
+                    raise_on_error=False,
+                    request_timeout=req_timeout,
+                )
+                stats['index_failed'] = len(errors)
+
+            failed_uuids = set()
+            for error in errors:
+                op_type, item = next(iteritems(error))
+                logger.warning('Cannot %s record %s in ES: %s',
+                               op_type, item.get('_id'), item.get('error'))
+                failed_uuids.add(item.get('_id'))
+            with timed_stage('save_digest'):
+                save_marcxml_digests([
+                    digest for uuid, digest in digests.items()
+                    if uuid not in failed_uuids
+                ])
+    finally:
+        models_committed.connect(index_after_commit)
+        before_record_update.connect(snapshot_cited_recids)
+        before_models_committed.connect(update_citation_counts_before_commit)
+
+    stats.update(timer.as_stats())
+    for key, value in get_name_cache_stats().items():
+        if key in ('hits', 'misses'):
+            stats['name_cache_' + key] = value - name_cache_stats[key]
+    for key, value in get_pid_cache_stats().items():
+        stats['pid_cache_' + key] = value - pid_cache_stats.get(key, 0)
+    logger.info('Migrated chunk: {}'.format(', '.join(
+        '{} {:.3f}s/{}'.format(stage, stage_time, count)
+        for stage, stage_time, count in get_stage_stats(stats)
+    )))
+    record_migration_stats(stats)
+
+    return dict(stats)
+
+
+def _migrate_chunk(chunk, force, index_queue, stats):
+    """Migrate a chunk of MARCXML records, and prepare their index actions.
+
+    Returns:
+        dict: the recid and the MARCXML digest of each migrated record,
+            keyed by record UUID, to be saved once it is indexed.
+    """
+    digests = {}
+    try:
+        marc_records = [read_marc_record(raw_record) for raw_record in chunk]
+        stats['records'] = len(marc_records)
+        marc_records = [marc_record for marc_record in marc_records if marc_record]
+
+        if not force:
+            with timed_stage('skip_check'):
+                unchanged_recids = get_unchanged_recids(
+                    prod_record for prod_record, _ in marc_records)
+            changed_records = [
+                (prod_record, marc_record)
+                for prod_record, marc_record in marc_records
+                if prod_record.recid not in unchanged_recids
+            ]
+            stats['skipped'] = len(marc_records) - len(changed_records)
+            marc_records = changed_records
+
+        # The digests are only written by save_marcxml_digests, once the
+        # records are in ES, so that a chunk that failed is migrated again.
+        marcxml_digests = {}
+        for prod_record, _ in marc_records:
+            marcxml_digests[prod_record.recid] = prod_record.marcxml_digest
+            prod_record.marcxml_digest = None
+
+        migrated_records = [
+            migrate_record(prod_record, marc_record)
+            for prod_record, marc_record in marc_records
+        ]
+        with timed_stage('preload'):
+            preloaded_records = PreloadedRecords(
+                json_record for _, json_record, _ in migrated_records
+                if json_record
+            )
+        snapshots = {
+            record.id: get_cited_recids(record) for record in preloaded_records
+        }
+        records = []
+        for prod_record, json_record, error in migrated_records:
+            created = bool(json_record) and not preloaded_records.exists(json_record)
             with db.session.begin_nested():
-                record = migrate_and_insert_record(raw_record)
+                record = insert_migrated_record(
+                    prod_record, json_record, error, preloaded_records)
+                with timed_stage('flush'):
+                    db.session.flush()
                 if record:
-                    index_queue.append(create_index_op(record))
+                    stats['created' if created else 'updated'] += 1
+                    records.append(record)
+                    digests[str(record.id)] = (
+                        prod_record.recid, marcxml_digests[prod_record.recid])
+        with timed_stage('citation_counts'):
+            deltas = update_citation_counts(records, snapshots)
+        with timed_stage('prepare_index'), prefetched_citation_counts(records):
+            index_queue.extend(create_index_op(record) for record in records)
+        with timed_stage('commit'):
+            db.session.commit()
+        if deltas:
+            # The counts of the records of the chunk are indexed with them.
+            with timed_stage('citation_counts'):
+                index_citation_counts(set(deltas).difference(
+                    record.get('control_number') for record in records))
+    finally:
+        db.session.close()
+    stats['migrated'] = len(index_queue)
+    stats['failed'] = stats['records'] - stats['migrated'] - stats['skipped']
+
+    return digests
+
+
+def save_marcxml_digests(digests):
+    """Mark some migrated records as unchanged until their MARCXML changes.
+
+    Args:
+        digests(list): the ``(recid, marcxml_digest)`` pairs of the records.
+    """
+    if not digests:
+        return
+
+    try:
+        db.session.bulk_update_mappings(InspireProdRecords, [
+            {'recid': recid, 'marcxml_digest': marcxml_digest}
+            for recid, marcxml_digest in digests
+        ])
         db.session.commit()
     finally:
         db.session.close()
 
-    req_timeout = current_app.config['INDEXER_BULK_REQUEST_TIMEOUT']
-    es_bulk(
-        es,
-        index_queue,
-        stats_only=True,
-        request_timeout=req_timeout,
-    )
 
-    models_committed.connect(index_after_commit)
+def update_citation_counts(records, snapshots):
+    """Update in the DB the citation counts of the records cited by a chunk.
+
+    The receivers doing it on every commit are disconnected while migrating
+    a chunk, as they would query the DB once per updated record.
+
+    Args:
+        records(list): the records inserted or updated by the chunk.
+        snapshots(dict): the recids cited by each updated record before the
+            chunk, keyed by record UUID.
+
+    Returns:
+        Counter: the change in the citation count of every affected recid.
+    """
+    if not current_app.config.get('RECORDS_INCREMENTAL_CITATION_COUNTS'):
+        return Counter()
+
+    # A record can appear more than once in a chunk.
+    models = {record.id: record.model for record in records}
+    deltas = get_citation_count_deltas([
+        (model, 'update' if uuid in snapshots else 'insert')
+        for uuid, model in models.items()
+    ], snapshots)
+    add_to_citation_counts(deltas)
+
+    return deltas
+
+
+def record_migration_stats(stats):
+    """Add the stats of a migrated chunk to the totals stored in Redis."""
+    redis_url = current_app.config.get('CACHE_REDIS_URL')
+    r = StrictRedis.from_url(redis_url)
+
+    pipeline = r.pipeline(transaction=False)
+    for key, value in stats.items():
+        pipeline.hincrbyfloat('migrator:stats', key, value)
+    pipeline.execute()
+
+
+def get_migration_stats():
+    """Return the totals of the stats of all the migrated chunks."""
+    redis_url = current_app.config.get('CACHE_REDIS_URL')
+    r = StrictRedis.from_url(redis_url)
+
+    return {
+        key: float(value)
+        for key, value in r.hgetall('migrator:stats').items()
+    }
+
+
+def reset_migration_stats():
+    redis_url = current_app.config.get('CACHE_REDIS_URL')
+    StrictRedis.from_url(redis_url).delete('migrator:stats')
+
+
+def _count_citations(records, counts=None):
+    """Count the citations of every recid in an array indexed by recid.
+
+    Every record is counted at most once per cited record, however many
+    times it cites it.
+    """
+    if counts is None:
+        counts = np.zeros(LARGE_CHUNK_SIZE, dtype=np.uint32)
+
+    for record in records:
+        refs_ids = np.unique(np.fromiter(
+            chain.from_iterable(map(
+                force_list, get_value(record, '_source.references.recid', []))),
+            dtype=np.int64,
+        ))
+        if not refs_ids.size:
+            continue
+
+        if refs_ids[-1] >= counts.size:
+            grown = np.zeros(max(refs_ids[-1] + 1, 2 * counts.size), dtype=counts.dtype)
+            grown[:counts.size] = counts
+            counts = grown
+
+        counts[refs_ids] += 1
+
+    return counts
 
 
 @shared_task()
-def add_citation_counts(chunk_size=500, request_timeout=120):
-    def _build_recid_to_uuid_map(citations_lookup):
-        pids = PersistentIdentifier.query.filter(
-            PersistentIdentifier.object_type == 'rec').yield_per(1000)
+def add_citation_counts(chunk_size=500, request_timeout=120, index=None):
+    """Compute the citation counts of all records and store them.
 
-        with click.progressbar(pids) as bar:
-            return {
-                pid.object_uuid: citations_lookup[int(pid.pid_value)]
-                for pid in bar if int(pid.pid_value) in citations_lookup
-            }
+    They replace the counts kept in the DB, from which the records read them
+    when they are indexed, and are also sent to ES. The counts are computed
+    from, and stored in, ``index`` if given, instead of the current
+    Literature index.
+    """
+    def _get_records_to_update_generator(counts):
+        pids = db.session.query(
+            PersistentIdentifier.pid_value,
+            PersistentIdentifier.object_uuid,
+        ).filter(
+            PersistentIdentifier.object_type == 'rec'
+        ).yield_per(1000)
 
-    def _get_records_to_update_generator(citations_lookup):
-        with click.progressbar(citations_lookup.iteritems()) as bar:
-            for uuid, citation_count in bar:
-                yield {
-                    '_op_type': 'update',
-                    '_index': index,
-                    '_type': doc_type,
-                    '_id': str(uuid),
-                    'doc': {'citation_count': citation_count}
-                }
+        with click.progressbar(pids) as bar:
+            for pid_value, object_uuid in bar:
+                recid = int(pid_value)
+                if recid < counts.size and counts[recid]:
+                    yield {
+                        '_op_type': 'update',
+                        '_index': index,
+                        '_type': doc_type,
+                        '_id': str(object_uuid),
+                        'doc': {'citation_count': int(counts[recid])}
+                    }
 
-    index, doc_type = schema_to_index('records/hep.json')
-    citations_lookup = Counter()
+    default_index, doc_type = schema_to_index('records/hep.json')
+    index = index or default_index
 
     click.echo('Extracting all citations...')
     with click.progressbar(es_scan(
@@ -249,30 +945,34 @@ def add_citation_counts(chunk_size=500, request_timeout=120):
             scroll=u'2m',
             index=index,
             doc_type=doc_type)) as records:
-        for record in records:
-            unique_refs_ids = dedupe_list(list(chain.from_iterable(map(
-                force_list, get_value(record, '_source.references.recid')))))
-
-            for unique_refs_id in unique_refs_ids:
-                citations_lookup[unique_refs_id] += 1
+        counts = _count_citations(records)
     click.echo('... DONE.')
 
-    click.echo('Mapping recids to UUIDs...')
-    citations_lookup = _build_recid_to_uuid_map(citations_lookup)
+    click.echo('Storing citation numbers...')
+    CitationCount.query.delete()
+    for recids in chunker(np.flatnonzero(counts), LARGE_CHUNK_SIZE):
+        db.session.bulk_insert_mappings(CitationCount, [
+            {'recid': int(recid), 'citation_count': int(counts[recid])}
+            for recid in recids
+        ])
+    db.session.commit()
     click.echo('... DONE.')
 
     click.echo('Adding citation numbers...')
-    success, failed = es_bulk(
-        es,
-        _get_records_to_update_generator(citations_lookup),
-        chunk_size=chunk_size,
-        raise_on_exception=False,
-        raise_on_error=False,
-        request_timeout=request_timeout,
-        stats_only=True,
-    )
+    with bulk_index_settings(index):
+        success, failed = es_bulk(
+            es,
+            _get_records_to_update_generator(counts),
+            chunk_size=chunk_size,
+            raise_on_exception=False,
+            raise_on_error=False,
+            request_timeout=request_timeout,
+            stats_only=True,
+        )
     click.echo('... DONE: {} records updated with success. {} failures.'.format(
         success, failed))
+    click.echo('Peak memory usage: {:.0f} MB.'.format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
 
 
 def create_record(record):
@@ -288,14 +988,88 @@ def create_record(record):
     return json
 
 
-def record_insert_or_replace(json):
-    """Insert or replace a record."""
+class PreloadedRecords(object):
+    """Records of a whole chunk that already exist in the DB.
+
+    They are resolved with one query for all the PIDs and one for all the
+    ``RecordMetadata`` rows, instead of two queries per record.
+    """
+
+    def __init__(self, json_records):
+        pids = set(filter(None, map(self._get_pid, json_records)))
+
+        self._uuids = {}
+        self._records = {}
+        if not pids:
+            return
+
+        query = PersistentIdentifier.query.filter(tuple_(
+            PersistentIdentifier.pid_type,
+            PersistentIdentifier.pid_value,
+        ).in_(pids))
+        for pid in query:
+            self._uuids[(pid.pid_type, pid.pid_value)] = pid.object_uuid
+
+        if not self._uuids:
+            return
+
+        query = RecordMetadata.query.filter(
+            RecordMetadata.id.in_(self._uuids.values()),
+            RecordMetadata.json != None,  # noqa: E711
+        )
+        for model in query:
+            self._records[model.id] = InspireRecord(model.json, model=model)
+
+    @staticmethod
+    def _get_pid(json):
+        control_number = json.get('control_number', json.get('recid'))
+        if control_number and '$schema' in json:
+            return get_pid_type_from_schema(json['$schema']), str(control_number)
+
+    def __iter__(self):
+        """Iterate over the records preloaded so far."""
+        return iter(self._records.values())
+
+    def exists(self, json):
+        """Whether the given record already exists."""
+        return self._get_pid(json) in self._uuids
+
+    def get(self, pid_type, pid_value):
+        """Get a preloaded record.
+
+        Raises:
+            PIDDoesNotExistError: if the record does not exist yet.
+        """
+        try:
+            object_uuid = self._uuids[(pid_type, str(pid_value))]
+        except KeyError:
+            raise PIDDoesNotExistError(pid_type, pid_value)
+
+        if object_uuid in self._records:
+            return self._records[object_uuid]
+        return InspireRecord.get_record(object_uuid)
+
+    def add(self, pid_type, pid_value, record):
+        """Add a record created while processing the chunk."""
+        self._uuids[(pid_type, str(pid_value))] = record.id
+        self._records[record.id] = record
+
+
+def record_insert_or_replace(json, preloaded_records=None):
+    """Insert or replace a record.
+
+    If ``preloaded_records`` is passed, the existing record is looked up
+    there instead of querying the DB.
+    """
     control_number = json.get('control_number', json.get('recid'))
     if control_number:
         pid_type = get_pid_type_from_schema(json['$schema'])
         try:
-            pid = PersistentIdentifier.get(pid_type, control_number)
-            record = InspireRecord.get_record(pid.object_uuid)
+            if preloaded_records is None:
+                pid = PersistentIdentifier.get(pid_type, control_number)
+                record = InspireRecord.get_record(pid.object_uuid)
+            else:
+                record = preloaded_records.get(pid_type, control_number)
             record.clear()
             record.update(json)
             record.commit()
@@ -303,6 +1077,8 @@ def record_insert_or_replace(json):
             record = InspireRecord.create(json, id_=None)
             # Create persistent identifier.
             inspire_recid_minter(str(record.id), json)
+            if preloaded_records is not None:
+                preloaded_records.add(pid_type, control_number, record)
 
         if json.get('deleted'):
             new_recid = get_recid_from_ref(json.get('new_record'))
@@ -312,28 +1088,67 @@ def record_insert_or_replace(json):
         return record
 
 
-def migrate_and_insert_record(raw_record):
-    """Convert a marc21 record to JSON and insert it into the DB."""
+def read_marc_record(raw_record):
+    """Read a marc21 record.
+
+    ``raw_record`` can either be the MARCXML of the record or an already
+    parsed ``<record>`` element, as yielded by :func:`iterparse_stream`, in
+    which case it is not parsed a second time.
+
+    Returns:
+        tuple: the ``InspireProdRecords`` row of the record and the record
+            itself, or ``None`` if the MARCXML could not be read.
+    """
+    if etree.iselement(raw_record):
+        element, raw_record = raw_record, etree.tostring(
+            raw_record, encoding='utf8', xml_declaration=False)
+    else:
+        element = raw_record
+
     try:
-        record = marc_create_record(raw_record, keep_singletons=False)
-    except Exception as e:
+        with timed_stage('marc'):
+            record = marc_create_record(element, keep_singletons=False)
+    except Exception:
         logger.exception('Migrator MARC 21 read Error')
         return None
 
     recid = int(record['001'])
     prod_record = InspireProdRecords(recid=recid)
     prod_record.marcxml = raw_record
+    with timed_stage('digest'):
+        prod_record.marcxml_digest = get_marcxml_digest(raw_record)
+
+    return prod_record, record
+
+
+def migrate_record(prod_record, record):
+    """Convert a marc21 record to JSON.
+
+    Returns:
+        tuple: the ``InspireProdRecords`` row of the record, its JSON and
+            the conversion error, if any.
+    """
+    json_record = None
     error = None
 
     try:
-        json_record = create_record(record)
+        with timed_stage('dojson'):
+            json_record = create_record(record)
     except Exception as e:
         logger.exception('Migrator DoJSON Error')
         error = e
 
+    return prod_record, json_record, error
+
+
+def insert_migrated_record(prod_record, json_record, error, preloaded_records=None):
+    """Insert a record converted by :func:`migrate_record` into the DB."""
+    recid = prod_record.recid
+
     try:
         if not error:
-            record = record_insert_or_replace(json_record)
+            with timed_stage('insert'):
+                record = record_insert_or_replace(json_record, preloaded_records)
     except ValidationError as e:
         # Aggregate logs by part of schema being validated.
         pattern = u'Migrator Validator Error: {}, Value: %r, Record: %r'
@@ -347,7 +1162,7 @@ def migrate_and_insert_record(raw_record):
 
     if error:
         # Invalid record, will not get indexed.
-        error_str = u'{0}: Record {1}: {2}'.format(type(error), recid, e)
+        error_str = u'{0}: Record {1}: {2}'.format(type(error), recid, error)
         prod_record.valid = False
         prod_record.errors = error_str
         db.session.merge(prod_record)
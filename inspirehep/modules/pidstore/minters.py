@@ -24,6 +24,8 @@
 
 from __future__ import absolute_import, division, print_function
 
+from inspirehep.utils.record_getter import invalidate_pid_cache
+
 from .providers import InspireRecordIdProvider
 from .utils import get_pid_type_from_schema
 
@@ -40,4 +42,5 @@ def inspire_recid_minter(record_uuid, data):
         args['pid_value'] = data['control_number']
     provider = InspireRecordIdProvider.create(**args)
     data['control_number'] = provider.pid.pid_value
+    invalidate_pid_cache(provider.pid.pid_type, provider.pid.pid_value, record_uuid)
     return provider.pid
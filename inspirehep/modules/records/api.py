@@ -33,17 +33,19 @@ from flask import current_app
 
 from inspire_schemas.api import validate
 from inspire_schemas.builders import LiteratureBuilder
-from invenio_files_rest.models import Bucket
+from invenio_files_rest.models import Bucket, FileInstance, ObjectVersion
 from invenio_pidstore.errors import PIDDoesNotExistError
 from invenio_pidstore.models import PersistentIdentifier
 from invenio_records_files.api import Record
 from invenio_db import db
 
-from inspirehep.modules.records.utils import open_url_or_path
+from inspirehep.modules.records.utils import download_files
 from inspirehep.utils.record_getter import (
     RecordGetterError,
-    get_es_record_by_uuid
+    get_es_record_by_uuid,
+    invalidate_pid_cache,
 )
+from inspirehep.utils.timers import timed
 
 
 MAX_UNIQUE_KEY_COUNT = 50000
@@ -135,6 +137,7 @@ class InspireRecord(Record):
             for pid in pids_deleted:
                 pid.redirect(pid_merged)
                 db.session.add(pid)
+                invalidate_pid_cache(pid.pid_type, pid.pid_value, self.id)
 
     def delete(self):
         """Mark as deleted all pidstores for a specific record."""
@@ -145,6 +148,7 @@ class InspireRecord(Record):
             for pid in pids:
                 pid.delete()
                 db.session.add(pid)
+                invalidate_pid_cache(pid.pid_type, pid.pid_value, self.id)
 
         self['deleted'] = True
         self.commit()
@@ -169,6 +173,7 @@ class InspireRecord(Record):
         )
         return bucket
 
+    @timed('validation')
     def validate(self):
         """Validate the record, also ensuring format compliance."""
         validate(self)
@@ -347,24 +352,12 @@ class InspireRecord(Record):
             doc_or_fig_obj,
         )
 
-    def _download_to_docs_or_figs(
+    def _add_downloaded_doc_or_fig(
         self,
-        document=None,
-        figure=None,
-        src_records=(),
-        only_new=False,
+        doc_or_fig_obj,
+        downloads,
+        is_document=True,
     ):
-        if not document and not figure:
-            raise TypeError(
-                'No document nor figure passed, at least one is needed.'
-            )
-
-        is_document = bool(document)
-        doc_or_fig_obj = self._resolve_doc_or_fig_url(
-            doc_or_fig_obj=document or figure,
-            src_records=src_records,
-            only_new=only_new,
-        )
         if doc_or_fig_obj['url'].startswith('/api/files/'):
             return self.add_document_or_figure(
                 metadata=doc_or_fig_obj,
@@ -376,14 +369,35 @@ class InspireRecord(Record):
         if key not in self.files:
             key = self._get_unique_files_key(base_file_name=key)
 
-        stream = open_url_or_path(doc_or_fig_obj['url'])
+        self._add_file(key, *downloads[doc_or_fig_obj['url']])
         return self.add_document_or_figure(
             metadata=doc_or_fig_obj,
             key=key,
-            stream=stream,
             is_document=is_document,
         )
 
+    def _add_file(self, key, stream, checksum, size):
+        """Store a file under ``key``, reusing an identical stored file if any."""
+        files = self.files
+        file_instance = FileInstance.query.filter_by(
+            checksum=checksum,
+            size=size,
+            readable=True,
+        ).first()
+        if file_instance is None:
+            stream.seek(0)
+            files[key] = stream
+            return
+
+        with db.session.begin_nested():
+            obj = ObjectVersion.create(
+                bucket=files.bucket,
+                key=key,
+                _file_id=file_instance,
+            )
+            files.filesmap[key] = files.file_cls(obj, {}).dumps()
+            files.flush()
+
     def download_documents_and_figures(self, only_new=False, src_records=()):
         """Gets all the documents and figures of the record, and downloads them
         to the files property.
@@ -434,6 +448,11 @@ class InspireRecord(Record):
         * if `url` field does not point to the files api: it will try to
           download the new file.
 
+        The files are downloaded concurrently, by at most
+        ``RECORDS_DOWNLOAD_WORKERS`` threads, before being added to the record
+        in order. A file whose contents are already stored, for example the
+        same plot in another version of the record, reuses the stored copy.
+
         Args:
             only_new(bool): If True, will not re-download any files if the
                 document['key'] matches an existing downloaded file.
@@ -444,22 +463,46 @@ class InspireRecord(Record):
         if 'control_number' not in self:
             return
 
-        documents_to_download = self.pop('documents', [])
-        figures_to_download = self.pop('figures', [])
-
-        for document in documents_to_download:
-            self._download_to_docs_or_figs(
-                document=document,
+        documents = [
+            self._resolve_doc_or_fig_url(
+                doc_or_fig_obj=document,
                 src_records=src_records,
                 only_new=only_new,
-            )
-
-        for figure in figures_to_download:
-            self._download_to_docs_or_figs(
-                figure=figure,
+            ) for document in self.pop('documents', [])
+        ]
+        figures = [
+            self._resolve_doc_or_fig_url(
+                doc_or_fig_obj=figure,
                 src_records=src_records,
                 only_new=only_new,
-            )
+            ) for figure in self.pop('figures', [])
+        ]
+
+        downloads = download_files(
+            (
+                doc_or_fig_obj['url']
+                for doc_or_fig_obj in documents + figures
+                if not doc_or_fig_obj['url'].startswith('/api/files/')
+            ),
+            workers=current_app.config['RECORDS_DOWNLOAD_WORKERS'],
+        )
+        try:
+            for document in documents:
+                self._add_downloaded_doc_or_fig(
+                    doc_or_fig_obj=document,
+                    downloads=downloads,
+                    is_document=True,
+                )
+
+            for figure in figures:
+                self._add_downloaded_doc_or_fig(
+                    doc_or_fig_obj=figure,
+                    downloads=downloads,
+                    is_document=False,
+                )
+        finally:
+            for stream, _, _ in downloads.values():
+                stream.close()
 
     def _get_unique_files_key(self, base_file_name):
         def _strip_old_control_number(base_name):
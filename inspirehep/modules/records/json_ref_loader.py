@@ -25,9 +25,11 @@
 from __future__ import absolute_import, division, print_function
 
 import re
+from collections import defaultdict
 
-from flask import current_app, url_for
+from flask import current_app, g, has_request_context, url_for
 from jsonref import JsonLoader, JsonRef
+from six import iteritems, string_types
 from werkzeug.urls import url_parse
 
 import jsonresolver
@@ -50,13 +52,7 @@ class AbstractRecordLoader(JsonLoader):
 
     def get_remote_json(self, uri, **kwargs):
         parsed_uri = url_parse(uri)
-        # Add http:// protocol so uri.netloc is correctly parsed.
-        server_name = current_app.config.get('SERVER_NAME')
-        if not re.match('^https?://', server_name):
-            server_name = 'http://{}'.format(server_name)
-        parsed_server = url_parse(server_name)
-
-        if parsed_uri.netloc and parsed_uri.netloc != parsed_server.netloc:
+        if not self._is_local(parsed_uri):
             return super(AbstractRecordLoader, self).get_remote_json(uri,
                                                                      **kwargs)
         path_parts = parsed_uri.path.strip('/').split('/')
@@ -70,15 +66,69 @@ class AbstractRecordLoader(JsonLoader):
         res = self.get_record(pid_type, recid)
         return res
 
+    def _is_local(self, parsed_uri):
+        # Add http:// protocol so uri.netloc is correctly parsed.
+        server_name = current_app.config.get('SERVER_NAME')
+        if not re.match('^https?://', server_name):
+            server_name = 'http://{}'.format(server_name)
+        parsed_server = url_parse(server_name)
+
+        return not parsed_uri.netloc or parsed_uri.netloc == parsed_server.netloc
+
 
 class ESJsonLoader(AbstractRecordLoader):
-    """Resolve resources by retrieving them from Elasticsearch."""
+    """Resolve resources by retrieving them from Elasticsearch.
+
+    Records are memoized in ``resolved``, keyed by PID type and value, and
+    can be fetched in batch beforehand with :meth:`prefetch`.
+    """
+
+    def __init__(self, resolved=None, **kwargs):
+        super(ESJsonLoader, self).__init__(**kwargs)
+        self.resolved = {} if resolved is None else resolved
 
     def get_record(self, pid_type, recid):
-        try:
-            return record_getter.get_es_record(pid_type, recid)
-        except record_getter.RecordGetterError:
-            return None
+        key = (pid_type, str(recid))
+        if key not in self.resolved:
+            try:
+                self.resolved[key] = record_getter.get_es_record(pid_type, recid)
+            except record_getter.RecordGetterError:
+                self.resolved[key] = None
+        return self.resolved[key]
+
+    def prefetch(self, obj):
+        """Fetch all the local records referenced in ``obj`` at once.
+
+        The records are fetched with one ``mget`` per PID type. The ones
+        that this does not return, or all of them if it fails, are left
+        to be fetched one by one by :meth:`get_record` when needed.
+        """
+        recids_by_pid_type = defaultdict(set)
+        for uri in _iter_ref_uris(obj):
+            parsed_uri = url_parse(uri)
+            path_parts = parsed_uri.path.strip('/').split('/')
+            if not self._is_local(parsed_uri) or len(path_parts) < 2:
+                continue
+
+            try:
+                pid_type = get_pid_type_from_endpoint(path_parts[-2])
+            except KeyError:
+                continue
+            if (pid_type, path_parts[-1]) not in self.resolved:
+                recids_by_pid_type[pid_type].add(path_parts[-1])
+
+        for pid_type, recids in iteritems(recids_by_pid_type):
+            try:
+                records = record_getter.get_es_records(pid_type, recids)
+            except Exception:
+                current_app.logger.exception(
+                    'Cannot prefetch %s records %s', pid_type, sorted(recids))
+                continue
+
+            for record in records:
+                recid = str(record.get('control_number'))
+                if recid in recids:
+                    self.resolved[pid_type, recid] = record
 
 
 class DatabaseJsonLoader(AbstractRecordLoader):
@@ -90,7 +140,6 @@ class DatabaseJsonLoader(AbstractRecordLoader):
             return None
 
 
-es_record_loader = ESJsonLoader()
 db_record_loader = DatabaseJsonLoader()
 SCHEMA_LOADER_CLS = json_loader_factory(
     jsonresolver.JSONResolver(
@@ -127,6 +176,11 @@ def replace_refs(obj, source='db'):
     Any reference URI that comes from the same server and references a resource
     will be resolved directly either from the database or from Elasticsearch.
 
+    When resolving from Elasticsearch, all the references in ``obj`` are
+    fetched at once, and the records are memoized until the end of the
+    current request. To benefit from that, resolve the references of many
+    objects by passing them together in a list.
+
     :param obj:
         Dict-like object for which '$ref' fields are recursively replaced.
     :param source:
@@ -139,13 +193,39 @@ def replace_refs(obj, source='db'):
         The same obj structure with the '$ref' fields replaced with the object
         available at the given URI.
     """
+    if source == 'es':
+        loader = ESJsonLoader(resolved=_get_request_resolved_refs())
+        loader.prefetch(obj)
+        return JsonRef.replace_refs(obj, loader=loader, load_on_repr=False)
+
     loaders = {
         'db': db_record_loader,
-        'es': es_record_loader,
         'http': None
     }
     if source not in loaders:
-        raise ValueError('source must be one of {}'.format(loaders.keys()))
+        raise ValueError('source must be one of {}'.format(['es'] + list(loaders.keys())))
 
     loader = loaders[source]
     return JsonRef.replace_refs(obj, loader=loader, load_on_repr=False)
+
+
+def _get_request_resolved_refs():
+    if not has_request_context():
+        return None
+    if 'resolved_refs' not in g:
+        g.resolved_refs = {}
+    return g.resolved_refs
+
+
+def _iter_ref_uris(obj):
+    if isinstance(obj, dict):
+        if isinstance(obj.get('$ref'), string_types):
+            yield obj['$ref']
+            return
+        obj = obj.values()
+    elif not isinstance(obj, list):
+        return
+
+    for value in obj:
+        for uri in _iter_ref_uris(value):
+            yield uri
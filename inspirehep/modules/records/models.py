@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Models for Records."""
+
+from __future__ import absolute_import, division, print_function
+
+from six import iteritems
+from sqlalchemy.dialects.postgresql import insert
+
+from invenio_db import db
+
+
+class CitationCount(db.Model):
+    """Number of Literature records citing each Literature record."""
+
+    __tablename__ = 'records_citation_count'
+
+    recid = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    citation_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+def get_citation_counts(recids):
+    """Return the citation counts of some Literature records.
+
+    Returns:
+        dict: the citation count of each recid, 0 for those never cited.
+    """
+    counts = dict.fromkeys(recids, 0)
+    if counts:
+        counts.update(db.session.query(
+            CitationCount.recid,
+            CitationCount.citation_count,
+        ).filter(CitationCount.recid.in_(list(counts))))
+
+    return counts
+
+
+def add_to_citation_counts(deltas):
+    """Increment or decrement the citation counts of some Literature records.
+
+    Args:
+        deltas(dict): the change in the citation count of each recid.
+    """
+    if not deltas:
+        return
+
+    statement = insert(CitationCount.__table__).values([
+        {'recid': recid, 'citation_count': delta}
+        for recid, delta in iteritems(deltas)
+    ])
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[CitationCount.recid],
+        set_={
+            'citation_count':
+                CitationCount.__table__.c.citation_count + statement.excluded.citation_count,
+        },
+    ))
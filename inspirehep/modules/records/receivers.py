@@ -25,20 +25,26 @@
 from __future__ import absolute_import, division, print_function
 
 import uuid
+from collections import Counter
 from itertools import chain
 
 import six
+from elasticsearch.helpers import bulk as es_bulk
 from flask import current_app
-from flask_sqlalchemy import models_committed
+from flask_sqlalchemy import before_models_committed, models_committed
 
-from invenio_indexer.api import RecordIndexer
+from invenio_db import db
 from invenio_indexer.signals import before_record_index
 from invenio_records.api import Record
 from invenio_records.models import RecordMetadata
+from invenio_pidstore.models import PersistentIdentifier
 from invenio_records.signals import (
     before_record_insert,
     before_record_update,
 )
+from invenio_search import current_search_client as es
+from invenio_search.utils import schema_to_index
+from sqlalchemy import event
 
 from inspire_dojson.utils import get_recid_from_ref
 from inspire_utils.date import earliest_date
@@ -46,6 +52,21 @@ from inspire_utils.helpers import force_list
 from inspire_utils.name import generate_name_variations
 from inspire_utils.record import get_value
 from inspirehep.modules.authors.utils import phonetic_blocks
+from inspirehep.modules.records.models import (
+    add_to_citation_counts,
+    get_citation_counts,
+)
+from inspirehep.modules.records.tasks import enqueue_records_to_index
+from inspirehep.modules.records.utils import (
+    get_citation_count,
+    get_delete_action,
+    get_index_action,
+    get_ref_paths,
+    index_records_in_bulk,
+    prefetched_citation_counts,
+)
+from inspirehep.modules.records.wrappers import LiteratureRecord
+from inspirehep.utils.timers import timed
 
 
 #
@@ -54,6 +75,7 @@ from inspirehep.modules.authors.utils import phonetic_blocks
 
 @before_record_insert.connect
 @before_record_update.connect
+@timed('receivers')
 def assign_phonetic_block(sender, record, *args, **kwargs):
     """Assign a phonetic block to each signature of a Literature record.
 
@@ -87,6 +109,7 @@ def assign_phonetic_block(sender, record, *args, **kwargs):
 
 @before_record_insert.connect
 @before_record_update.connect
+@timed('receivers')
 def assign_uuid(sender, record, *args, **kwargs):
     """Assign a UUID to each signature of a Literature record."""
     if 'hep.json' not in record.get('$schema'):
@@ -99,6 +122,64 @@ def assign_uuid(sender, record, *args, **kwargs):
             author['uuid'] = str(uuid.uuid4())
 
 
+@before_record_update.connect
+def snapshot_cited_recids(sender, record, *args, **kwargs):
+    """Remember which records a Literature record cited before this transaction.
+
+    The snapshots are read from the DB, as the references might have been
+    changed in place, with a single query for all the records updated
+    before the next flush (see :func:`take_cited_recids_snapshots`). Only
+    the first one in a transaction is kept.
+    """
+    if 'hep.json' not in record.get('$schema'):
+        return
+
+    if not current_app.config.get('RECORDS_INCREMENTAL_CITATION_COUNTS'):
+        return
+
+    if record.id in db.session.info.get(CITED_RECIDS_SNAPSHOTS, {}):
+        return
+
+    db.session.info.setdefault(CITED_RECIDS_TO_SNAPSHOT, set()).add(record.id)
+
+
+@event.listens_for(db.session, 'before_flush')
+def take_cited_recids_snapshots(session, *args):
+    """Take the snapshots of all the records updated since the last flush."""
+    uuids = session.info.pop(CITED_RECIDS_TO_SNAPSHOT, None)
+    if not uuids:
+        return
+
+    with session.no_autoflush:
+        old_jsons = session.query(
+            RecordMetadata.id,
+            RecordMetadata.json['$schema'],
+            RecordMetadata.json['deleted'],
+            RecordMetadata.json['references'],
+        ).filter(RecordMetadata.id.in_(uuids)).all()
+
+    snapshots = session.info.setdefault(CITED_RECIDS_SNAPSHOTS, {})
+    for uuid_, schema, deleted, references in old_jsons:
+        snapshots.setdefault(uuid_, get_cited_recids({
+            '$schema': schema or '',
+            'deleted': deleted,
+            'references': references or [],
+        }))
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def clear_cited_recids_snapshots(session, previous_transaction):
+    """Forget the snapshots and pending counts of a rolled back transaction.
+
+    Rolling back a savepoint keeps them, as they still describe the records
+    before the enclosing transaction.
+    """
+    if previous_transaction.parent is None:
+        session.info.pop(CITED_RECIDS_TO_SNAPSHOT, None)
+        session.info.pop(CITED_RECIDS_SNAPSHOTS, None)
+        session.info.pop(CITATION_COUNTS_TO_INDEX, None)
+
+
 #
 # models_committed
 #
@@ -110,15 +191,165 @@ def index_after_commit(sender, changes):
     This cannot happen in an ``after_record_commit`` receiver from Invenio-Records
     because, despite the name, at that point we are not yet sure whether the record
     has been really committed to the DB.
+
+    All the records changed in the same commit are sent to ES in bulk, with
+    their revision as external version. Failures are logged per record.
+
+    If ``RECORDS_ASYNC_INDEXING`` is set, inserted and updated records are
+    only queued, and indexed later by
+    :func:`~inspirehep.modules.records.tasks.process_index_queue`.
+    """
+    records = [
+        (model_instance, change) for model_instance, change in changes
+        if isinstance(model_instance, RecordMetadata)
+    ]
+
+    if current_app.config.get('RECORDS_ASYNC_INDEXING'):
+        revisions = {
+            str(model_instance.id): model_instance.version_id - 1
+            for model_instance, change in records if change in ('insert', 'update')
+        }
+        if revisions:
+            enqueue_records_to_index(revisions)
+        records = [
+            (model_instance, change) for model_instance, change in records
+            if change not in ('insert', 'update')
+        ]
+
+    if not records:
+        return
+
+    records = [
+        (Record(model_instance.json, model_instance), change)
+        for model_instance, change in records
+    ]
+    with prefetched_citation_counts(
+            record for record, change in records if change in ('insert', 'update')):
+        actions = [
+            get_index_action(record) if change in ('insert', 'update') else get_delete_action(record)
+            for record, change in records
+        ]
+    index_records_in_bulk(actions)
+
+
+CITED_RECIDS_SNAPSHOTS = 'inspirehep_cited_recids_snapshots'
+CITED_RECIDS_TO_SNAPSHOT = 'inspirehep_cited_recids_to_snapshot'
+CITATION_COUNTS_TO_INDEX = 'inspirehep_citation_counts_to_index'
+
+
+def get_cited_recids(json):
+    """Return the recids of the records cited by a Literature record."""
+    if json is None or 'hep.json' not in json.get('$schema', ''):
+        return set()
+
+    if json.get('deleted'):
+        return set()
+
+    refs = force_list(get_value(json, 'references.record', default=[]))
+
+    return set(filter(None, (get_recid_from_ref(ref) for ref in refs)))
+
+
+def get_citation_count_deltas(changes, snapshots):
+    """Compute how the committed changes affect the citation counts.
+
+    Args:
+        changes(list): the ``(model_instance, change)`` pairs of a commit.
+        snapshots(dict): the recids cited by each updated record before
+            the commit, keyed by record UUID.
+
+    Returns:
+        Counter: the change in the citation count of every affected recid.
     """
-    indexer = RecordIndexer()
+    deltas = Counter()
 
     for model_instance, change in changes:
-        if isinstance(model_instance, RecordMetadata):
-            if change in ('insert', 'update'):
-                indexer.index(Record(model_instance.json, model_instance))
-            else:
-                indexer.delete(Record(model_instance.json, model_instance))
+        if not isinstance(model_instance, RecordMetadata):
+            continue
+
+        if change == 'insert':
+            old_recids = set()
+        elif model_instance.id in snapshots:
+            old_recids = snapshots[model_instance.id]
+        else:
+            continue
+
+        if change == 'delete':
+            new_recids = set()
+        else:
+            new_recids = get_cited_recids(model_instance.json)
+
+        deltas.update(new_recids - old_recids)
+        deltas.subtract(old_recids - new_recids)
+
+    return Counter({recid: delta for recid, delta in six.iteritems(deltas) if delta})
+
+
+@before_models_committed.connect
+def update_citation_counts_before_commit(sender, changes):
+    """Update in the DB the citation counts of the records cited in a commit.
+
+    Instead of recomputing them, the counts of the records whose citations
+    changed are incremented or decremented in the same transaction, and
+    sent to ES after the commit by
+    :func:`update_citation_counts_after_commit`.
+    """
+    # Records updated without being flushed since.
+    take_cited_recids_snapshots(db.session)
+    snapshots = db.session.info.pop(CITED_RECIDS_SNAPSHOTS, {})
+
+    if not current_app.config.get('RECORDS_INCREMENTAL_CITATION_COUNTS'):
+        return
+
+    deltas = get_citation_count_deltas(changes, snapshots)
+    if not deltas:
+        return
+
+    add_to_citation_counts(deltas)
+    db.session.info.setdefault(CITATION_COUNTS_TO_INDEX, set()).update(deltas)
+
+
+@models_committed.connect
+def update_citation_counts_after_commit(sender, changes):
+    """Update in ES the citation counts changed by a commit."""
+    recids = db.session.info.pop(CITATION_COUNTS_TO_INDEX, None)
+    if recids:
+        index_citation_counts(recids)
+
+
+def index_citation_counts(recids):
+    """Copy to ES the citation counts of some Literature records.
+
+    The counts are read from the DB, and sent as partial updates in a single
+    bulk request. Failures are logged.
+    """
+    counts = get_citation_counts(recids)
+    pids = PersistentIdentifier.query.filter(
+        PersistentIdentifier.pid_type == 'lit',
+        PersistentIdentifier.pid_value.in_([str(recid) for recid in counts]),
+    )
+    index, doc_type = schema_to_index('records/hep.json')
+
+    actions = [
+        {
+            '_op_type': 'update',
+            '_index': index,
+            '_type': doc_type,
+            '_id': str(pid.object_uuid),
+            '_retry_on_conflict': 3,
+            'doc': {'citation_count': counts[int(pid.pid_value)]},
+        } for pid in pids
+    ]
+
+    _, errors = es_bulk(
+        es,
+        actions,
+        raise_on_error=False,
+        raise_on_exception=False,
+        request_timeout=current_app.config['INDEXER_BULK_REQUEST_TIMEOUT'],
+    )
+    for error in errors:
+        current_app.logger.warning('Cannot update citation count: %s', error)
 
 
 #
@@ -129,6 +360,10 @@ def index_after_commit(sender, changes):
 def enhance_after_index(sender, json, *args, **kwargs):
     """Run all the receivers that enhance the record for ES in the right order.
 
+    The receivers that apply to the schema of the record are compiled in
+    a :class:`RecordEnhancer`, which produces the same result as running
+    them one after the other, but traverses the record only once.
+
     .. note::
 
        ``populate_recid_from_ref`` **MUST** come before ``populate_bookautocomplete``
@@ -136,15 +371,79 @@ def enhance_after_index(sender, json, *args, **kwargs):
        would be expanded to an incorrect ``payload_recid`` by the former.
 
     """
-    populate_recid_from_ref(sender, json, *args, **kwargs)
-    populate_bookautocomplete(sender, json, *args, **kwargs)
-    populate_abstract_source_suggest(sender, json, *args, **kwargs)
-    populate_affiliation_suggest(sender, json, *args, **kwargs)
-    populate_author_count(sender, json, *args, **kwargs)
-    populate_earliest_date(sender, json, *args, **kwargs)
-    populate_inspire_document_type(sender, json, *args, **kwargs)
-    populate_name_variations(sender, json, *args, **kwargs)
-    populate_title_suggest(sender, json, *args, **kwargs)
+    get_record_enhancer(json.get('$schema')).enhance(json)
+
+
+class RecordEnhancer(object):
+    """The receivers of ``enhance_after_index`` compiled for a schema.
+
+    The record is traversed once: only along the paths where the schema
+    allows JSON references, or entirely when the schema cannot be loaded.
+    The receivers that work on the items of a top-level list, like the
+    authors, are applied to each item right after it is traversed. The
+    others only read a few top-level fields, and are applied to the whole
+    record at the end, without checking its schema again.
+    """
+
+    def __init__(self, schema):
+        self.ref_tree = get_ref_tree(schema)
+        self.item_enhancers = {}
+        self.record_enhancers = []
+
+        if 'hep.json' in schema:
+            self.item_enhancers['abstracts'] = _populate_abstract_source_suggest
+            self.item_enhancers['authors'] = _populate_author_name_variations
+            self.record_enhancers.extend([
+                _populate_bookautocomplete,
+                _populate_author_count,
+                _populate_earliest_date,
+                _populate_inspire_document_type,
+                _populate_citation_count,
+                _populate_display,
+            ])
+        if 'institutions.json' in schema:
+            self.record_enhancers.append(_populate_affiliation_suggest)
+        if 'journals.json' in schema:
+            self.record_enhancers.append(_populate_title_suggest)
+
+        if self.ref_tree is not None:
+            self.top_level_keys = sorted(set(self.ref_tree) | set(self.item_enhancers))
+
+    def enhance(self, json):
+        if self.ref_tree is None:
+            _populate_recids(json, self.item_enhancers)
+        else:
+            for key in self.top_level_keys:
+                if key not in json:
+                    continue
+
+                value = json[key]
+                is_ref, children = self.ref_tree.get(key, (False, None))
+                if is_ref:
+                    _populate_recid(json, key, value)
+
+                enhance_item = self.item_enhancers.get(key)
+                if enhance_item and isinstance(value, list):
+                    for item in value:
+                        if children:
+                            _populate_recids_in_tree(item, children)
+                        enhance_item(item)
+                elif children:
+                    _populate_recids_in_tree(value, children)
+
+        for enhancer in self.record_enhancers:
+            enhancer(json)
+
+
+_record_enhancers = {}
+
+
+def get_record_enhancer(schema):
+    """Return the :class:`RecordEnhancer` of a schema."""
+    try:
+        return _record_enhancers[schema]
+    except KeyError:
+        return _record_enhancers.setdefault(schema, RecordEnhancer(schema))
 
 
 def populate_bookautocomplete(sender, json, *args, **kwargs):
@@ -152,6 +451,10 @@ def populate_bookautocomplete(sender, json, *args, **kwargs):
     if 'hep.json' not in json.get('$schema'):
         return
 
+    _populate_bookautocomplete(json)
+
+
+def _populate_bookautocomplete(json):
     if 'book' not in json.get('document_type', []):
         return
 
@@ -189,6 +492,10 @@ def populate_inspire_document_type(sender, json, *args, **kwargs):
     if 'hep.json' not in json.get('$schema'):
         return
 
+    _populate_inspire_document_type(json)
+
+
+def _populate_inspire_document_type(json):
     result = []
 
     result.extend(json.get('document_type', []))
@@ -199,6 +506,50 @@ def populate_inspire_document_type(sender, json, *args, **kwargs):
     json['facet_inspire_doc_type'] = result
 
 
+def populate_citation_count(sender, json, *args, **kwargs):
+    """Populate the ``citation_count`` field of Literature records.
+
+    The counts are kept in the DB, so that indexing a record again does not
+    reset it.
+    """
+    if 'hep.json' not in json.get('$schema'):
+        return
+
+    _populate_citation_count(json)
+
+
+def _populate_citation_count(json):
+    if not current_app.config.get('RECORDS_INCREMENTAL_CITATION_COUNTS'):
+        return
+
+    if 'control_number' in json:
+        json['citation_count'] = get_citation_count(json['control_number'])
+
+
+def populate_display(sender, json, *args, **kwargs):
+    """Populate the ``_display`` field of Literature records.
+
+    It holds the fields shown in the brief format of the search results,
+    so that they are not computed again for every hit of every search.
+    Only the fields that depend on the record alone are stored, the
+    conference information is added by the serializer.
+
+    .. note::
+
+       It **MUST** come after ``populate_earliest_date``, which populates
+       the field from which the displayed date is computed.
+
+    """
+    if 'hep.json' not in json.get('$schema'):
+        return
+
+    _populate_display(json)
+
+
+def _populate_display(json):
+    json['_display'] = LiteratureRecord(json).get_display_fields()
+
+
 def populate_recid_from_ref(sender, json, *args, **kwargs):
     """Extract recids from all JSON reference fields and add them to ES.
 
@@ -240,37 +591,132 @@ def populate_recid_from_ref(sender, json, *args, **kwargs):
             ],
         }
 
+    Only the paths at which the schema of the record allows references,
+    as returned by :func:`~inspirehep.modules.records.utils.get_ref_paths`,
+    are looked at: references elsewhere, which would not validate, do not
+    get a recid. The whole record is walked only if it has no schema, or if
+    the schema cannot be loaded.
+
     """
-    list_ref_fields_translations = {
-        'deleted_records': 'deleted_recids'
-    }
-
-    def _recursive_find_refs(json_root):
-        if isinstance(json_root, list):
-            items = enumerate(json_root)
-        elif isinstance(json_root, dict):
-            # Note that items have to be generated before altering the dict.
-            # In this case, iteritems might break during iteration.
-            items = json_root.items()
-        else:
-            items = []
-
-        for key, value in items:
-            if (isinstance(json_root, dict) and isinstance(value, dict) and
-                    '$ref' in value):
-                # Append '_recid' and remove 'record' from the key name.
-                key_basename = key.replace('record', '').rstrip('_')
-                new_key = '{}_recid'.format(key_basename).lstrip('_')
-                json_root[new_key] = get_recid_from_ref(value)
-            elif (isinstance(json_root, dict) and isinstance(value, list) and
-                    key in list_ref_fields_translations):
-                new_list = [get_recid_from_ref(v) for v in value]
-                new_key = list_ref_fields_translations[key]
-                json_root[new_key] = new_list
-            else:
-                _recursive_find_refs(value)
+    ref_tree = get_ref_tree(json['$schema']) if '$schema' in json else None
+    if ref_tree is None:
+        _populate_recids(json)
+    else:
+        _populate_recids_in_tree(json, ref_tree)
+
+
+LIST_REF_FIELDS_TRANSLATIONS = {
+    'deleted_records': 'deleted_recids',
+}
+
+_recid_keys = {}
+
+
+def _get_recid_key(key):
+    """Return the name of the sibling holding the recid of a reference."""
+    try:
+        return _recid_keys[key]
+    except KeyError:
+        # Append '_recid' and remove 'record' from the key name.
+        key_basename = key.replace('record', '').rstrip('_')
+        return _recid_keys.setdefault(key, '{}_recid'.format(key_basename).lstrip('_'))
+
+
+_ref_trees = {}
 
-    _recursive_find_refs(json)
+
+def get_ref_tree(schema):
+    """Return the paths of :func:`~inspirehep.modules.records.utils.get_ref_paths` as a tree.
+
+    Each node maps a key to an ``(is_ref, children)`` pair, where ``is_ref``
+    tells whether a JSON reference, or a list of them, can be found at that
+    key, and ``children`` is the node of the keys below it. It is ``None``
+    if the schema cannot be loaded.
+    """
+    try:
+        return _ref_trees[schema]
+    except KeyError:
+        pass
+
+    ref_paths = get_ref_paths(schema)
+    if ref_paths is None:
+        return _ref_trees.setdefault(schema, None)
+
+    tree = {}
+    for path in ref_paths:
+        node = tree
+        for key in path[:-1]:
+            node = node.setdefault(key, (False, {}))[1]
+        node[path[-1]] = (True, node.get(path[-1], (False, {}))[1])
+
+    return _ref_trees.setdefault(schema, tree)
+
+
+def _populate_recid(parent, key, value):
+    if isinstance(value, dict):
+        if '$ref' in value:
+            parent[_get_recid_key(key)] = get_recid_from_ref(value)
+    elif isinstance(value, list) and key in LIST_REF_FIELDS_TRANSLATIONS:
+        parent[LIST_REF_FIELDS_TRANSLATIONS[key]] = [get_recid_from_ref(v) for v in value]
+
+
+def _populate_recids_in_tree(json, ref_tree):
+    """Add the recids of the references found along ``ref_tree`` in ``json``.
+
+    Lists found along the way are traversed transparently.
+    """
+    if isinstance(json, list):
+        for el in json:
+            _populate_recids_in_tree(el, ref_tree)
+        return
+    if not isinstance(json, dict):
+        return
+
+    for key, (is_ref, children) in six.iteritems(ref_tree):
+        if key not in json:
+            continue
+        value = json[key]
+        if is_ref:
+            _populate_recid(json, key, value)
+        if children:
+            _populate_recids_in_tree(value, children)
+
+
+def _populate_recids(json_root, item_enhancers=None):
+    """Add the recids of the references found in ``json_root``.
+
+    If ``item_enhancers`` is given, the items of the lists it names are
+    passed to the corresponding function after being traversed.
+    """
+    if isinstance(json_root, list):
+        for value in json_root:
+            if isinstance(value, (dict, list)):
+                _populate_recids(value)
+        return
+
+    # Siblings are added after the iteration, which would break otherwise.
+    recids = []
+    for key, value in six.iteritems(json_root):
+        if isinstance(value, dict):
+            if '$ref' in value:
+                recids.append((_get_recid_key(key), get_recid_from_ref(value)))
+            else:
+                _populate_recids(value)
+        elif isinstance(value, list):
+            if key in LIST_REF_FIELDS_TRANSLATIONS:
+                recids.append((
+                    LIST_REF_FIELDS_TRANSLATIONS[key],
+                    [get_recid_from_ref(v) for v in value],
+                ))
+            elif item_enhancers and key in item_enhancers:
+                enhance_item = item_enhancers[key]
+                for item in value:
+                    if isinstance(item, (dict, list)):
+                        _populate_recids(item)
+                    enhance_item(item)
+            else:
+                _populate_recids(value)
+    json_root.update(recids)
 
 
 def populate_abstract_source_suggest(sender, json, *args, **kwargs):
@@ -281,14 +727,18 @@ def populate_abstract_source_suggest(sender, json, *args, **kwargs):
     abstracts = json.get('abstracts', [])
 
     for abstract in abstracts:
-        source = abstract.get('source')
-        if source:
-            abstract.update({
-                'abstract_source_suggest': {
-                    'input': source,
-                    'output': source,
-                },
-            })
+        _populate_abstract_source_suggest(abstract)
+
+
+def _populate_abstract_source_suggest(abstract):
+    source = abstract.get('source')
+    if source:
+        abstract.update({
+            'abstract_source_suggest': {
+                'input': source,
+                'output': source,
+            },
+        })
 
 
 def populate_title_suggest(sender, json, *args, **kwargs):
@@ -296,6 +746,10 @@ def populate_title_suggest(sender, json, *args, **kwargs):
     if 'journals.json' not in json.get('$schema'):
         return
 
+    _populate_title_suggest(json)
+
+
+def _populate_title_suggest(json):
     journal_title = get_value(json, 'journal_title.title', default='')
     short_title = json.get('short_title', '')
     title_variants = json.get('title_variants', [])
@@ -322,6 +776,10 @@ def populate_affiliation_suggest(sender, json, *args, **kwargs):
     if 'institutions.json' not in json.get('$schema'):
         return
 
+    _populate_affiliation_suggest(json)
+
+
+def _populate_affiliation_suggest(json):
     ICN = json.get('ICN', [])
     institution_acronyms = get_value(json, 'institution_hierarchy.acronym', default=[])
     institution_names = get_value(json, 'institution_hierarchy.name', default=[])
@@ -358,6 +816,10 @@ def populate_earliest_date(sender, json, *args, **kwargs):
     if 'hep.json' not in json.get('$schema'):
         return
 
+    _populate_earliest_date(json)
+
+
+def _populate_earliest_date(json):
     date_paths = [
         'preprint_date',
         'thesis_info.date',
@@ -384,20 +846,24 @@ def populate_name_variations(sender, json, *args, **kwargs):
     authors = json.get('authors', [])
 
     for author in authors:
-        full_name = author.get('full_name')
-        if full_name:
-            bais = [
-                el['value'] for el in author.get('ids', [])
-                if el['schema'] == 'INSPIRE BAI'
-            ]
-            name_variations = generate_name_variations(full_name)
-
-            author.update({'name_variations': name_variations})
-            author.update({'name_suggest': {
-                'input': name_variations,
-                'output': full_name,
-                'payload': {'bai': bais[0] if bais else None}
-            }})
+        _populate_author_name_variations(author)
+
+
+def _populate_author_name_variations(author):
+    full_name = author.get('full_name')
+    if full_name:
+        bais = [
+            el['value'] for el in author.get('ids', [])
+            if el['schema'] == 'INSPIRE BAI'
+        ]
+        name_variations = generate_name_variations(full_name)
+
+        author.update({'name_variations': name_variations})
+        author.update({'name_suggest': {
+            'input': name_variations,
+            'output': full_name,
+            'payload': {'bai': bais[0] if bais else None}
+        }})
 
 
 def populate_author_count(sender, json, *args, **kwargs):
@@ -405,6 +871,10 @@ def populate_author_count(sender, json, *args, **kwargs):
     if 'hep.json' not in json.get('$schema'):
         return
 
+    _populate_author_count(json)
+
+
+def _populate_author_count(json):
     authors = json.get('authors', [])
 
     authors_excluding_supervisors = [
@@ -24,10 +24,16 @@
 
 from __future__ import absolute_import, division, print_function
 
+import threading
+
 from invenio_records_rest.serializers.json import JSONSerializer
 
-from inspire_utils.date import format_date
-from inspirehep.modules.records.wrappers import LiteratureRecord
+from inspirehep.modules.records.wrappers import (
+    LiteratureRecord,
+    get_publication_info_references,
+)
+
+_search_context = threading.local()
 
 
 def process_es_hit(record):
@@ -41,27 +47,28 @@ def process_es_hit(record):
         record['authors'] = record['authors'][:10]
     if 'references' in record:
         del record['references']
+    record.pop('_display', None)
 
     return record
 
 
-def get_display_fields(record):
+def get_display_fields(record, references=None):
     """
     Add extra fields used for display by client application.
 
-    Jinja2 filters can be applied here to format certain fields.
+    They are read from the ``_display`` field computed at index time, or
+    computed on the fly for the records indexed before it existed. The
+    conference information is always computed here, using ``references``,
+    the conference and parent records already fetched, as returned by
+    ``get_publication_info_references``.
     """
-    display = {}
     record = LiteratureRecord(record)
-    if 'references' in record:
-        display['number_of_references'] = len(record['references'])
-    if 'earliest_date' in record:
-        display['date'] = format_date(record['earliest_date'])
+    if '_display' in record:
+        display = dict(record['_display'])
+    else:
+        display = record.get_display_fields()
     if 'publication_info' in record:
-        display['publication_info'] = record.publication_information
-        display['conference_info'] = record.conference_information
-    if 'authors' in record:
-        display['number_of_authors'] = len(record['authors'])
+        display['conference_info'] = record.get_conference_information(references)
     display['admin_tools'] = record.admin_tools
 
     return display
@@ -70,12 +77,29 @@ def get_display_fields(record):
 class LiteratureJSONBriefSerializer(JSONSerializer):
     """JSON brief format serializer."""
 
+    def serialize_search(self, pid_fetcher, search_result, links=None,
+                         item_links_factory=None):
+        """Serialize a search result.
+
+        The conference and parent records of all the hits are fetched at
+        once, instead of hit by hit, and used by ``preprocess_search_hit``.
+        """
+        _search_context.references = get_publication_info_references(
+            hit['_source'] for hit in search_result['hits']['hits'])
+        try:
+            return super(LiteratureJSONBriefSerializer, self).serialize_search(
+                pid_fetcher, search_result, links=links,
+                item_links_factory=item_links_factory)
+        finally:
+            del _search_context.references
+
     @staticmethod
     def preprocess_search_hit(pid, record_hit, links_factory=None):
         """Prepare a record hit from Elasticsearch for serialization."""
         links_factory = links_factory or (lambda x: dict())
+        references = getattr(_search_context, 'references', None)
         # Get extra display fields before the ES hit gets processed
-        display = get_display_fields(record_hit['_source'])
+        display = get_display_fields(record_hit['_source'], references)
         record = dict(
             pid=pid,
             metadata=process_es_hit(record_hit['_source']),
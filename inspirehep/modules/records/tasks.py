@@ -28,105 +28,357 @@ from celery import shared_task
 from celery.utils.log import get_task_logger
 from elasticsearch.helpers import scan
 from flask import current_app
+from redis import StrictRedis
 from six import iteritems
+from sqlalchemy import cast, literal, or_
+from sqlalchemy.dialects.postgresql import JSONB
 
 from invenio_db import db
 from invenio_pidstore.models import PersistentIdentifier
+from invenio_records.api import Record
+from invenio_records.models import RecordMetadata
 from invenio_search import current_search_client as es
 
 from inspire_dojson.utils import get_recid_from_ref
 from inspirehep.modules.records.api import InspireRecord
-from inspirehep.modules.records.utils import get_endpoint_from_record
+from inspirehep.modules.records.utils import (
+    get_endpoint_from_record,
+    get_index_action,
+    get_ref_paths,
+    index_records_in_bulk,
+    iter_values_at_path,
+    prefetched_citation_counts,
+)
 from inspirehep.utils.record_getter import get_db_record
 
 
 logger = get_task_logger(__name__)
 
+INDEX_QUEUE = 'records:index_queue'
+INDEX_QUEUE_SCHEDULED = 'records:index_queue:scheduled'
+INDEX_QUEUE_CHUNK_SIZE = 1000
+INDEX_QUEUE_BATCH_SIZE = 10000
+
+UPDATE_REFS_CHUNK_SIZE = 100
+UPDATE_REFS_PROGRESS = 'records:update_refs:{}'
+
+# Keep the highest revision queued for each record.
+ENQUEUE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if not current or tonumber(current) < tonumber(ARGV[2]) then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+"""
+
+# Remove the records that were not queued again at a later revision.
+DEQUEUE_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+"""
+
+
+def enqueue_records_to_index(revisions):
+    """Queue records to be indexed by :func:`process_index_queue`.
+
+    A record queued several times before the queue is processed is indexed
+    only once, at its latest revision.
+
+    Args:
+        revisions(dict): the revision of each record, keyed by record UUID.
+    """
+    redis_url = current_app.config.get('CACHE_REDIS_URL')
+    r = StrictRedis.from_url(redis_url)
+    enqueue = r.register_script(ENQUEUE_SCRIPT)
+
+    pipeline = r.pipeline(transaction=False)
+    for uuid, revision_id in iteritems(revisions):
+        enqueue(keys=[INDEX_QUEUE], args=[uuid, revision_id], client=pipeline)
+    pipeline.execute()
+
+    _schedule_index_queue(r)
+
+
+def _schedule_index_queue(r):
+    """Run :func:`process_index_queue` soon, unless a run is already due."""
+    window = current_app.config['RECORDS_ASYNC_INDEXING_WINDOW']
+    if r.set(INDEX_QUEUE_SCHEDULED, 1, ex=window * 10, nx=True):
+        process_index_queue.apply_async(countdown=window)
+
+
+def _is_retryable(item):
+    """Whether a failed bulk action might succeed if sent again."""
+    status = item.get('status')
+    return not isinstance(status, int) or status == 429 or status >= 500
+
 
 @shared_task(ignore_result=True)
-def update_refs(old_ref, new_ref):
+def process_index_queue():
+    """Index in bulk the records queued by :func:`enqueue_records_to_index`.
+
+    The current version of each record in the DB is indexed. Records that
+    were deleted meanwhile are skipped, as they are removed from ES when
+    they are deleted.
+
+    Records are removed from the queue only once they have been indexed,
+    and only if they were not queued again meanwhile. Those that failed
+    because of a transient error stay there and another run is scheduled.
+
+    About ``INDEX_QUEUE_BATCH_SIZE`` records are processed by each run,
+    which schedules another one if the queue holds more.
+    """
+    redis_url = current_app.config.get('CACHE_REDIS_URL')
+    r = StrictRedis.from_url(redis_url)
+
+    # Records queued from now on need another run of this task.
+    r.delete(INDEX_QUEUE_SCHEDULED)
+
+    # ``count`` is only a hint, but a large hash is scanned a few entries
+    # more or less at a time.
+    cursor, revisions = r.hscan(INDEX_QUEUE, count=INDEX_QUEUE_BATCH_SIZE)
+    uuids = list(revisions)
+
+    def _get_actions():
+        for i in range(0, len(uuids), INDEX_QUEUE_CHUNK_SIZE):
+            query = RecordMetadata.query.filter(
+                RecordMetadata.id.in_(uuids[i:i + INDEX_QUEUE_CHUNK_SIZE]))
+            records = [
+                Record(model_instance.json, model_instance)
+                for model_instance in query if model_instance.json is not None
+            ]
+            with prefetched_citation_counts(records):
+                actions = [get_index_action(record) for record in records]
+            for action in actions:
+                yield action
+
+    try:
+        indexed, failed = index_records_in_bulk(_get_actions())
+    except Exception:
+        _schedule_index_queue(r)
+        raise
+
+    retry = set(item.get('_id') for _, item in failed if _is_retryable(item))
+    done = [uuid for uuid in uuids if uuid not in retry]
+
+    dequeue = r.register_script(DEQUEUE_SCRIPT)
+    pipeline = r.pipeline(transaction=False)
+    for i in range(0, len(done), INDEX_QUEUE_CHUNK_SIZE):
+        args = []
+        for uuid in done[i:i + INDEX_QUEUE_CHUNK_SIZE]:
+            args.extend([uuid, revisions[uuid]])
+        dequeue(keys=[INDEX_QUEUE], args=args, client=pipeline)
+    pipeline.execute()
+
+    if retry or cursor:
+        _schedule_index_queue(r)
+
+    logger.info('Indexed %s of %s queued records, %s will be retried%s',
+                indexed, len(uuids), len(retry), ', more are queued' if cursor else '')
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def update_refs(old_ref, new_ref, from_db=False):
     """Update references in the entire database.
 
     Replaces all occurrences of ``old_ref`` with ``new_ref``,
     provided that they happen at one of the paths listed in
     ``INSPIRE_REF_UPDATER_WHITELISTS``.
+
+    The records are updated in chunks of ``UPDATE_REFS_CHUNK_SIZE``, each in
+    its own transaction, and the progress is kept in Redis. If ``from_db``
+    is ``True`` they are found in the DB instead of in ES, in UUID order, so
+    that an interrupted run resumes after the last committed chunk. Records
+    that no longer contain ``old_ref`` are never committed again, so running
+    the task again also resumes an interrupted run that used ES.
     """
-    records = get_records_to_update(old_ref)
+    redis_url = current_app.config.get('CACHE_REDIS_URL')
+    r = StrictRedis.from_url(redis_url)
+    progress_key = UPDATE_REFS_PROGRESS.format(old_ref)
+
+    progress = r.hgetall(progress_key)
+    if progress.get('new_ref') != new_ref:
+        r.delete(progress_key)
+        progress = {}
+
+    if from_db:
+        chunks = get_uuids_to_update_from_db(old_ref, after=progress.get('last_uuid'))
+    else:
+        chunks = get_uuids_to_update(old_ref)
+
+    checked = int(progress.get('checked', 0))
+    updated = int(progress.get('updated', 0))
+    for uuids in chunks:
+        with db.session.begin_nested():
+            for record in InspireRecord.get_records(uuids):
+                if update_links(record, old_ref, new_ref):
+                    record.commit()
+                    updated += 1
+        db.session.commit()
+
+        checked += len(uuids)
+        progress = {
+            'new_ref': new_ref,
+            'checked': checked,
+            'updated': updated,
+        }
+        if from_db:
+            progress['last_uuid'] = uuids[-1]
+        r.hmset(progress_key, progress)
+        logger.info(
+            'Updating references %s -> %s: %d records updated, %d checked',
+            old_ref, new_ref, updated, checked)
+
+    r.delete(progress_key)
+    logger.info(
+        'Updated references %s -> %s in %d records', old_ref, new_ref, updated)
 
-    with db.session.begin_nested():
-        for record in records:
-            logger.info('Updated reference: %s -> %s, Record: %s', old_ref, new_ref, record.id)
-            update_links(record, old_ref, new_ref)
-            record.commit()
-    db.session.commit()
+
+def get_update_refs_progress(old_ref):
+    """Return the progress of a running or interrupted :func:`update_refs`."""
+    redis_url = current_app.config.get('CACHE_REDIS_URL')
+    r = StrictRedis.from_url(redis_url)
+
+    return r.hgetall(UPDATE_REFS_PROGRESS.format(old_ref))
 
 
 def update_links(record, old_ref, new_ref):
-    def _update_links(record, parts, old_ref, new_ref):
-        for i, part in enumerate(parts):
-            if isinstance(record, dict):
-                try:
-                    record = record[part]
-                except KeyError:
-                    return
-            elif isinstance(record, list):
-                for el in record:
-                    _update_links(el, parts[i:], old_ref, new_ref)
-                return
-
-        if record['$ref'] == old_ref:
-            record['$ref'] = new_ref
+    """Replace ``old_ref`` with ``new_ref`` at the whitelisted paths.
 
+    Returns:
+        bool: whether any reference was replaced.
+    """
     endpoint = get_endpoint_from_record(record)
-    whitelist = current_app.config['INSPIRE_REF_UPDATER_WHITELISTS'][endpoint]
-
-    for path in whitelist:
-        _update_links(record, path.split('.'), old_ref, new_ref)
-
-
-def get_records_to_update(old_ref):
-    def _get_uuids_to_update(old_ref):
-        def _replace_record_with_recid(path):
-            return path.replace('record', 'recid')
-
-        def _ref_to_recid(ref):
-            return int(ref.split('/')[-1])
-
-        result = []
-
-        whitelists = current_app.config['INSPIRE_REF_UPDATER_WHITELISTS']
-        for endpoint, whitelist in iteritems(whitelists):
-            fields = [_replace_record_with_recid(path) for path in whitelist]
-            body = {
-                'query': {
-                    'bool': {
-                        'should': [
-                            {
-                                'term': {
-                                    field: {
-                                        'value': _ref_to_recid(old_ref),
-                                    },
+    paths = get_whitelisted_ref_paths(endpoint, record['$schema'])
+
+    updated = False
+    for path in paths:
+        for parent, key in iter_values_at_path(record, path):
+            refs = parent[key] if isinstance(parent[key], list) else [parent[key]]
+            for ref in refs:
+                if isinstance(ref, dict) and ref.get('$ref') == old_ref:
+                    ref['$ref'] = new_ref
+                    updated = True
+
+    return updated
+
+
+_whitelisted_ref_paths = {}
+
+
+def get_whitelisted_ref_paths(endpoint, schema):
+    """Return the paths of the references updated in records of an endpoint.
+
+    These are the paths listed for the endpoint in
+    ``INSPIRE_REF_UPDATER_WHITELISTS``, split once. The ones at which the
+    schema does not allow JSON references are logged, as they are most
+    likely mistakes.
+    """
+    whitelist = tuple(current_app.config['INSPIRE_REF_UPDATER_WHITELISTS'][endpoint])
+    try:
+        return _whitelisted_ref_paths[whitelist, schema]
+    except KeyError:
+        pass
+
+    paths = [tuple(path.split('.')) for path in whitelist]
+    ref_paths = get_ref_paths(schema)
+    if ref_paths is not None:
+        for path in paths:
+            if path not in ref_paths:
+                logger.warning(
+                    'Whitelisted path %s cannot contain references in %s',
+                    '.'.join(path), schema)
+
+    return _whitelisted_ref_paths.setdefault((whitelist, schema), paths)
+
+
+def get_uuids_to_update(old_ref, chunk_size=UPDATE_REFS_CHUNK_SIZE):
+    """Yield in chunks the UUIDs of the records that ES says refer to ``old_ref``."""
+    def _replace_record_with_recid(path):
+        return path.replace('record', 'recid')
+
+    def _ref_to_recid(ref):
+        return int(ref.split('/')[-1])
+
+    chunk = []
+
+    whitelists = current_app.config['INSPIRE_REF_UPDATER_WHITELISTS']
+    for endpoint, whitelist in iteritems(whitelists):
+        fields = [_replace_record_with_recid(path) for path in whitelist]
+        body = {
+            'query': {
+                'bool': {
+                    'should': [
+                        {
+                            'term': {
+                                field: {
+                                    'value': _ref_to_recid(old_ref),
                                 },
-                            } for field in fields
-                        ],
-                    },
+                            },
+                        } for field in fields
+                    ],
                 },
-            }
+            },
+        }
 
-            index = current_app.config['INSPIRE_ENDPOINT_TO_INDEX'][endpoint]
-            query = scan(es, query=body, index=index)
+        index = current_app.config['INSPIRE_ENDPOINT_TO_INDEX'][endpoint]
+        for hit in scan(es, query=body, index=index, _source=False):
+            chunk.append(hit['_id'])
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
 
-            result.extend(el['_id'] for el in list(query))
+    if chunk:
+        yield chunk
 
-        return result
 
-    def _get_records_to_update(uuids):
-        return InspireRecord.get_records(uuids)
+def get_uuids_to_update_from_db(old_ref, after=None, chunk_size=UPDATE_REFS_CHUNK_SIZE):
+    """Yield in chunks the UUIDs of the records that refer to ``old_ref``.
 
-    uuids = _get_uuids_to_update(old_ref)
-    records = _get_records_to_update(uuids)
+    The records are found with JSONB containment queries on the paths of
+    ``INSPIRE_REF_UPDATER_WHITELISTS``, which can use the GIN index on
+    ``records_metadata.json``, and are returned in UUID order starting
+    after ``after``. Each chunk is queried only after the previous one has
+    been consumed, so the records can be updated in between.
+    """
+    paths = set()
+    whitelists = current_app.config['INSPIRE_REF_UPDATER_WHITELISTS']
+    for whitelist in whitelists.values():
+        paths.update(tuple(path.split('.')) for path in whitelist)
+
+    condition = or_(*[
+        RecordMetadata.json.op('@>')(cast(literal(document, JSONB), JSONB))
+        for path in sorted(paths)
+        for document in get_ref_containment_documents(path, old_ref)
+    ])
+
+    while True:
+        query = db.session.query(RecordMetadata.id).filter(condition)
+        if after:
+            query = query.filter(RecordMetadata.id > after)
+        uuids = [
+            str(uuid) for uuid, in query.order_by(RecordMetadata.id).limit(chunk_size)
+        ]
+        if not uuids:
+            return
+
+        yield uuids
+        after = uuids[-1]
+
+
+def get_ref_containment_documents(path, ref):
+    """Return the JSON documents contained in the records with ``ref`` at ``path``.
+
+    Whitelisted paths do not tell which of their keys hold lists, so one
+    document is returned for each combination of lists and objects.
+    """
+    documents = [{'$ref': ref}]
+    for key in reversed(path):
+        documents = [{key: document} for document in documents] + \
+            [{key: [document]} for document in documents]
 
-    return records
+    return documents
 
 
 @shared_task
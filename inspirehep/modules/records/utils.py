@@ -24,16 +24,32 @@
 
 from __future__ import absolute_import, division, print_function
 
+import hashlib
+import posixpath
 import requests
 import sys
+import threading
 import traceback
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from tempfile import SpooledTemporaryFile
+from elasticsearch.helpers import bulk as es_bulk
 from flask import current_app
-from six.moves.urllib.parse import urlparse
+from six import iteritems, reraise, string_types
+from six.moves.urllib.parse import urlparse, urlsplit
+
+from invenio_indexer.api import RecordIndexer, current_record_to_index
+from invenio_search import current_search_client as es
+
+from inspire_schemas.utils import load_schema
 
 from inspirehep.modules.pidstore.utils import (
     get_endpoint_from_pid_type,
     get_pid_type_from_schema
 )
+from inspirehep.modules.records.models import get_citation_counts
+
+_prefetched = threading.local()
 
 
 class FailedToOpenUrlPath(Exception):
@@ -54,6 +70,168 @@ def get_endpoint_from_record(record):
     return endpoint
 
 
+_ref_paths = {}
+
+
+def get_ref_paths(schema):
+    """Return the paths at which records of a schema can contain JSON references.
+
+    The paths are derived from the JSON schema the first time they are
+    requested, and then cached.
+
+    Args:
+        schema(str): the ``$schema`` of a record.
+
+    Returns:
+        frozenset: tuples of keys leading to a JSON reference, or to a list
+        of them, where lists along the way are traversed transparently, or
+        ``None`` if the schema cannot be loaded.
+    """
+    try:
+        return _ref_paths[schema]
+    except KeyError:
+        pass
+
+    schema_name = urlsplit(schema).path.split('/')[-1]
+    try:
+        paths = frozenset(_iter_ref_paths(load_schema(schema_name), schema_name))
+    except Exception:
+        # The schema or one of its references could not be found.
+        paths = None
+
+    return _ref_paths.setdefault(schema, paths)
+
+
+def _iter_ref_paths(node, schema_name, path=(), depth=0):
+    if depth > 50:
+        raise ValueError('Schema {} is too deep'.format(schema_name))
+
+    while isinstance(node.get('$ref'), string_types):
+        ref_name, _, pointer = node['$ref'].partition('#')
+        if ref_name:
+            schema_name = posixpath.normpath(posixpath.join(
+                posixpath.dirname(schema_name), ref_name))
+        node = load_schema(schema_name)
+        for part in filter(None, pointer.split('/')):
+            node = node[part]
+
+    properties = node.get('properties', {})
+    if '$ref' in properties:
+        yield path
+        return
+
+    for key, subnode in iteritems(properties):
+        for ref_path in _iter_ref_paths(subnode, schema_name, path + (key,), depth + 1):
+            yield ref_path
+
+    subnodes = [node['items']] if isinstance(node.get('items'), dict) else []
+    for keyword in ('allOf', 'anyOf', 'oneOf'):
+        subnodes.extend(node.get(keyword, []))
+    for subnode in subnodes:
+        for ref_path in _iter_ref_paths(subnode, schema_name, path, depth + 1):
+            yield ref_path
+
+
+def iter_values_at_path(json, path):
+    """Yield the ``(parent, key)`` of every value found at ``path`` in ``json``.
+
+    Lists found along the way, including in ``json`` itself, are
+    traversed transparently.
+    """
+    if isinstance(json, list):
+        for el in json:
+            for result in iter_values_at_path(el, path):
+                yield result
+    elif isinstance(json, dict) and path[0] in json:
+        if len(path) == 1:
+            yield json, path[0]
+        else:
+            for result in iter_values_at_path(json[path[0]], path[1:]):
+                yield result
+
+
+def get_index_action(record):
+    """Return the bulk action indexing a record in ES."""
+    index, doc_type = current_record_to_index(record)
+
+    return {
+        '_op_type': 'index',
+        '_index': index,
+        '_type': doc_type,
+        '_id': str(record.id),
+        '_version': record.revision_id,
+        '_version_type': 'external_gte',
+        '_source': RecordIndexer._prepare_record(record, index, doc_type),
+    }
+
+
+@contextmanager
+def prefetched_citation_counts(records):
+    """Fetch at once the citation counts of many records about to be indexed.
+
+    Inside the context, :func:`get_citation_count` returns them instead of
+    querying the DB once per record.
+    """
+    recids = [
+        record['control_number'] for record in records
+        if 'hep.json' in record.get('$schema', '') and 'control_number' in record
+    ]
+    previous = getattr(_prefetched, 'citation_counts', None)
+    _prefetched.citation_counts = get_citation_counts(recids)
+    try:
+        yield
+    finally:
+        _prefetched.citation_counts = previous
+
+
+def get_citation_count(recid):
+    """Return the number of Literature records citing a Literature record."""
+    prefetched = getattr(_prefetched, 'citation_counts', None) or {}
+    if recid in prefetched:
+        return prefetched[recid]
+    return get_citation_counts([recid])[recid]
+
+
+def get_delete_action(record):
+    """Return the bulk action deleting a record from ES."""
+    index, doc_type = current_record_to_index(record)
+
+    return {
+        '_op_type': 'delete',
+        '_index': index,
+        '_type': doc_type,
+        '_id': str(record.id),
+    }
+
+
+def index_records_in_bulk(actions):
+    """Send bulk actions to ES, logging the ones that failed.
+
+    Deleting a record that is not in ES is not considered a failure.
+
+    Returns:
+        tuple: the number of successful actions, and the ``(op_type, item)``
+        pairs describing the ones that failed.
+    """
+    success, errors = es_bulk(
+        es,
+        actions,
+        raise_on_error=False,
+        raise_on_exception=False,
+        request_timeout=current_app.config['INDEXER_BULK_REQUEST_TIMEOUT'],
+    )
+    failed = []
+    for error in errors:
+        op_type, item = next(iteritems(error))
+        if op_type == 'delete' and item.get('status') == 404:
+            continue
+        current_app.logger.warning(
+            'Cannot %s record %s in ES: %s', op_type, item.get('_id'), item.get('error'))
+        failed.append((op_type, item))
+
+    return success, failed
+
+
 def get_detailed_template_from_record(record):
     """Return the detailed template corresponding to the given record."""
     endpoint = get_endpoint_from_record(record)
@@ -78,3 +256,89 @@ def open_url_or_path(file_path):
         raise
     except Exception as error:
         raise FailedToOpenUrlPath(path=file_path, exception=error)
+
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def download_files(urls, workers):
+    """Download concurrently the given URLs or paths to temporary files.
+
+    Each file is downloaded once, however many times it is given, and
+    hashed while it is downloaded.
+
+    Args:
+        urls(Iterable[str]): URLs or paths that can be opened with
+            :func:`open_url_or_path`.
+        workers(int): maximum number of concurrent downloads.
+
+    Returns:
+        dict: for each URL, a ``(file, checksum, size)`` tuple, where
+        ``file`` is a temporary file positioned at its start, and
+        ``checksum`` is in the format used by Invenio-Files-REST. The
+        caller is responsible for closing the files.
+
+    Raises:
+        FailedToOpenUrlPath: if any of the files cannot be downloaded. The
+            downloads that are not started yet are skipped, and the files
+            already downloaded are closed.
+    """
+    urls = sorted(set(urls))
+    if not urls:
+        return {}
+
+    failed = threading.Event()
+
+    def download(url):
+        if failed.is_set():
+            return None
+        try:
+            return _download_file(url)
+        except Exception:
+            failed.set()
+            raise
+
+    pool = ThreadPool(min(workers, len(urls)))
+    try:
+        results = [pool.apply_async(download, (url,)) for url in urls]
+        pool.close()
+
+        downloads = {}
+        error = None
+        for url, result in zip(urls, results):
+            try:
+                downloaded = result.get()
+            except Exception:
+                error = error or sys.exc_info()
+                continue
+            if downloaded is not None:
+                downloads[url] = downloaded
+
+        if error:
+            for downloaded, _, _ in downloads.values():
+                downloaded.close()
+            reraise(*error)
+    finally:
+        pool.join()
+
+    return downloads
+
+
+def _download_file(url):
+    stream = open_url_or_path(url)
+    downloaded = SpooledTemporaryFile(max_size=DOWNLOAD_CHUNK_SIZE)
+    md5 = hashlib.md5()
+    size = 0
+    try:
+        for chunk in iter(lambda: stream.read(DOWNLOAD_CHUNK_SIZE), b''):
+            md5.update(chunk)
+            downloaded.write(chunk)
+            size += len(chunk)
+    except Exception as error:
+        downloaded.close()
+        raise FailedToOpenUrlPath(path=url, exception=error)
+    finally:
+        stream.close()
+
+    downloaded.seek(0)
+    return downloaded, 'md5:{}'.format(md5.hexdigest()), size
@@ -24,13 +24,47 @@ from __future__ import absolute_import, division, print_function
 
 from flask_login import current_user
 
+from inspire_dojson.utils import get_recid_from_ref
+from inspire_utils.date import format_date
 from inspirehep.utils.record import get_title
+from inspirehep.utils.record_getter import get_es_records_by_pids
 from inspirehep.modules.records.json_ref_loader import replace_refs
 from inspirehep.modules.records.api import ESRecord
 from inspirehep.modules.records.permissions import has_update_permission
 from inspirehep.modules.search import JobsSearch
 
 
+PUBLICATION_INFO_REF_PID_TYPES = {
+    'conference_record': 'con',
+    'parent_record': 'lit',
+}
+
+
+def _get_reference_key(key, ref):
+    return PUBLICATION_INFO_REF_PID_TYPES[key], str(get_recid_from_ref(ref))
+
+
+def get_publication_info_references(records):
+    """Fetch the conference and parent records of many records at once.
+
+    Only their titles and control numbers are fetched, in a single ``mget``.
+
+    Returns:
+        dict: the records, or ``None`` for those not found, keyed by PID type
+        and value, to be passed to
+        :meth:`LiteratureRecord.get_conference_information`.
+    """
+    pids = set()
+    for record in records:
+        for pub_info in record.get('publication_info', []):
+            for key in PUBLICATION_INFO_REF_PID_TYPES:
+                if get_recid_from_ref(pub_info.get(key)):
+                    pids.add(_get_reference_key(key, pub_info[key]))
+
+    found = get_es_records_by_pids(pids, _source=['control_number', 'titles'])
+    return {pid: found.get(pid) for pid in pids}
+
+
 class AdminToolsMixin(object):
     @property
     def admin_tools(self):
@@ -55,21 +89,43 @@ class LiteratureRecord(ESRecord, AdminToolsMixin):
         Returns a list with information about conferences related to the
         record.
         """
+        return self.get_conference_information()
+
+    def get_conference_information(self, references=None):
+        """Conference information, using records that were already fetched.
+
+        Args:
+            references(dict): conference and parent records, as returned by
+                :func:`get_publication_info_references`. The ones missing are
+                fetched from Elasticsearch.
+        """
+        references = references or {}
+        pub_infos = self['publication_info']
+        resolved_pub_infos = replace_refs([
+            {
+                key: pub_info[key]
+                for key in PUBLICATION_INFO_REF_PID_TYPES
+                if key in pub_info and
+                _get_reference_key(key, pub_info[key]) not in references
+            } for pub_info in pub_infos
+        ], 'es')
+
         conf_info = []
-        for pub_info in self['publication_info']:
+        for pub_info, resolved in zip(pub_infos, resolved_pub_infos):
             conference_recid = None
             parent_recid = None
             parent_rec = {}
             conference_rec = {}
             if 'conference_record' in pub_info:
-                conference_rec = replace_refs(pub_info['conference_record'],
-                                              'es')
+                conference_rec = resolved.get('conference_record') or references.get(
+                    _get_reference_key('conference_record', pub_info['conference_record']))
                 if conference_rec and conference_rec.get('control_number'):
                     conference_recid = conference_rec['control_number']
                 else:
                     conference_rec = {}
             if 'parent_record' in pub_info:
-                parent_rec = replace_refs(pub_info['parent_record'], 'es')
+                parent_rec = resolved.get('parent_record') or references.get(
+                    _get_reference_key('parent_record', pub_info['parent_record']))
                 if parent_rec and parent_rec.get('control_number'):
                     parent_recid = parent_rec['control_number']
                 else:
@@ -91,6 +147,25 @@ class LiteratureRecord(ESRecord, AdminToolsMixin):
 
         return conf_info
 
+    def get_display_fields(self):
+        """Fields shown in the brief format of the search results.
+
+        They are computed when the record is indexed, and stored in its
+        ``_display`` field. The conference information is not among them,
+        as it would get stale when the conference or parent records change.
+        """
+        display = {}
+        if 'references' in self:
+            display['number_of_references'] = len(self['references'])
+        if 'earliest_date' in self:
+            display['date'] = format_date(self['earliest_date'])
+        if 'publication_info' in self:
+            display['publication_info'] = self.publication_information
+        if 'authors' in self:
+            display['number_of_authors'] = len(self['authors'])
+
+        return display
+
     @property
     def publication_information(self):
         """Publication information.
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Index related commands."""
+
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+
+import click
+
+from flask_cli import with_appcontext
+
+from .reindex import CHUNK_SIZE, rebuild_index, reindex_records
+
+
+@click.command('bulk-reindex')
+@click.option('--pid-type', '-t', 'pid_types', multiple=True, required=True,
+              help="Type of the PIDs of the records to reindex, e.g. lit.")
+@click.option('--workers', '-w', type=int, default=multiprocessing.cpu_count(),
+              help="Number of processes indexing in parallel.")
+@click.option('--chunk-size', '-s', type=int, default=CHUNK_SIZE,
+              help="Number of records sent to ES in each bulk request.")
+@click.option('--retry-file', '-r', default='/tmp/reindex-failed.txt',
+              help="File where the UUIDs of the records that failed are written.")
+@click.option('--from-file', '-f', type=click.File(),
+              help="Only reindex the records whose UUIDs are listed in this file.")
+@with_appcontext
+def bulk_reindex(pid_types, workers, chunk_size, retry_file, from_file):
+    """Reindex all the records of some PID types in bulk."""
+    uuids = [line.strip() for line in from_file if line.strip()] if from_file else None
+
+    _, failed = reindex_records(
+        pid_types, workers, chunk_size=chunk_size, uuids=uuids, retry_file=retry_file)
+
+    if failed:
+        raise click.Abort()
+
+
+@click.command('rebuild')
+@click.option('--pid-type', '-t', required=True,
+              help="Type of the PIDs of the records of the index, e.g. lit.")
+@click.option('--workers', '-w', type=int, default=multiprocessing.cpu_count(),
+              help="Number of processes indexing in parallel.")
+@click.option('--chunk-size', '-s', type=int, default=CHUNK_SIZE,
+              help="Number of records sent to ES in each bulk request.")
+@click.option('--retry-file', '-r', default='/tmp/reindex-failed.txt',
+              help="File where the UUIDs of the records that failed are written.")
+@click.option('--delete-concrete-index', is_flag=True, default=False,
+              help="Delete the index created by 'index init', which has the "
+                   "name of the alias, instead of failing.")
+@with_appcontext
+def rebuild(pid_type, workers, chunk_size, retry_file, delete_concrete_index):
+    """Rebuild an index with the current mapping without interrupting searches."""
+    rebuild_index(
+        pid_type, workers, chunk_size=chunk_size, retry_file=retry_file,
+        delete_concrete_index=delete_concrete_index)
@@ -24,6 +24,9 @@
 
 from __future__ import absolute_import, division, print_function
 
+from invenio_search.cli import index
+
+from .cli import bulk_reindex, rebuild
 from .views import blueprint
 
 
@@ -34,4 +37,8 @@ class InspireSearch(object):
 
     def init_app(self, app):
         app.register_blueprint(blueprint)
+        # Next to the ``reindex`` command of Invenio-Indexer, which queues
+        # the records to be indexed one by one.
+        index.add_command(bulk_reindex)
+        index.add_command(rebuild)
         app.extensions['inspire-search'] = self
@@ -24,15 +24,109 @@
 
 from __future__ import absolute_import, division, print_function
 
+import copy
+import hashlib
+import re
+from collections import Counter
+
 from elasticsearch_dsl import Q
+from flask import current_app, has_app_context
+from six import text_type
 
 import inspire_query_parser
+from invenio_cache import current_cache
+
+from inspirehep.utils.lru import LRUCache
+
+
+QUERY_CACHE_SIZE = 10000
+"""Maximum number of generated queries cached by each process."""
+
+_relative_date = re.compile(
+    r'\b(today|yesterday|this\s+month|last\s+month)\b',
+    re.IGNORECASE | re.UNICODE)
+_spaces = re.compile(r'\s+', re.UNICODE)
+
+_query_cache = LRUCache(QUERY_CACHE_SIZE)
+
+query_cache_stats = Counter()
+"""Queries found in Redis, and queries not cached because of relative dates."""
+
+
+def normalize_query(query_string):
+    """Normalize a query string for use as a cache key.
+
+    Whitespace is collapsed only when there are no quotes, as it is
+    significant in exact and partial matches.
+    """
+    if '"' in query_string or "'" in query_string:
+        return query_string.strip()
+    return _spaces.sub(' ', query_string).strip()
+
+
+def get_query_cache_stats():
+    """Return the size and the hit rate of the query cache of this process."""
+    stats = _query_cache.stats()
+    stats.update(query_cache_stats)
+    return stats
+
+
+def clear_query_cache():
+    """Empty the query cache of this process."""
+    _query_cache.clear()
+    query_cache_stats.clear()
+
+
+def _get_redis_key(query_string):
+    if isinstance(query_string, text_type):
+        query_string = query_string.encode('utf-8')
+    return 'search_query:{}'.format(hashlib.sha1(query_string).hexdigest())
+
+
+def _use_redis():
+    return has_app_context() and current_app.config.get('SEARCH_QUERY_CACHE_REDIS')
+
+
+def parse_query(query_string):
+    """Generate the Elasticsearch query of a query string, caching it.
+
+    The queries are cached in each process and, if
+    ``SEARCH_QUERY_CACHE_REDIS`` is set, shared between processes through
+    Redis. Queries with relative dates, like ``de today``, are not cached,
+    because they change from one day to the next.
+
+    Returns:
+        dict: a copy of the query, that can be modified by the caller.
+    """
+    query_string = normalize_query(query_string)
+    if _relative_date.search(query_string):
+        query_cache_stats['uncacheable'] += 1
+        return inspire_query_parser.parse_query(query_string)
+
+    query = _query_cache.get(query_string)
+    if query is None:
+        redis_key = _get_redis_key(query_string)
+        if _use_redis():
+            query = current_cache.get(redis_key)
+            if query is not None:
+                query_cache_stats['redis_hits'] += 1
+
+        if query is None:
+            query = inspire_query_parser.parse_query(query_string)
+            if _use_redis():
+                current_cache.set(
+                    redis_key, query,
+                    timeout=current_app.config['SEARCH_QUERY_CACHE_TIMEOUT'])
+
+        _query_cache.set(query_string, query)
+
+    return copy.deepcopy(query)
 
 
 def inspire_query_factory():
     """Create an Elastic Search DSL query instance using the generated Elastic Search query by the parser."""
 
     def inspire_query(query_string, search):
-        return Q(inspire_query_parser.parse_query(query_string))
+        return Q(parse_query(query_string))
 
     return inspire_query
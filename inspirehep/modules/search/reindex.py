@@ -0,0 +1,516 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Bulk reindexing of records with a local pool of processes."""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import multiprocessing
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import partial
+
+import click
+from elasticsearch.helpers import bulk as es_bulk
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy_continuum import transaction_class, version_class
+from sqlalchemy_continuum.operation import Operation
+
+from invenio_db import db
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_records.api import Record
+from invenio_records.models import RecordMetadata
+from invenio_search import current_search, current_search_client as es
+
+from inspirehep.modules.pidstore.utils import get_endpoint_from_pid_type
+from inspirehep.modules.records.utils import (
+    get_index_action,
+    prefetched_citation_counts,
+)
+
+CHUNK_SIZE = 500
+
+CATCH_UP_MARGIN = timedelta(minutes=10)
+"""Changes made this long before an index started being built are indexed again.
+
+They might have been committed after the records were read.
+"""
+
+
+BULK_INDEX_SETTINGS = {
+    'refresh_interval': '-1',
+    'number_of_replicas': 0,
+}
+
+
+def get_index_settings(index):
+    """Return the settings that an index has outside of bulk operations.
+
+    They are the ``SEARCH_INDEX_SETTINGS``, unless the mapping of the index,
+    or of the alias that it is a version of, sets them. They do not depend
+    on the current settings, which might be left over by a bulk operation.
+    """
+    settings = dict(current_app.config['SEARCH_INDEX_SETTINGS'])
+
+    mapping = current_search.mappings.get(re.sub(r'-v\d+$', '', index))
+    if mapping:
+        with open(mapping) as fd:
+            mapping_settings = json.load(fd).get('settings', {})
+        mapping_settings = mapping_settings.get('index', mapping_settings)
+        settings.update(
+            (key, mapping_settings[key]) for key in settings if key in mapping_settings)
+
+    return settings
+
+
+def _get_live_index_settings(index, settings):
+    """Return the current values of the bulk settings of an index.
+
+    A value equal to the bulk one was left over by an interrupted bulk
+    operation, so it is replaced, like a value that isn't set, by the one
+    returned by :func:`get_index_settings`.
+    """
+    live_settings = settings[index]['settings']['index']
+    restored = get_index_settings(index)
+    for key, bulk_value in BULK_INDEX_SETTINGS.items():
+        value = live_settings.get(key)
+        if value is not None and str(value) != str(bulk_value):
+            restored[key] = value
+
+    return {key: restored[key] for key in BULK_INDEX_SETTINGS}
+
+
+@contextmanager
+def bulk_index_settings(*indices):
+    """Disable refresh and replicas on some indices for a bulk operation.
+
+    The settings that the indices had when entering, as returned by
+    :func:`_get_live_index_settings`, are restored on exit, whether the
+    operation succeeded or not. Aliases are resolved to the concrete
+    indices when entering: wildcards should be avoided, as they could match
+    the indices of another bulk operation.
+    """
+    if not indices:
+        yield
+        return
+
+    settings = es.indices.get_settings(index=','.join(indices))
+    original_settings = {
+        index: _get_live_index_settings(index, settings)
+        for index in settings
+    }
+
+    try:
+        for index in original_settings:
+            es.indices.put_settings(index=index, body=BULK_INDEX_SETTINGS)
+        yield
+    finally:
+        for index, settings in original_settings.items():
+            try:
+                es.indices.put_settings(index=index, body=settings)
+            except Exception:
+                current_app.logger.exception('Cannot restore the settings of %s: %s', index, settings)
+
+
+def _get_index_of_pid_type(pid_type):
+    return current_app.config['INSPIRE_ENDPOINT_TO_INDEX'][get_endpoint_from_pid_type(pid_type)]
+
+
+def _init_reindex_worker():
+    """Give each reindex worker its own app, DB session and ES client."""
+    from inspirehep.factory import create_app
+
+    app = create_app()
+    app.app_context().push()
+
+
+def _get_uuids_query(pid_types, updated_since=None):
+    query = db.session.query(PersistentIdentifier.object_uuid).filter(
+        PersistentIdentifier.pid_type.in_(pid_types),
+        PersistentIdentifier.object_type == 'rec',
+        PersistentIdentifier.status == PIDStatus.REGISTERED,
+    )
+    if updated_since:
+        query = query.join(
+            RecordMetadata, RecordMetadata.id == PersistentIdentifier.object_uuid
+        ).filter(RecordMetadata.updated >= updated_since)
+    return query
+
+
+def _get_uuid_ranges(pid_types, chunk_size):
+    """Split the UUIDs of the records to reindex in ranges of ``chunk_size`` records."""
+    query = _get_uuids_query(pid_types).distinct().order_by(
+        PersistentIdentifier.object_uuid
+    ).execution_options(stream_results=True)
+
+    chunk = []
+    for uuid, in query.yield_per(chunk_size * 10):
+        chunk.append(str(uuid))
+        if len(chunk) == chunk_size:
+            yield ('range', chunk[0], chunk[-1])
+            chunk = []
+    if chunk:
+        yield ('range', chunk[0], chunk[-1])
+
+
+def _get_uuid_lists(uuids, chunk_size):
+    for i in range(0, len(uuids), chunk_size):
+        yield ('ids', uuids[i:i + chunk_size])
+
+
+def reindex_chunk(chunk, pid_types, index=None):
+    """Index in bulk a chunk of records.
+
+    Args:
+        chunk(tuple): either ``('range', first_uuid, last_uuid)``, meaning all
+            the records of ``pid_types`` with an UUID in that range, or
+            ``('ids', uuids)``.
+        pid_types(list): the types of the PIDs of the records to index.
+        index(str): index to write into, instead of the one of each record.
+
+    Returns:
+        tuple: the number of records read and the UUIDs of the records that
+        could not be indexed.
+    """
+    query = RecordMetadata.query.filter(
+        RecordMetadata.id.in_(_get_uuids_query(pid_types).subquery()))
+    if chunk[0] == 'range':
+        query = query.filter(RecordMetadata.id.between(chunk[1], chunk[2]))
+    else:
+        query = query.filter(RecordMetadata.id.in_(chunk[1]))
+    query = query.execution_options(stream_results=True)
+
+    read = 0
+    records = []
+    for model_instance in query.yield_per(CHUNK_SIZE):
+        read += 1
+        if model_instance.json is not None:
+            records.append(Record(model_instance.json, model_instance))
+
+    failed = []
+    actions = []
+    with prefetched_citation_counts(records):
+        for record in records:
+            try:
+                action = get_index_action(record)
+            except Exception:
+                current_app.logger.exception('Cannot prepare record %s', record.id)
+                failed.append(str(record.id))
+                continue
+            if index:
+                action['_index'] = index
+            actions.append(action)
+    db.session.close()
+
+    _, errors = es_bulk(
+        es,
+        actions,
+        raise_on_error=False,
+        raise_on_exception=False,
+        request_timeout=current_app.config['INDEXER_BULK_REQUEST_TIMEOUT'],
+    )
+    for error in errors:
+        _, item = next(iter(error.items()))
+        current_app.logger.warning('Cannot index record %s: %s', item.get('_id'), item.get('error'))
+        failed.append(item['_id'])
+
+    return read, failed
+
+
+def reindex_records(pid_types, workers, chunk_size=CHUNK_SIZE, uuids=None,
+                    retry_file=None, index=None):
+    """Reindex all the records of some PID types with a local pool of processes.
+
+    The parent process splits the records in ranges of UUIDs, which the
+    workers read with server-side cursors, enhance and send to ES in bulk.
+    Progress and throughput are reported as the chunks complete, and the
+    UUIDs of the records that could not be indexed are written to
+    ``retry_file``, from which they can be passed again as ``uuids``.
+
+    Returns:
+        tuple: the number of records read and the UUIDs of the failed ones.
+    """
+    if uuids is None:
+        total = _get_uuids_query(pid_types).distinct().count()
+        # The pool consumes its input in another thread, without app context.
+        chunks = list(_get_uuid_ranges(pid_types, chunk_size))
+    else:
+        total = len(uuids)
+        chunks = list(_get_uuid_lists(uuids, chunk_size))
+
+    # Don't let the workers inherit the connections of the parent.
+    db.session.close()
+    db.engine.dispose()
+
+    read = 0
+    failed = []
+    start = time.time()
+    # A new index being built already has the bulk settings.
+    indices = [_get_index_of_pid_type(pid_type) for pid_type in pid_types] if index is None else []
+    pool = multiprocessing.Pool(workers, initializer=_init_reindex_worker)
+    try:
+        with bulk_index_settings(*indices):
+            reindex = partial(reindex_chunk, pid_types=pid_types, index=index)
+            for chunk_read, chunk_failed in pool.imap_unordered(reindex, chunks):
+                read += chunk_read
+                failed.extend(chunk_failed)
+                rate = read / (time.time() - start)
+                click.echo(
+                    'Indexed {read}/{total} records ({rate:.1f} docs/s, '
+                    '{failed} failed), ETA {eta:.0f}s'.format(
+                        read=read,
+                        total=total,
+                        rate=rate,
+                        failed=len(failed),
+                        eta=max(total - read, 0) / rate if rate else 0,
+                    ))
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    click.echo('All {} records have been processed in {:.0f}s.'.format(
+        read, time.time() - start))
+
+    if failed and retry_file:
+        with open(retry_file, 'w') as fd:
+            fd.writelines(uuid + '\n' for uuid in failed)
+        click.echo('{} records could not be indexed, their UUIDs are in {}.'.format(
+            len(failed), retry_file), err=True)
+
+    return read, failed
+
+
+def get_next_index_name(alias):
+    """Return the name of the next version of the index behind ``alias``.
+
+    Examples:
+        >>> get_next_index_name('records-hep')  # with records-hep-v1
+        'records-hep-v2'
+    """
+    version_pattern = re.compile(r'^{}-v(\d+)$'.format(re.escape(alias)))
+    versions = [
+        int(match.group(1)) for match in (
+            version_pattern.match(index)
+            for index in es.indices.get_alias(index='{}-v*'.format(alias))
+        ) if match
+    ]
+
+    return '{}-v{}'.format(alias, max(versions) + 1 if versions else 1)
+
+
+def _supports_remove_index_action():
+    return int(es.info()['version']['number'].split('.')[0]) >= 5
+
+
+def _is_concrete_index(name):
+    return name in es.indices.get_alias(index=name)
+
+
+def _check_concrete_index(alias, delete_concrete_index):
+    if _is_concrete_index(alias) and not delete_concrete_index:
+        raise click.ClickException(
+            '{} is an index, not an alias: it can only be replaced by deleting '
+            'it, which must be explicitly requested.'.format(alias))
+
+
+def swap_index_alias(alias, new_index, delete_concrete_index=False):
+    """Make ``alias`` point to ``new_index``, with the other aliases of the old index.
+
+    If ``alias`` is still a concrete index, as created by ``inspirehep index
+    init``, it can only be replaced if ``delete_concrete_index`` is set. It
+    is then deleted in the same request that creates the alias, so that
+    searches never fail. Elasticsearch 2 does not support this: the index
+    is deleted just before, and searches fail for a few milliseconds.
+
+    Returns:
+        list: the indices the alias pointed to before, that are kept.
+
+    Raises:
+        click.ClickException: if ``alias`` is a concrete index and
+            ``delete_concrete_index`` is not set.
+    """
+    _check_concrete_index(alias, delete_concrete_index)
+
+    old_aliases = es.indices.get_alias(index=alias)
+    old_indices = list(old_aliases)
+
+    actions = []
+    for old_index in old_indices:
+        for name in old_aliases[old_index].get('aliases', {}):
+            actions.append({'remove': {'index': old_index, 'alias': name}})
+            if name != alias:
+                actions.append({'add': {'index': new_index, 'alias': name}})
+    actions.append({'add': {'index': new_index, 'alias': alias}})
+
+    if alias in old_indices:
+        actions = [action for action in actions if 'remove' not in action]
+        old_indices = []
+        if _supports_remove_index_action():
+            actions.append({'remove_index': {'index': alias}})
+        else:
+            es.indices.delete(index=alias)
+    es.indices.update_aliases(body={'actions': actions})
+
+    return old_indices
+
+
+def _get_deleted_uuids(pid_type, since):
+    """Return the UUIDs of the records deleted since a given time.
+
+    These are the records whose PIDs were deleted or redirected, the ones
+    deleted without their PIDs, and the ones removed from the DB.
+    """
+    query = db.session.query(PersistentIdentifier.object_uuid).join(
+        RecordMetadata, RecordMetadata.id == PersistentIdentifier.object_uuid
+    ).filter(
+        PersistentIdentifier.pid_type == pid_type,
+        PersistentIdentifier.object_type == 'rec',
+        RecordMetadata.updated >= since,
+        or_(
+            PersistentIdentifier.status != PIDStatus.REGISTERED,
+            RecordMetadata.json == None,  # noqa: E711
+        ),
+    )
+    deleted = {str(uuid) for uuid, in query}
+
+    RecordMetadataVersion = version_class(RecordMetadata)
+    Transaction = transaction_class(RecordMetadata)
+    query = db.session.query(RecordMetadataVersion.id).join(
+        Transaction, Transaction.id == RecordMetadataVersion.transaction_id
+    ).filter(
+        RecordMetadataVersion.operation_type == Operation.DELETE,
+        Transaction.issued_at >= since,
+    )
+    deleted.update(str(uuid) for uuid, in query)
+
+    live = _get_uuids_query([pid_type], updated_since=since).filter(
+        RecordMetadata.json != None)  # noqa: E711
+    deleted.difference_update(str(uuid) for uuid, in live)
+
+    return deleted
+
+
+def _delete_from_index(uuids, index):
+    doc_types = [
+        doc_type for doc_type in es.indices.get_mapping(index=index)[index]['mappings']
+        if doc_type != '_default_'
+    ]
+    _, errors = es_bulk(
+        es,
+        (
+            {'_op_type': 'delete', '_index': index, '_type': doc_type, '_id': uuid}
+            for uuid in uuids for doc_type in doc_types
+        ),
+        raise_on_error=False,
+        raise_on_exception=False,
+        request_timeout=current_app.config['INDEXER_BULK_REQUEST_TIMEOUT'],
+    )
+    for error in errors:
+        _, item = next(iter(error.items()))
+        if item.get('status') != 404:
+            current_app.logger.warning(
+                'Cannot delete record %s: %s', item.get('_id'), item.get('error'))
+
+
+def _catch_up(pid_type, since, index, chunk_size):
+    # The records are selected by the time at which they were changed, not
+    # at which the change was committed.
+    since -= CATCH_UP_MARGIN
+    uuids = [str(uuid) for uuid, in _get_uuids_query([pid_type], updated_since=since)]
+    failed = []
+    for chunk in _get_uuid_lists(uuids, chunk_size):
+        _, chunk_failed = reindex_chunk(chunk, [pid_type], index=index)
+        failed.extend(chunk_failed)
+
+    deleted = _get_deleted_uuids(pid_type, since)
+    if deleted:
+        _delete_from_index(deleted, index)
+    db.session.close()
+    click.echo('Caught up with {} records changed and {} deleted since {}.'.format(
+        len(uuids), len(deleted), since))
+
+    return failed
+
+
+def rebuild_index(pid_type, workers, chunk_size=CHUNK_SIZE, retry_file=None,
+                  delete_concrete_index=False):
+    """Rebuild the index of a PID type without interrupting searches.
+
+    A new version of the index is created with the current mapping and
+    bulk-loaded while the old one keeps serving requests. The records
+    changed meanwhile are then indexed again, and the alias of the index
+    is atomically moved to the new version, which later changes also catch
+    up with. The old version is kept, and can be deleted once the new one
+    has been checked.
+
+    The index created by ``inspirehep index init`` has the name of the
+    alias, so it has to be deleted to be replaced by it, which is only
+    done if ``delete_concrete_index`` is set.
+
+    Returns:
+        str: the name of the new index.
+
+    Raises:
+        click.ClickException: if the index has to be deleted and
+            ``delete_concrete_index`` is not set.
+    """
+    alias = _get_index_of_pid_type(pid_type)
+    _check_concrete_index(alias, delete_concrete_index)
+    new_index = get_next_index_name(alias)
+
+    with open(current_search.mappings[alias]) as fd:
+        body = json.load(fd)
+    body.setdefault('settings', {}).update(BULK_INDEX_SETTINGS)
+    es.indices.create(index=new_index, body=body)
+    click.echo('Created index {}.'.format(new_index))
+
+    build_start = datetime.utcnow()
+    _, failed = reindex_records(
+        [pid_type], workers, chunk_size=chunk_size, index=new_index)
+
+    catch_up_start = datetime.utcnow()
+    failed.extend(_catch_up(pid_type, build_start, new_index, chunk_size))
+
+    es.indices.put_settings(index=new_index, body=get_index_settings(new_index))
+    es.indices.refresh(index=new_index)
+
+    old_indices = swap_index_alias(
+        alias, new_index, delete_concrete_index=delete_concrete_index)
+    click.echo('{} now points to {} instead of {}.'.format(
+        alias, new_index, ', '.join(old_indices) or 'the old index'))
+
+    failed.extend(_catch_up(pid_type, catch_up_start, new_index, chunk_size))
+
+    if failed and retry_file:
+        with open(retry_file, 'w') as fd:
+            fd.writelines(uuid + '\n' for uuid in failed)
+        click.echo('{} records could not be indexed, their UUIDs are in {}.'.format(
+            len(failed), retry_file), err=True)
+
+    return new_index
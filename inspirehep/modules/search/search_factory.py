@@ -32,9 +32,32 @@ from invenio_records_rest.errors import InvalidQueryRESTError
 from invenio_records_rest.facets import default_facets_factory
 from invenio_records_rest.sorter import default_sorter_factory
 
+from inspirehep.modules.records.serializers import (
+    json_literature_brief_v1_search,
+)
 from inspirehep.modules.search import IQ
 
 
+def select_source(self, search, search_index):
+    """Don't fetch the fields of the records dropped by the brief serializer.
+
+    :param self: REST view.
+    :param search: Elastic search DSL search instance.
+    :param search_index: Index name.
+    :returns: The search instance.
+    """
+    serializer = self.match_serializers(
+        *self.get_method_serializers(request.method))
+    if serializer is not json_literature_brief_v1_search:
+        return search
+
+    excludes = current_app.config['RECORDS_BRIEF_SOURCE_EXCLUDES'].get(search_index)
+    if excludes:
+        search = search.source(exclude=excludes)
+
+    return search
+
+
 def inspire_search_factory(self, search):
     """Parse query using Inspire-Query-Parser.
 
@@ -61,6 +84,7 @@ def inspire_search_factory(self, search):
     search_index = search._index[0]
     search, urlkwargs = default_facets_factory(search, search_index)
     search, sortkwargs = default_sorter_factory(search, search_index)
+    search = select_source(self, search, search_index)
     for key, value in sortkwargs.items():
         urlkwargs.add(key, value)
 
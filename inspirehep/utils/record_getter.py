@@ -24,11 +24,21 @@
 
 from __future__ import absolute_import, division, print_function
 
+import sys
+from collections import Counter, defaultdict
 from functools import wraps
 
-from flask import current_app
+from elasticsearch import NotFoundError, TransportError
+from flask import current_app, g, has_request_context
+from six import iteritems, reraise
+from sqlalchemy import event
+from sqlalchemy.orm.exc import NoResultFound
 from werkzeug.utils import import_string
 
+from invenio_cache import current_cache
+from invenio_db import db
+from invenio_search import current_search_client as es
+from invenio_pidstore.errors import PIDDoesNotExistError
 from invenio_pidstore.models import PersistentIdentifier
 
 from inspirehep.modules.pidstore.utils import get_endpoint_from_pid_type
@@ -62,38 +72,254 @@ def raise_record_getter_error_and_log(f):
     return wrapper
 
 
+pid_cache_stats = Counter()
+"""Lookups of PIDs answered by the request cache, by Redis, or by the DB."""
+
+PID_CACHE_KEYS_TO_INVALIDATE = 'inspirehep_pid_cache_keys_to_invalidate'
+
+
+def get_pid_cache_stats():
+    """Return the PID cache counters of this process.
+
+    ``queries_saved`` is the number of ``PersistentIdentifier`` lookups that
+    did not need to query the DB.
+    """
+    stats = dict(pid_cache_stats)
+    stats['queries_saved'] = pid_cache_stats['request_hits'] + pid_cache_stats['redis_hits']
+    return stats
+
+
+def _get_pid_key(pid_type, pid_value):
+    return 'pid:{}:{}'.format(pid_type, pid_value)
+
+
+def _get_uuid_key(uuid):
+    return 'pid_type:{}'.format(uuid)
+
+
+def _get_request_cache():
+    if not has_request_context():
+        return {}
+    if 'pid_cache' not in g:
+        g.pid_cache = {}
+    return g.pid_cache
+
+
+def _get_cached(keys):
+    """Look up ``keys`` in the request cache, then in Redis."""
+    request_cache = _get_request_cache()
+    found = {key: request_cache[key] for key in keys if key in request_cache}
+    pid_cache_stats['request_hits'] += len(found)
+
+    missing = [key for key in keys if key not in found]
+    if missing:
+        values = current_cache.get_many(*missing)
+        from_redis = {key: value for key, value in zip(missing, values) if value is not None}
+        pid_cache_stats['redis_hits'] += len(from_redis)
+        request_cache.update(from_redis)
+        found.update(from_redis)
+
+    return found
+
+
+def _set_cached(mapping):
+    _get_request_cache().update(mapping)
+    current_cache.set_many(
+        mapping,
+        timeout=current_app.config['RECORDS_PID_CACHE_TIMEOUT'],
+    )
+
+
+def invalidate_pid_cache(pid_type, pid_value, uuid=None):
+    """Forget the cached UUID of a PID and, if given, the PID type of a UUID.
+
+    Must be called whenever a PID is created, deleted or redirected, before
+    the transaction doing it is committed. The keys are only removed from
+    Redis once it is, as other processes could otherwise cache again the
+    values that are about to change.
+    """
+    keys = [_get_pid_key(pid_type, pid_value)]
+    if uuid:
+        keys.append(_get_uuid_key(uuid))
+
+    request_cache = _get_request_cache()
+    for key in keys:
+        request_cache.pop(key, None)
+    db.session.info.setdefault(PID_CACHE_KEYS_TO_INVALIDATE, set()).update(keys)
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_pid_cache_after_commit(session):
+    """Remove from the caches the keys invalidated by a transaction."""
+    # Also sent when a savepoint is released.
+    if session.transaction is not None and session.transaction.nested:
+        return
+
+    keys = session.info.pop(PID_CACHE_KEYS_TO_INVALIDATE, None)
+    if keys:
+        _delete_cached(sorted(keys))
+
+
+def _delete_cached(keys):
+    request_cache = _get_request_cache()
+    for key in keys:
+        request_cache.pop(key, None)
+    current_cache.delete_many(*keys)
+
+
+def get_object_uuids(pid_type, pid_values, use_cache=True):
+    """Return the object UUIDs of the PIDs that exist, keyed by PID value.
+
+    PIDs that are not cached are looked up in a single DB query. If
+    ``use_cache`` is ``False`` all of them are, and the cache is refreshed.
+    """
+    keys = {str(pid_value): _get_pid_key(pid_type, pid_value) for pid_value in pid_values}
+    cached = _get_cached(list(keys.values())) if use_cache else {}
+    uuids = {
+        pid_value: cached[key]
+        for pid_value, key in keys.items()
+        if key in cached
+    }
+
+    missing = [pid_value for pid_value in keys if pid_value not in uuids]
+    if missing:
+        pid_cache_stats['misses'] += len(missing)
+        pids = PersistentIdentifier.query.filter(
+            PersistentIdentifier.pid_value.in_(missing),
+            PersistentIdentifier.pid_type == pid_type
+        ).all()
+        found = {pid.pid_value: str(pid.object_uuid) for pid in pids}
+        if found:
+            _set_cached({keys[pid_value]: uuid for pid_value, uuid in found.items()})
+        if not use_cache:
+            _delete_cached([keys[pid_value] for pid_value in missing if pid_value not in found])
+        uuids.update(found)
+
+    return uuids
+
+
+def get_object_uuid(pid_type, pid_value, use_cache=True):
+    """Return the object UUID of a PID.
+
+    Raises:
+        PIDDoesNotExistError: if the PID does not exist.
+    """
+    uuid = get_object_uuids(pid_type, [pid_value], use_cache=use_cache).get(str(pid_value))
+    if uuid is None:
+        raise PIDDoesNotExistError(pid_type, pid_value)
+    return uuid
+
+
+def get_pid_type_from_uuid(uuid, use_cache=True):
+    """Return the PID type of the record with the given UUID."""
+    key = _get_uuid_key(uuid)
+    cached = _get_cached([key]) if use_cache else {}
+    if key in cached:
+        return cached[key]
+
+    pid_cache_stats['misses'] += 1
+    pid_type = PersistentIdentifier.query.filter_by(object_uuid=uuid).one().pid_type
+    _set_cached({key: pid_type})
+    return pid_type
+
+
+def _call_with_object_uuid(pid_type, pid_value, f):
+    """Call ``f`` with the UUID of the PID, retrying once if it was stale.
+
+    The cached UUID is considered stale if no record was found with it and
+    the PID now points to another one.
+    """
+    uuid = get_object_uuid(pid_type, pid_value)
+    try:
+        return f(uuid)
+    except (NotFoundError, NoResultFound):
+        exc_info = sys.exc_info()
+        fresh_uuid = get_object_uuid(pid_type, pid_value, use_cache=False)
+        if fresh_uuid == uuid:
+            reraise(*exc_info)
+        return f(fresh_uuid)
+
+
 @raise_record_getter_error_and_log
 def get_es_record(pid_type, recid, **kwargs):
-    pid = PersistentIdentifier.get(pid_type, recid)
-
     endpoint = get_endpoint_from_pid_type(pid_type)
     search_conf = current_app.config['RECORDS_REST_ENDPOINTS'][endpoint]
     search_class = import_string(search_conf['search_class'])()
 
-    return search_class.get_source(pid.object_uuid, **kwargs)
+    return _call_with_object_uuid(
+        pid_type, recid, lambda uuid: search_class.get_source(uuid, **kwargs))
 
 
 def get_es_records(pid_type, recids, **kwargs):
     """Get a list of recids from ElasticSearch."""
-    recids = [str(recid) for recid in recids]
-    uuids = PersistentIdentifier.query.filter(
-        PersistentIdentifier.pid_value.in_(recids),
-        PersistentIdentifier.pid_type == pid_type
-    ).all()
-    uuids = [str(uuid.object_uuid) for uuid in uuids]
-
     endpoint = get_endpoint_from_pid_type(pid_type)
     search_conf = current_app.config['RECORDS_REST_ENDPOINTS'][endpoint]
     search_class = import_string(search_conf['search_class'])()
 
-    return search_class.mget(uuids, **kwargs)
+    uuids = sorted(get_object_uuids(pid_type, recids).values())
+    try:
+        return search_class.mget(uuids, **kwargs)
+    except KeyError:
+        # A document was not found: some cached UUIDs might be stale.
+        exc_info = sys.exc_info()
+        fresh_uuids = sorted(get_object_uuids(pid_type, recids, use_cache=False).values())
+        if fresh_uuids == uuids:
+            reraise(*exc_info)
+        return search_class.mget(fresh_uuids, **kwargs)
+
+
+def get_es_records_by_pids(pids, **kwargs):
+    """Get records of any PID type from ElasticSearch with a single mget.
+
+    Args:
+        pids(Iterable[tuple]): ``(pid_type, pid_value)`` of the records.
+        kwargs: passed to ``mget``, for example ``_source``.
+
+    Returns:
+        dict: the records found, keyed by ``(pid_type, pid_value)``, where
+        ``pid_value`` is a string. It is empty if Elasticsearch can't be
+        reached.
+    """
+    pid_values_by_type = defaultdict(set)
+    for pid_type, pid_value in pids:
+        pid_values_by_type[pid_type].add(str(pid_value))
+
+    docs = []
+    pids_by_uuid = {}
+    for pid_type, pid_values in iteritems(pid_values_by_type):
+        endpoint = get_endpoint_from_pid_type(pid_type)
+        search_conf = current_app.config['RECORDS_REST_ENDPOINTS'][endpoint]
+        search_class = import_string(search_conf['search_class'])
+
+        for pid_value, uuid in iteritems(get_object_uuids(pid_type, pid_values)):
+            pids_by_uuid[uuid] = (pid_type, pid_value)
+            docs.append({
+                '_index': search_class.Meta.index,
+                '_type': search_class.Meta.doc_types,
+                '_id': uuid,
+            })
+
+    if not docs:
+        return {}
+
+    try:
+        response = es.mget(body={'docs': docs}, **kwargs)
+    except TransportError:
+        current_app.logger.exception("Can't get records %s", sorted(pids_by_uuid.values()))
+        return {}
+
+    return {
+        pids_by_uuid[doc['_id']]: doc['_source']
+        for doc in response['docs']
+        if doc.get('found')
+    }
 
 
 @raise_record_getter_error_and_log
 def get_es_record_by_uuid(uuid):
-    pid = PersistentIdentifier.query.filter_by(object_uuid=uuid).one()
+    pid_type = get_pid_type_from_uuid(uuid)
 
-    endpoint = get_endpoint_from_pid_type(pid.pid_type)
+    endpoint = get_endpoint_from_pid_type(pid_type)
     search_conf = current_app.config['RECORDS_REST_ENDPOINTS'][endpoint]
     search_class = import_string(search_conf['search_class'])()
 
@@ -103,5 +329,4 @@ def get_es_record_by_uuid(uuid):
 @raise_record_getter_error_and_log
 def get_db_record(pid_type, recid):
     from inspirehep.modules.records.api import InspireRecord
-    pid = PersistentIdentifier.get(pid_type, recid)
-    return InspireRecord.get_record(pid.object_uuid)
+    return _call_with_object_uuid(pid_type, recid, InspireRecord.get_record)
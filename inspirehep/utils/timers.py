@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""Cumulative per-stage timers for long running pipelines."""
+
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+
+_active = threading.local()
+
+
+class StageTimer(object):
+    """Accumulate the time spent in, and the number of calls to, each stage.
+
+    Times are exclusive: when a stage runs inside another one, its time is
+    not counted again in the outer stage.
+    """
+
+    def __init__(self):
+        self.times = Counter()
+        self.counts = Counter()
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as part of the ``name`` stage."""
+        self._stack.append(name)
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self._stack.pop()
+            self.times[name] += elapsed
+            self.counts[name] += 1
+            if self._stack:
+                self.times[self._stack[-1]] -= elapsed
+
+    @contextmanager
+    def activate(self):
+        """Make this timer collect the stages timed with :func:`timed_stage`."""
+        previous = getattr(_active, 'timer', None)
+        _active.timer = self
+        try:
+            yield self
+        finally:
+            _active.timer = previous
+
+    def as_stats(self):
+        """Return the timers as a flat dict of ``<stage>_time`` and ``<stage>_count``."""
+        stats = {}
+        for name in self.counts:
+            stats['{}_time'.format(name)] = self.times[name]
+            stats['{}_count'.format(name)] = self.counts[name]
+
+        return stats
+
+
+@contextmanager
+def timed_stage(name):
+    """Time the enclosed block in the active timer, if any."""
+    timer = getattr(_active, 'timer', None)
+    if timer is None:
+        yield
+    else:
+        with timer.stage(name):
+            yield
+
+
+def timed(name):
+    """Decorator timing every call of a function as part of a stage."""
+    def _decorator(func):
+        @wraps(func)
+        def _wrapper(*args, **kwargs):
+            with timed_stage(name):
+                return func(*args, **kwargs)
+        return _wrapper
+    return _decorator
+
+
+def get_stage_stats(stats):
+    """Extract the per-stage totals from flat ``<stage>_time`` stats.
+
+    Returns:
+        list: ``(stage, time, count)`` tuples, slowest stage first.
+    """
+    stages = [key[:-len('_time')] for key in stats if key.endswith('_time')]
+
+    return sorted(
+        (
+            (stage, float(stats[stage + '_time']), int(stats.get(stage + '_count', 0)))
+            for stage in stages
+        ),
+        key=lambda stage: stage[1],
+        reverse=True,
+    )
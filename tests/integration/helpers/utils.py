@@ -30,7 +30,7 @@ import requests_mock
 from invenio_db import db
 from invenio_pidstore.models import PersistentIdentifier, RecordIdentifier
 
-from inspirehep.utils.record_getter import get_db_record
+from inspirehep.utils.record_getter import get_db_record, invalidate_pid_cache
 
 
 def _delete_record(pid_type, pid_value):
@@ -46,6 +46,7 @@ def _delete_record(pid_type, pid_value):
     object_uuid = pid.object_uuid
     PersistentIdentifier.query.filter(
         object_uuid == PersistentIdentifier.object_uuid).delete()
+    invalidate_pid_cache(pid_type, pid_value, object_uuid)
 
     db.session.commit()
 
@@ -87,3 +87,90 @@ def test_alembic_revision_cb9f81e8251c(alembic_app):
     assert 'idxgincollections' in index_names
 
     drop_alembic_version_table()
+
+
+def test_alembic_revision_a24895affbb2(alembic_app):
+    def get_columns(tablename):
+        return [column['name'] for column in inspect(db.engine).get_columns(tablename)]
+
+    ext = alembic_app.extensions['invenio-db']
+
+    if db.engine.name == 'sqlite':
+        raise pytest.skip('Upgrades are not supported on SQLite.')
+
+    ext.alembic.stamp()
+
+    ext.alembic.downgrade(target='cb9f81e8251c')
+
+    assert 'marcxml_digest' not in get_columns('inspire_prod_records')
+
+    ext.alembic.upgrade(target='a24895affbb2')
+
+    assert 'marcxml_digest' in get_columns('inspire_prod_records')
+
+    drop_alembic_version_table()
+
+
+def test_alembic_revision_e6c8b0b7f3d1(alembic_app):
+    def get_indexes(tablename):
+        index_names = db.session.execute("select indexname from pg_indexes where tablename='{}'".format(tablename)).fetchall()
+        return [index[0] for index in index_names]
+
+    ext = alembic_app.extensions['invenio-db']
+
+    if db.engine.name == 'sqlite':
+        raise pytest.skip('Upgrades are not supported on SQLite.')
+
+    ext.alembic.stamp()
+
+    ext.alembic.downgrade(target='a24895affbb2')
+
+    assert 'idxginjson' not in get_indexes('records_metadata')
+
+    ext.alembic.upgrade(target='e6c8b0b7f3d1')
+
+    assert 'idxginjson' in get_indexes('records_metadata')
+
+    drop_alembic_version_table()
+
+
+def test_alembic_revision_f2b5c1e8a9d4(alembic_app):
+    def get_indexes(tablename):
+        index_names = db.session.execute("select indexname from pg_indexes where tablename='{}'".format(tablename)).fetchall()
+        return [index[0] for index in index_names]
+
+    ext = alembic_app.extensions['invenio-db']
+
+    if db.engine.name == 'sqlite':
+        raise pytest.skip('Upgrades are not supported on SQLite.')
+
+    ext.alembic.stamp()
+
+    ext.alembic.downgrade(target='e6c8b0b7f3d1')
+
+    assert 'idxfileschecksum' not in get_indexes('files_files')
+
+    ext.alembic.upgrade(target='f2b5c1e8a9d4')
+
+    assert 'idxfileschecksum' in get_indexes('files_files')
+
+    drop_alembic_version_table()
+
+
+def test_alembic_revision_b3d7e2a41c5f(alembic_app):
+    ext = alembic_app.extensions['invenio-db']
+
+    if db.engine.name == 'sqlite':
+        raise pytest.skip('Upgrades are not supported on SQLite.')
+
+    ext.alembic.stamp()
+
+    ext.alembic.downgrade(target='f2b5c1e8a9d4')
+
+    assert 'records_citation_count' not in inspect(db.engine).get_table_names()
+
+    ext.alembic.upgrade(target='b3d7e2a41c5f')
+
+    assert 'records_citation_count' in inspect(db.engine).get_table_names()
+
+    drop_alembic_version_table()
@@ -28,19 +28,30 @@ import zlib
 
 import pytest
 from flask import current_app
+from mock import patch
 from redis import StrictRedis
 
 from inspirehep.modules.migrator.models import InspireProdRecords
-from inspirehep.modules.migrator.tasks import continuous_migration
+from inspirehep.modules.migrator.tasks import (
+    MigrationCheckpoint,
+    continuous_migration,
+    get_migration_stats,
+    migrate_chunk,
+    migrate_recid_range,
+)
 from inspirehep.utils.record_getter import get_db_record
 
 from utils import _delete_record
 
 
-def push_to_redis(record_file):
-    record = pkg_resources.resource_string(
+def read_fixture(record_file):
+    return pkg_resources.resource_string(
         __name__, os.path.join('fixtures', record_file))
 
+
+def push_to_redis(record_file):
+    record = read_fixture(record_file)
+
     redis_url = current_app.config.get('CACHE_REDIS_URL')
     r = StrictRedis.from_url(redis_url)
     r.rpush('legacy_records', zlib.compress(record))
@@ -52,6 +63,9 @@ def flush_redis():
     redis_url = current_app.config.get('CACHE_REDIS_URL')
     r = StrictRedis.from_url(redis_url)
     r.delete('legacy_records')
+    r.delete('legacy_records:stats')
+    r.delete('legacy_records:errors')
+    r.delete('migrator:stats')
 
 
 @pytest.fixture(scope='function')
@@ -87,6 +101,34 @@ def record_1502656_and_update():
     _delete_record('lit', 1502656)
 
 
+@pytest.fixture(scope='function')
+def cleanup_1502656():
+    yield
+
+    _delete_record('lit', 1502656)
+
+
+def test_migrate_chunk_handles_record_and_its_update_in_the_same_chunk(app, cleanup_1502656):
+    record = read_fixture('1502656.xml')
+    update = read_fixture('1502656_update.xml')
+
+    stats = migrate_chunk([record, update])
+
+    assert stats['migrated'] == 2
+
+    record = get_db_record('lit', 1502656)
+
+    expected = 1
+    result = len(record['authors'])
+
+    assert expected == result
+
+    expected = update
+    result = InspireProdRecords.query.get(1502656).marcxml
+
+    assert expected == result
+
+
 def test_continuous_migration_handles_a_single_record(app, record_1502656):
     r = StrictRedis.from_url(current_app.config.get('CACHE_REDIS_URL'))
 
@@ -148,3 +190,112 @@ def test_continuous_migration_handles_record_updates(app, record_1502656_and_upd
     result = InspireProdRecords.query.get(1502656).marcxml
 
     assert expected == result
+
+
+def test_migrate_chunk_skips_unchanged_records(app, cleanup_1502656):
+    record = read_fixture('1502656.xml')
+
+    stats = migrate_chunk([record])
+
+    assert stats['created'] == 1
+
+    stats = migrate_chunk([record])
+
+    assert stats['skipped'] == 1
+    assert stats['migrated'] == 0
+
+    stats = migrate_chunk([record], force=True)
+
+    assert stats['skipped'] == 0
+    assert stats['updated'] == 1
+
+
+def test_migrate_chunk_does_not_skip_records_that_failed_to_be_indexed(app, cleanup_1502656):
+    record = read_fixture('1502656.xml')
+
+    def _fail(client, actions, **kwargs):
+        errors = [
+            {'index': {'_id': action['_id'], 'status': 400, 'error': 'Failed'}}
+            for action in actions
+        ]
+        return 0, errors
+
+    with patch('inspirehep.modules.migrator.tasks.es_bulk', side_effect=_fail):
+        stats = migrate_chunk([record])
+
+    assert stats['created'] == 1
+    assert stats['index_failed'] == 1
+    assert InspireProdRecords.query.get(1502656).marcxml_digest is None
+
+    stats = migrate_chunk([record])
+
+    assert stats['skipped'] == 0
+    assert stats['updated'] == 1
+    assert InspireProdRecords.query.get(1502656).marcxml_digest is not None
+
+
+def test_continuous_migration_exports_queue_stats(app, record_1502655_and_1502656):
+    r = StrictRedis.from_url(current_app.config.get('CACHE_REDIS_URL'))
+
+    continuous_migration()
+
+    stats = r.hgetall('legacy_records:stats')
+
+    assert stats['queue_depth'] == '0'
+    assert stats['last_batch_size'] == '2'
+
+
+def test_migrate_chunk_records_stage_stats(app, cleanup_1502656):
+    flush_redis()
+
+    stats = migrate_chunk([read_fixture('1502656.xml')], force=True)
+
+    assert stats['dojson_count'] == 1
+    assert stats['insert_count'] == 1
+    assert stats['index_count'] == 1
+
+    totals = get_migration_stats()
+
+    assert totals['records'] == 1
+    assert totals['dojson_count'] == 1
+
+    flush_redis()
+
+
+def test_migrate_recid_range_reads_marcxml_from_the_database(app, cleanup_1502656):
+    migrate_chunk([read_fixture('1502656.xml')])
+
+    stats = migrate_recid_range(1502656, 1502656, only_broken=False, force=True)
+
+    assert stats['records'] == 1
+    assert stats['updated'] == 1
+
+    stats = migrate_recid_range(1502600, 1502700, only_broken=True, force=True)
+
+    assert stats['records'] == 0
+
+
+def test_migration_checkpoint_skips_the_chunks_not_migrated_yet(app):
+    checkpoint = MigrationCheckpoint('/tmp/dump.xml')
+    checkpoint.clear()
+
+    checkpoint.complete(1, (20, 0), 2)
+
+    assert checkpoint.load() is None
+
+    checkpoint.complete(0, (10, 0), 1)
+    checkpoint.complete(3, (40, 0), 4)
+
+    expected = {'chunk': 1, 'offset': 20, 'skip': 0, 'compressed_offset': 2}
+    result = checkpoint.load()
+
+    assert expected == result
+
+    checkpoint.complete(2, (30, 5), 3)
+
+    expected = {'chunk': 3, 'offset': 40, 'skip': 0, 'compressed_offset': 4}
+    result = checkpoint.load()
+
+    assert expected == result
+
+    checkpoint.clear()
@@ -39,9 +39,17 @@ from invenio_search import current_search_client as es
 from inspire_dojson.hep import hep
 from inspire_utils.record import get_value
 from inspirehep.modules.records.api import InspireRecord
-from inspirehep.modules.records.tasks import merge_merged_records, update_refs
+from inspirehep.modules.records.tasks import (
+    get_update_refs_progress,
+    merge_merged_records,
+    update_refs,
+)
 from inspirehep.modules.migrator.tasks import record_insert_or_replace
-from inspirehep.utils.record_getter import get_db_record, get_es_records
+from inspirehep.utils.record_getter import (
+    get_db_record,
+    get_es_records,
+    get_object_uuid,
+)
 
 from utils import _delete_record, mock_addresses
 
@@ -339,6 +347,38 @@ def test_references_can_be_updated(app, records_to_be_merged):
     assert expected == result
 
 
+def test_references_can_be_updated_from_the_db(app, records_to_be_merged):
+    merged_record = get_db_record('lit', 111)
+    deleted_record = get_db_record('lit', 222)
+
+    deleted_record.merge(merged_record)
+    update_refs.delay(
+        'http://localhost:5000/api/literature/222',
+        'http://localhost:5000/api/literature/111',
+        from_db=True)
+
+    pointing_record = get_db_record('lit', 333)
+
+    expected = 'http://localhost:5000/api/literature/111'
+    result = get_value(
+        pointing_record, 'accelerator_experiments[0].record.$ref')
+
+    assert expected == result
+    assert get_update_refs_progress('http://localhost:5000/api/literature/222') == {}
+
+
+def test_merge_invalidates_the_pid_cache(app, records_to_be_merged):
+    merged_record = get_db_record('lit', 111)
+    deleted_record = get_db_record('lit', 222)
+
+    assert get_object_uuid('lit', 222) == str(deleted_record.id)
+
+    deleted_record.merge(merged_record)
+    db.session.commit()
+
+    assert get_object_uuid('lit', 222) != str(deleted_record.id)
+
+
 def test_get_es_records_handles_empty_lists(app):
     get_es_records('lit', [])  # Does not raise.
 
@@ -542,6 +582,56 @@ def test_update_handles_figures(app):
     assert file_content == expected_file_content
 
 
+def test_create_stores_identical_figures_once(app):
+    record_json = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': 1,
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'foo'},
+        ],
+        '_collections': [
+            'Literature'
+        ],
+        'figures': [
+            {
+                'key': 'graph.png',
+                'url': 'http://www.mdpi.com/2218-1997/3/1/24/png',
+            },
+            {
+                'key': 'same_graph.png',
+                'url': 'http://www.mdpi.com/2218-1997/3/1/25/png',
+            },
+        ],
+    }
+
+    mocked_addresses = [
+        {
+            'method': 'GET',
+            'url': 'http://www.mdpi.com/2218-1997/3/1/24/png',
+            'body': StringIO.StringIO('identical body'),
+        },
+        {
+            'method': 'GET',
+            'url': 'http://www.mdpi.com/2218-1997/3/1/25/png',
+            'body': StringIO.StringIO('identical body'),
+        },
+    ]
+    with mock_addresses(mocked_addresses):
+        record = InspireRecord.create(record_json)
+
+    assert len(record.files) == 2
+    assert len(record['figures']) == 2
+
+    graph = record.files['1_graph.png'].obj
+    same_graph = record.files['1_same_graph.png'].obj
+
+    assert graph.file_id == same_graph.file_id
+    assert open(same_graph.file.uri).read() == 'identical body'
+
+
 @patch(
     'inspirehep.modules.records.utils.open',
     mock_open(read_data='doc1 body'),
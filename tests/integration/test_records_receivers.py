@@ -22,10 +22,16 @@
 
 from __future__ import absolute_import, division, print_function
 
+import mock
 import pytest
 from elasticsearch import NotFoundError
+from flask import current_app
+from redis import StrictRedis
+
+from invenio_db import db
 
 from inspirehep.modules.records.api import InspireRecord
+from inspirehep.modules.records.tasks import INDEX_QUEUE, process_index_queue
 from inspirehep.modules.search import LiteratureSearch
 from inspirehep.utils.record import get_title
 
@@ -64,3 +70,104 @@ def test_that_db_changes_are_mirrored_in_es(app):
 
     with pytest.raises(NotFoundError):
         es_record = search.get_source(record.id)
+
+
+def test_that_records_committed_together_are_indexed_together(app):
+    search = LiteratureSearch()
+    records = [
+        InspireRecord.create({
+            '$schema': 'http://localhost:5000/schemas/records/hep.json',
+            'document_type': [
+                'article',
+            ],
+            'titles': [
+                {'title': title},
+            ],
+            '_collections': ['Literature']
+        }) for title in ('foo', 'bar')
+    ]
+    db.session.commit()
+
+    assert [get_title(search.get_source(record.id)) for record in records] == ['foo', 'bar']
+
+    for record in records:
+        record._delete(force=True)
+    db.session.commit()
+
+    for record in records:
+        with pytest.raises(NotFoundError):
+            search.get_source(record.id)
+
+
+def test_that_async_indexing_indexes_the_latest_revision_once(app):
+    search = LiteratureSearch()
+    r = StrictRedis.from_url(current_app.config['CACHE_REDIS_URL'])
+    json = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'foo'},
+        ],
+        '_collections': ['Literature']
+    }
+
+    with mock.patch.dict(current_app.config, {'RECORDS_ASYNC_INDEXING': True}), \
+            mock.patch('inspirehep.modules.records.tasks.process_index_queue.apply_async'):
+        record = InspireRecord.create(json)
+        db.session.commit()
+        record['titles'][0]['title'] = 'bar'
+        record.commit()
+        db.session.commit()
+
+        with pytest.raises(NotFoundError):
+            search.get_source(record.id)
+
+        assert r.hgetall(INDEX_QUEUE) == {str(record.id): str(record.revision_id)}
+
+        process_index_queue()
+
+        assert get_title(search.get_source(record.id)) == 'bar'
+        assert not r.exists(INDEX_QUEUE)
+
+        record._delete(force=True)
+        db.session.commit()
+
+        with pytest.raises(NotFoundError):
+            search.get_source(record.id)
+
+
+def test_that_async_indexing_keeps_the_records_that_failed_in_the_queue(app):
+    r = StrictRedis.from_url(current_app.config['CACHE_REDIS_URL'])
+    json = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'foo'},
+        ],
+        '_collections': ['Literature']
+    }
+
+    with mock.patch.dict(current_app.config, {'RECORDS_ASYNC_INDEXING': True}), \
+            mock.patch('inspirehep.modules.records.tasks.process_index_queue.apply_async') as apply_async:
+        record = InspireRecord.create(json)
+        db.session.commit()
+        apply_async.reset_mock()
+
+        failure = ('index', {'_id': str(record.id), 'status': 503, 'error': 'Unavailable'})
+        with mock.patch('inspirehep.modules.records.tasks.index_records_in_bulk',
+                        return_value=(0, [failure])):
+            process_index_queue()
+
+        assert r.hgetall(INDEX_QUEUE) == {str(record.id): str(record.revision_id)}
+        assert apply_async.called
+
+        process_index_queue()
+
+        assert not r.exists(INDEX_QUEUE)
+
+        record._delete(force=True)
+        db.session.commit()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+from __future__ import absolute_import, division, print_function
+
+import json
+from datetime import datetime
+
+import click
+import mock
+import pytest
+from flask import current_app
+
+from invenio_db import db
+from invenio_search import current_search, current_search_client as es
+
+from inspirehep.modules.migrator.tasks import record_insert_or_replace
+from inspirehep.modules.search.reindex import (
+    _catch_up,
+    bulk_index_settings,
+    get_next_index_name,
+    reindex_chunk,
+    swap_index_alias,
+)
+from inspirehep.utils.record_getter import get_db_record, get_es_record
+
+from utils import _delete_record
+
+
+def test_reindex_chunk_indexes_records_in_a_range_of_uuids(app):
+    record = record_insert_or_replace({
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': 1234568,
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'indexed by range'},
+        ],
+        '_collections': ['Literature'],
+    })
+    db.session.commit()
+    uuid = str(record.id)
+    try:
+        es.delete(index='records-hep', doc_type='hep', id=uuid, ignore=404)
+
+        read, failed = reindex_chunk(('range', uuid, uuid), ['lit'])
+        es.indices.refresh('records-hep')
+
+        assert read == 1
+        assert failed == []
+        assert get_es_record('lit', 1234568)['titles'] == [
+            {'title': 'indexed by range'},
+        ]
+    finally:
+        _delete_record('lit', 1234568)
+
+
+def test_reindex_chunk_only_indexes_records_of_the_given_pid_types(app):
+    record = get_db_record('lit', 712925)
+
+    read, failed = reindex_chunk(('ids', [str(record.id)]), ['aut'])
+
+    assert read == 0
+    assert failed == []
+
+
+def test_swap_index_alias_replaces_the_index_then_moves_the_alias(app):
+    es.indices.create(index='test-reindex')
+    es.indices.put_alias(index='test-reindex', name='test-reindex-all')
+    try:
+        assert get_next_index_name('test-reindex') == 'test-reindex-v1'
+        es.indices.create(index='test-reindex-v1')
+
+        with pytest.raises(click.ClickException):
+            swap_index_alias('test-reindex', 'test-reindex-v1')
+        assert es.indices.exists(index='test-reindex')
+
+        assert swap_index_alias(
+            'test-reindex', 'test-reindex-v1', delete_concrete_index=True) == []
+        assert es.indices.get_alias(index='test-reindex') == {
+            'test-reindex-v1': {'aliases': {'test-reindex': {}, 'test-reindex-all': {}}},
+        }
+
+        assert get_next_index_name('test-reindex') == 'test-reindex-v2'
+        es.indices.create(index='test-reindex-v2')
+
+        assert swap_index_alias('test-reindex', 'test-reindex-v2') == ['test-reindex-v1']
+        assert es.indices.get_alias(index='test-reindex') == {
+            'test-reindex-v2': {'aliases': {'test-reindex': {}, 'test-reindex-all': {}}},
+        }
+    finally:
+        es.indices.delete(index='test-reindex*')
+
+
+def test_catch_up_removes_the_records_deleted_meanwhile(app):
+    with open(current_search.mappings['records-hep']) as fd:
+        es.indices.create(index='test-catch-up', body=json.load(fd))
+    record = record_insert_or_replace({
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': 1234567,
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'deleted while rebuilding'},
+        ],
+        '_collections': ['Literature'],
+    })
+    db.session.commit()
+    try:
+        reindex_chunk(('ids', [str(record.id)]), ['lit'], index='test-catch-up')
+        since = datetime.utcnow()
+
+        record.delete()
+        db.session.commit()
+        _catch_up('lit', since, 'test-catch-up', 10)
+
+        assert not es.exists(index='test-catch-up', doc_type='hep', id=str(record.id))
+    finally:
+        _delete_record('lit', 1234567)
+        es.indices.delete(index='test-catch-up')
+
+
+def test_catch_up_indexes_the_records_changed_just_before(app):
+    with open(current_search.mappings['records-hep']) as fd:
+        es.indices.create(index='test-catch-up', body=json.load(fd))
+    record = record_insert_or_replace({
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': 1234569,
+        'document_type': [
+            'article',
+        ],
+        'titles': [
+            {'title': 'committed while rebuilding'},
+        ],
+        '_collections': ['Literature'],
+    })
+    db.session.commit()
+    try:
+        _catch_up('lit', datetime.utcnow(), 'test-catch-up', 10)
+
+        assert es.exists(index='test-catch-up', doc_type='hep', id=str(record.id))
+    finally:
+        _delete_record('lit', 1234569)
+        es.indices.delete(index='test-catch-up')
+
+
+def test_bulk_index_settings_restores_the_settings_on_failure(app):
+    es.indices.create(index='test-bulk', body={
+        'settings': {'number_of_replicas': 1, 'refresh_interval': '5s'},
+    })
+    config = {'SEARCH_INDEX_SETTINGS': {'number_of_replicas': 1, 'refresh_interval': '5s'}}
+    try:
+        def get_settings():
+            settings = es.indices.get_settings(index='test-bulk')['test-bulk']['settings']['index']
+            return settings['refresh_interval'], settings['number_of_replicas']
+
+        with mock.patch.dict(current_app.config, config):
+            with pytest.raises(ZeroDivisionError):
+                with bulk_index_settings('test-bulk'):
+                    assert get_settings() == ('-1', '0')
+                    1 / 0
+
+        assert get_settings() == ('5s', '1')
+    finally:
+        es.indices.delete(index='test-bulk')
+
+
+def test_bulk_index_settings_restores_the_settings_set_by_hand(app):
+    es.indices.create(index='test-bulk', body={
+        'settings': {'number_of_replicas': 2, 'refresh_interval': '30s'},
+    })
+    try:
+        with bulk_index_settings('test-bulk'):
+            pass
+
+        settings = es.indices.get_settings(index='test-bulk')['test-bulk']['settings']['index']
+
+        assert settings['refresh_interval'] == '30s'
+        assert settings['number_of_replicas'] == '2'
+    finally:
+        es.indices.delete(index='test-bulk')
+
+
+def test_bulk_index_settings_does_not_keep_the_settings_of_an_interrupted_operation(app):
+    es.indices.create(index='test-bulk', body={
+        'settings': {'number_of_replicas': 0, 'refresh_interval': '-1'},
+    })
+    try:
+        with bulk_index_settings('test-bulk'):
+            pass
+
+        settings = es.indices.get_settings(index='test-bulk')['test-bulk']['settings']['index']
+
+        assert settings['refresh_interval'] == '1s'
+        assert settings['number_of_replicas'] == '1'
+    finally:
+        es.indices.delete(index='test-bulk')
@@ -22,7 +22,15 @@
 
 from __future__ import absolute_import, division, print_function
 
-from inspirehep.modules.authors.utils import bai
+import mock
+
+from inspirehep.modules.authors.utils import (
+    NameCache,
+    bai,
+    clear_name_cache,
+    get_name_cache_stats,
+    phonetic_blocks,
+)
 
 
 def test_that_bai_conforms_to_the_spec():
@@ -46,3 +54,57 @@ def test_that_bai_conforms_to_the_spec():
     assert bai("Müller, Andreas") == "A.Mueller"
     assert bai("Hernández-Tomé, G.") == "G.Hernandez.Tome"
     assert bai("José de Goya y Lucientes, Francisco Y H") == "F.Y.H.Jose.de.Goya.y.Lucientes"
+
+
+def test_name_cache_evicts_the_least_recently_used_names():
+    cache = NameCache(maxsize=2)
+    cache.set('bai', 'Ellis, J.', 'J.Ellis')
+    cache.set('bai', 'Smith, J.', 'J.Smith')
+    cache.get('bai', 'Ellis, J.')
+    cache.set('bai', 'Doe, J.', 'J.Doe')
+
+    assert cache.get('bai', 'Ellis, J.') == 'J.Ellis'
+    assert cache.get('bai', 'Smith, J.') is None
+    assert cache.get('bai', 'Doe, J.') == 'J.Doe'
+
+    expected = {
+        'size': 2,
+        'maxsize': 2,
+        'hits': 3,
+        'misses': 1,
+        'hit_rate': 0.75,
+    }
+    result = cache.stats()
+
+    assert expected == result
+
+
+def test_bai_is_cached_by_normalized_name():
+    clear_name_cache()
+
+    assert bai("Ellis, John Richard") == "J.R.Ellis"
+    assert bai(" Ellis,  John Richard ") == "J.R.Ellis"
+
+    stats = get_name_cache_stats()
+
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+
+
+@mock.patch('inspirehep.modules.authors.utils._block_names')
+def test_phonetic_blocks_only_blocks_the_names_not_in_the_cache(mock_block_names):
+    clear_name_cache()
+    mock_block_names.side_effect = lambda names, algorithm: [
+        name.split(',')[0].upper() for name in names]
+
+    phonetic_blocks(['Ellis, John', 'Smith, John'])
+
+    expected = {
+        'Ellis,  John': 'ELLIS',
+        'Smith, John': 'SMITH',
+        'Doe, John': 'DOE',
+    }
+    result = phonetic_blocks(['Ellis,  John', 'Smith, John', 'Doe, John'])
+
+    assert expected == result
+    mock_block_names.assert_called_with(['Doe, John'], 'nysiis')
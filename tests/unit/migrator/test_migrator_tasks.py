@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+from __future__ import absolute_import, division, print_function
+
+import gzip
+import zlib
+from io import BytesIO
+from uuid import uuid4
+
+import mock
+import pytest
+from flask_sqlalchemy import models_committed
+from lxml import etree
+
+from invenio_records.api import Record
+from invenio_records.models import RecordMetadata
+
+from inspirehep.modules.migrator.tasks import (
+    _count_citations,
+    _migrate_legacy_batch,
+    get_marcxml_digest,
+    iterparse_stream,
+    iterparse_stream_with_positions,
+    index_after_commit,
+    marc_create_record,
+    migrate_chunk,
+    migrate_locally,
+    split_stream_with_positions,
+    update_citation_counts,
+)
+
+
+COLLECTION = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<collection xmlns="http://www.loc.gov/MARC21/slim">\n'
+    b'<record>\n'
+    b'  <controlfield tag="001">1</controlfield>\n'
+    b'  <datafield tag="245" ind1=" " ind2=" ">\n'
+    b'    <subfield code="a">Caf\xc3\xa9</subfield>\n'
+    b'  </datafield>\n'
+    b'</record>\n'
+    b'<record>\n'
+    b'  <controlfield tag="001">2</controlfield>\n'
+    b'</record>\n'
+    b'</collection>\n'
+)
+
+
+def test_split_stream_with_positions():
+    records = [
+        marc_create_record(raw_record, keep_singletons=False)
+        for raw_record, _ in split_stream_with_positions(BytesIO(COLLECTION))
+    ]
+
+    assert [record['001'] for record in records] == ['1', '2']
+    assert records[0]['245__']['a'] == u'Café'
+
+
+def test_split_stream_with_positions_handles_gzipped_streams():
+    buf = BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as fd:
+        fd.write(COLLECTION)
+    buf.seek(0)
+
+    with gzip.GzipFile(fileobj=buf) as fd:
+        result = len(list(split_stream_with_positions(fd)))
+
+    assert result == 2
+
+
+def test_iterparse_stream_clears_consumed_records():
+    elements = []
+    for element in iterparse_stream(BytesIO(COLLECTION)):
+        assert marc_create_record(element)['001'] in ('1', '2')
+        elements.append(element)
+
+    assert all(len(element) == 0 for element in elements)
+
+
+def test_iterparse_stream_with_positions_resumes_after_each_record():
+    collection = (
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<collection xmlns="http://www.loc.gov/MARC21/slim">\n' +
+        b''.join(
+            b'<record><controlfield tag="001">' + str(recid).encode('ascii') +
+            b'</controlfield></record>\n'
+            for recid in range(20)
+        ) +
+        b'</collection>\n'
+    )
+
+    def _read_recids(offset=0, skip=0):
+        elements = iterparse_stream_with_positions(
+            BytesIO(collection), offset, block_size=50)
+        return [
+            (marc_create_record(element)['001'], position)
+            for element, position in elements
+        ][skip:]
+
+    records = _read_recids()
+
+    assert [recid for recid, _ in records] == [str(recid) for recid in range(20)]
+
+    for i, (_, (offset, skip)) in enumerate(records):
+        expected = [str(recid) for recid in range(i + 1, 20)]
+        result = [recid for recid, _ in _read_recids(offset, skip)]
+
+        assert expected == result
+
+
+def test_iterparse_stream_with_positions_keeps_the_namespaces_of_the_root_when_resuming():
+    collection = (
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<!-- <collection> -->\n'
+        b'<marc:collection xmlns:marc="http://www.loc.gov/MARC21/slim">\n' +
+        b''.join(
+            b'<marc:record><marc:controlfield tag="001">' + str(recid).encode('ascii') +
+            b'</marc:controlfield></marc:record>\n'
+            for recid in range(5)
+        ) +
+        b'</marc:collection>\n'
+    )
+
+    def _read_records(offset=0, skip=0):
+        elements = iterparse_stream_with_positions(
+            BytesIO(collection), offset, block_size=50)
+        return [
+            (get_marcxml_digest(etree.tostring(element)), position)
+            for element, position in elements
+        ][skip:]
+
+    records = _read_records()
+
+    for i, (_, (offset, skip)) in enumerate(records):
+        expected = [digest for digest, _ in records[i + 1:]]
+        result = [digest for digest, _ in _read_records(offset, skip)]
+
+        assert expected == result
+
+
+def test_get_marcxml_digest_ignores_namespace_and_blanks():
+    marcxml = (
+        b'<record xmlns="http://www.loc.gov/MARC21/slim">\n'
+        b'  <controlfield tag="001">1</controlfield>\n'
+        b'</record>\n'
+    )
+
+    expected = get_marcxml_digest(marcxml)
+    result = get_marcxml_digest(b'<record><controlfield tag="001">1</controlfield></record>')
+
+    assert expected == result
+
+
+def test_get_marcxml_digest_changes_with_content():
+    digest = get_marcxml_digest(b'<record><controlfield tag="001">1</controlfield></record>')
+
+    assert digest != get_marcxml_digest(b'<record><controlfield tag="001">2</controlfield></record>')
+
+
+def test_count_citations_counts_each_citing_record_once():
+    records = [
+        {'_source': {'references': [{'recid': 1}, {'recid': 1}, {'recid': 2}]}},
+        {'_source': {'references': [{'recid': 1}]}},
+    ]
+
+    counts = _count_citations(records)
+
+    assert counts[1] == 2
+    assert counts[2] == 1
+    assert counts.sum() == 3
+
+
+def test_count_citations_grows_the_array_for_large_recids():
+    records = [
+        {'_source': {'references': [{'recid': 1502656}]}},
+    ]
+
+    counts = _count_citations(records)
+
+    assert counts.size > 1502656
+    assert counts[1502656] == 1
+
+
+def _hep_record_citing(*recids):
+    json = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'references': [
+            {'record': {'$ref': 'http://localhost:5000/api/literature/{}'.format(recid)}}
+            for recid in recids
+        ],
+    }
+    return Record(json, model=RecordMetadata(id=uuid4(), json=json))
+
+
+@mock.patch('inspirehep.modules.migrator.tasks.add_to_citation_counts')
+def test_update_citation_counts(add_to_citation_counts):
+    created = _hep_record_citing(1)
+    updated = _hep_record_citing(1, 3)
+    snapshots = {updated.id: {2, 3}}
+
+    expected = {1: 2, 2: -1}
+    result = update_citation_counts([created, updated, updated], snapshots)
+
+    assert expected == result
+    add_to_citation_counts.assert_called_once_with(result)
+
+
+@mock.patch('inspirehep.modules.migrator.tasks.add_to_citation_counts')
+def test_update_citation_counts_when_disabled(add_to_citation_counts, app):
+    with mock.patch.dict(app.config, {'RECORDS_INCREMENTAL_CITATION_COUNTS': False}):
+        assert not update_citation_counts([_hep_record_citing(1)], {})
+
+    assert not add_to_citation_counts.called
+
+
+@mock.patch('inspirehep.modules.migrator.tasks._migrate_chunk', side_effect=ValueError)
+def test_migrate_chunk_reconnects_the_receivers_when_it_fails(_migrate_chunk):
+    with pytest.raises(ValueError):
+        migrate_chunk([])
+
+    assert index_after_commit in models_committed.receivers_for(object())
+
+
+def _imap_unordered_in_reverse_pairs(func, iterable):
+    """Run the chunks in this process, completing them two by two in reverse order."""
+    done = []
+    for item in iterable:
+        done.append(item)
+        if len(done) == 2:
+            for item in reversed(done):
+                yield func(item)
+            done = []
+    for item in reversed(done):
+        yield func(item)
+
+
+CHUNKS_AFTER_CHECKPOINT = [
+    (3, ['record 3'], (30, 0), 3),
+    (4, ['record 4'], (40, 0), 4),
+    (5, ['record 5'], (50, 0), 5),
+]
+
+
+@mock.patch('inspirehep.modules.migrator.tasks.migrate_chunk')
+@mock.patch('inspirehep.modules.migrator.tasks.read_chunks')
+@mock.patch('inspirehep.modules.migrator.tasks.multiprocessing.Pool')
+@mock.patch('inspirehep.modules.migrator.tasks.bulk_index_settings')
+@mock.patch('inspirehep.modules.migrator.tasks.MigrationCheckpoint')
+@mock.patch('inspirehep.modules.migrator.tasks.db')
+def test_migrate_locally_checkpoints_the_chunks_completed_in_order(
+        db, checkpoint_cls, bulk_index_settings, pool_cls, read_chunks, migrate_chunk):
+    pool = pool_cls.return_value
+    pool.imap_unordered.side_effect = _imap_unordered_in_reverse_pairs
+    read_chunks.return_value = iter(CHUNKS_AFTER_CHECKPOINT)
+    migrate_chunk.return_value = {'records': 1, 'created': 1}
+    checkpoint = checkpoint_cls.return_value
+
+    totals = migrate_locally('dump.xml.gz', workers=1, chunk_size=10, resume=True)
+
+    assert totals['records'] == 3
+    read_chunks.assert_called_once_with('dump.xml.gz', 10, resume=True)
+    assert checkpoint.save.call_args_list == [
+        mock.call(4, (40, 0), 4),
+        mock.call(5, (50, 0), 5),
+    ]
+    checkpoint.clear.assert_called_once_with()
+    pool.close.assert_called_once_with()
+    pool.join.assert_called_once_with()
+    assert not pool.terminate.called
+
+
+@mock.patch('inspirehep.modules.migrator.tasks.migrate_chunk')
+@mock.patch('inspirehep.modules.migrator.tasks.read_chunks')
+@mock.patch('inspirehep.modules.migrator.tasks.multiprocessing.Pool')
+@mock.patch('inspirehep.modules.migrator.tasks.bulk_index_settings')
+@mock.patch('inspirehep.modules.migrator.tasks.MigrationCheckpoint')
+@mock.patch('inspirehep.modules.migrator.tasks.db')
+def test_migrate_locally_keeps_the_checkpoint_when_a_worker_fails(
+        db, checkpoint_cls, bulk_index_settings, pool_cls, read_chunks, migrate_chunk):
+    def _migrate_chunk(chunk, force=False):
+        if chunk == ['record 5']:
+            raise ValueError
+        return {'records': 1, 'created': 1}
+
+    pool = pool_cls.return_value
+    pool.imap_unordered.side_effect = _imap_unordered_in_reverse_pairs
+    read_chunks.return_value = iter(CHUNKS_AFTER_CHECKPOINT)
+    migrate_chunk.side_effect = _migrate_chunk
+    checkpoint = checkpoint_cls.return_value
+
+    with pytest.raises(ValueError):
+        migrate_locally('dump.xml.gz', workers=1, chunk_size=10, resume=True)
+
+    checkpoint.save.assert_called_once_with(4, (40, 0), 4)
+    assert not checkpoint.clear.called
+    assert bulk_index_settings.return_value.__exit__.called
+    pool.terminate.assert_called_once_with()
+    pool.join.assert_called_once_with()
+
+
+@mock.patch('inspirehep.modules.migrator.tasks.migrate_chunk')
+@mock.patch('inspirehep.modules.migrator.tasks.db')
+def test_migrate_legacy_batch_sets_aside_the_records_that_fail(db, migrate_chunk):
+    def _migrate_chunk(chunk):
+        if b'poison' in chunk:
+            raise ValueError
+        return {'records': len(chunk), 'created': len(chunk)}
+
+    migrate_chunk.side_effect = _migrate_chunk
+    r = mock.Mock()
+    raw_records = [zlib.compress(b'record'), zlib.compress(b'poison')]
+
+    stats = _migrate_legacy_batch(r, raw_records)
+
+    assert stats == {'records': 2, 'created': 1, 'failed': 1}
+    r.rpush.assert_called_once_with('legacy_records:errors', raw_records[1])
@@ -22,7 +22,7 @@
 
 from __future__ import absolute_import, division, print_function
 
-from flask import current_app
+from flask import current_app, g
 from mock import patch
 
 from jsonref import JsonRef
@@ -39,13 +39,13 @@ def _build_url(endpoint='literature', recid='42'):
     return '{}/api/{}/{}'.format(server, endpoint, recid)
 
 
-@patch('inspirehep.modules.records.json_ref_loader.record_getter.get_es_record')
+@patch('inspirehep.modules.records.json_ref_loader.record_getter.get_es_records')
 @patch('inspirehep.modules.records.json_ref_loader.record_getter.get_db_record')
-def test_replace_refs_correct_sources(get_db_rec, get_es_rec):
-    with_es_record = {'ES': 'ES'}
+def test_replace_refs_correct_sources(get_db_rec, get_es_recs):
+    with_es_record = {'ES': 'ES', 'control_number': 42}
     with_db_record = {'DB': 'DB'}
 
-    get_es_rec.return_value = with_es_record
+    get_es_recs.return_value = [with_es_record]
     get_db_rec.return_value = with_db_record
 
     db_rec = replace_refs({'$ref': _build_url()}, 'db')
@@ -182,3 +182,49 @@ def test_specific_loaders_return_none(get_db_rec, get_es_rec, g_p_t_f_e):
         assert expect_none == None  # noqa: E711
         assert get_db_rec.call_count == 1
         assert get_es_rec.call_count == 1
+
+
+@patch('inspirehep.modules.records.json_ref_loader.record_getter.get_es_record')
+@patch('inspirehep.modules.records.json_ref_loader.record_getter.get_es_records')
+def test_replace_refs_from_es_fetches_the_records_in_batch(get_es_recs, get_es_rec):
+    get_es_recs.side_effect = lambda pid_type, recids: [
+        {'control_number': int(recid), 'pid_type': pid_type}
+        for recid in recids if recid != '3'
+    ]
+    get_es_rec.return_value = {'control_number': 3, 'pid_type': 'lit'}
+
+    obj = [
+        {'record': {'$ref': _build_url('literature', '1')}},
+        {'record': {'$ref': _build_url('literature', '2')}},
+        {'record': {'$ref': _build_url('literature', '1')}},
+        {'record': {'$ref': _build_url('literature', '3')}},
+        {'record': {'$ref': _build_url('conferences', '4')}},
+    ]
+
+    expected = [
+        {'record': {'control_number': 1, 'pid_type': 'lit'}},
+        {'record': {'control_number': 2, 'pid_type': 'lit'}},
+        {'record': {'control_number': 1, 'pid_type': 'lit'}},
+        {'record': {'control_number': 3, 'pid_type': 'lit'}},
+        {'record': {'control_number': 4, 'pid_type': 'con'}},
+    ]
+    result = replace_refs(obj, 'es')
+
+    assert expected == result
+    assert get_es_recs.call_count == 2
+    get_es_recs.assert_any_call('lit', {'1', '2', '3'})
+    get_es_recs.assert_any_call('con', {'4'})
+    get_es_rec.assert_called_once_with('lit', '3')
+
+
+@patch('inspirehep.modules.records.json_ref_loader.record_getter.get_es_records')
+def test_replace_refs_from_es_memoizes_the_records_in_the_request(get_es_recs, request_context):
+    get_es_recs.return_value = [{'control_number': 5}]
+
+    replace_refs({'$ref': _build_url('literature', '5')}, 'es')
+    result = replace_refs({'$ref': _build_url('literature', '5')}, 'es')
+
+    assert result == {'control_number': 5}
+    assert get_es_recs.call_count == 1
+
+    del g.resolved_refs
@@ -22,19 +22,34 @@
 
 from __future__ import absolute_import, division, print_function
 
-from uuid import UUID
+from copy import deepcopy
+from uuid import UUID, uuid4
 
 import mock
+import pytest
+
+from invenio_records.models import RecordMetadata
 
 from inspire_schemas.api import load_schema, validate
 from inspirehep.modules.records.receivers import (
     assign_phonetic_block,
+    CITATION_COUNTS_TO_INDEX,
+    CITED_RECIDS_SNAPSHOTS,
+    CITED_RECIDS_TO_SNAPSHOT,
     assign_uuid,
+    clear_cited_recids_snapshots,
+    enhance_after_index,
+    get_citation_count_deltas,
+    get_cited_recids,
+    get_ref_tree,
     populate_abstract_source_suggest,
     populate_affiliation_suggest,
     populate_bookautocomplete,
+    populate_citation_count,
+    populate_display,
     populate_earliest_date,
     populate_inspire_document_type,
+    populate_name_variations,
     populate_recid_from_ref,
     populate_title_suggest,
     populate_author_count,
@@ -495,6 +510,97 @@ def test_populate_earliest_date_from_thesis_info_defense_date():
     assert expected == result
 
 
+@mock.patch('inspirehep.modules.records.receivers.get_citation_count')
+def test_populate_citation_count(get_citation_count):
+    get_citation_count.return_value = 42
+    record = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': 1,
+    }
+    populate_citation_count(None, record)
+
+    get_citation_count.assert_called_once_with(1)
+    assert record['citation_count'] == 42
+
+
+@mock.patch('inspirehep.modules.records.receivers.get_citation_count')
+def test_populate_citation_count_ignores_other_records(get_citation_count):
+    record = {
+        '$schema': 'http://localhost:5000/schemas/records/authors.json',
+        'control_number': 1,
+    }
+    populate_citation_count(None, record)
+
+    assert 'citation_count' not in record
+    assert not get_citation_count.called
+
+
+@mock.patch('inspirehep.modules.records.receivers.get_citation_count')
+def test_populate_citation_count_when_disabled(get_citation_count, app):
+    record = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'control_number': 1,
+    }
+    with mock.patch.dict(app.config, {'RECORDS_INCREMENTAL_CITATION_COUNTS': False}):
+        populate_citation_count(None, record)
+
+    assert 'citation_count' not in record
+    assert not get_citation_count.called
+
+
+def test_populate_display():
+    record = {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'authors': [
+            {'full_name': 'Smith, John'},
+            {'full_name': 'Doe, Jane'},
+        ],
+        'earliest_date': '2017-01-01',
+        'publication_info': [
+            {
+                'conference_record': {'$ref': 'http://localhost:5000/api/conferences/1'},
+                'journal_title': 'Phys.Rev.D',
+                'year': 2017,
+            },
+        ],
+        'references': [
+            {'reference': {'title': {'title': 'Foo'}}},
+        ],
+    }
+    populate_display(None, record)
+
+    expected = {
+        'date': 'Jan 1, 2017',
+        'number_of_authors': 2,
+        'number_of_references': 1,
+        'publication_info': [
+            {
+                'journal_title': 'Phys.Rev.D',
+                'journal_volume': '',
+                'year': '2017',
+                'journal_issue': '',
+                'page_start': '',
+                'page_end': '',
+                'artid': '',
+                'pubinfo_freetext': '',
+            },
+        ],
+    }
+    result = record['_display']
+
+    assert expected == result
+
+
+def test_populate_display_ignores_other_records():
+    record = {
+        '$schema': 'http://localhost:5000/schemas/records/authors.json',
+        'name': {'value': 'Smith, John'},
+    }
+    populate_display(None, record)
+
+    assert '_display' not in record
+
+
 def test_populate_earliest_date_from_publication_info_year():
     schema = load_schema('hep')
     subschema = schema['properties']['publication_info']
@@ -661,6 +767,23 @@ def test_populate_recid_from_ref():
     assert json_dict['embedded_record']['recid'] == 5
 
 
+def test_populate_recid_from_ref_only_looks_at_the_paths_of_the_schema():
+    json_dict = {
+        '$schema': 'http://localhost:5000/schemas/records/institutions.json',
+        'related_institutes': [
+            {'record': {'$ref': 'http://localhost:5000/api/institutions/7'}},
+        ],
+        'related_records': [
+            {'record': {'$ref': 'http://localhost:5000/api/institutions/8'}},
+        ],
+    }
+
+    populate_recid_from_ref(None, json_dict)
+
+    assert 'recid' not in json_dict['related_institutes'][0]
+    assert json_dict['related_records'][0]['recid'] == 8
+
+
 def test_populate_recid_from_ref_handles_deleted_records():
     json_dict = {
         'deleted_records': [
@@ -1168,3 +1291,177 @@ def test_populate_author_count_does_nothing_if_record_is_not_literature():
     populate_author_count(None, record)
 
     assert 'author_count' not in record
+
+
+def _hep_record_citing(*recids):
+    return {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'references': [
+            {'record': {'$ref': 'http://localhost:5000/api/literature/{}'.format(recid)}}
+            for recid in recids
+        ] + [{'reference': {'title': {'title': 'Not linked'}}}],
+    }
+
+
+def test_get_cited_recids():
+    expected = {1, 2}
+    result = get_cited_recids(_hep_record_citing(1, 2, 2))
+
+    assert expected == result
+
+
+def test_get_cited_recids_of_deleted_records_is_empty():
+    record = _hep_record_citing(1, 2)
+    record['deleted'] = True
+
+    assert get_cited_recids(record) == set()
+
+
+def test_get_citation_count_deltas():
+    inserted = RecordMetadata(id=uuid4(), json=_hep_record_citing(1, 2))
+    updated = RecordMetadata(id=uuid4(), json=_hep_record_citing(2, 3))
+    deleted = RecordMetadata(id=uuid4(), json=_hep_record_citing(4))
+    not_snapshotted = RecordMetadata(id=uuid4(), json=_hep_record_citing(5))
+
+    changes = [
+        (inserted, 'insert'),
+        (updated, 'update'),
+        (deleted, 'delete'),
+        (not_snapshotted, 'update'),
+    ]
+    snapshots = {
+        updated.id: {1, 2},
+        deleted.id: {4},
+    }
+
+    expected = {2: 1, 3: 1, 4: -1}
+    result = get_citation_count_deltas(changes, snapshots)
+
+    assert expected == result
+
+
+def test_clear_cited_recids_snapshots_on_rollback():
+    session = mock.Mock(info={
+        CITED_RECIDS_TO_SNAPSHOT: {uuid4()},
+        CITED_RECIDS_SNAPSHOTS: {uuid4(): {1}},
+        CITATION_COUNTS_TO_INDEX: {1},
+        'other': 'value',
+    })
+    clear_cited_recids_snapshots(session, mock.Mock(parent=None))
+
+    assert session.info == {'other': 'value'}
+
+
+def test_clear_cited_recids_snapshots_keeps_them_on_savepoint_rollback():
+    info = {
+        CITED_RECIDS_TO_SNAPSHOT: {uuid4()},
+        CITED_RECIDS_SNAPSHOTS: {uuid4(): {1}},
+    }
+    session = mock.Mock(info=deepcopy(info))
+    clear_cited_recids_snapshots(session, mock.Mock(parent=mock.Mock()))
+
+    assert session.info == info
+
+
+@pytest.mark.parametrize('record', [
+    {
+        '$schema': 'http://localhost:5000/schemas/records/hep.json',
+        'abstracts': [
+            {'source': 'arXiv', 'value': 'Lorem ipsum.'},
+            {'value': 'Dolor sit amet.'},
+        ],
+        'authors': [
+            {
+                'full_name': 'Smith, John',
+                'ids': [{'schema': 'INSPIRE BAI', 'value': 'J.Smith.1'}],
+                'record': {'$ref': 'http://localhost:5000/api/authors/1'},
+                'affiliations': [
+                    {
+                        'value': 'CERN',
+                        'record': {'$ref': 'http://localhost:5000/api/institutions/2'},
+                    },
+                ],
+            },
+            {'full_name': 'Doe, Jane', 'inspire_roles': ['supervisor']},
+        ],
+        'deleted_records': [
+            {'$ref': 'http://localhost:5000/api/literature/3'},
+        ],
+        'document_type': ['book'],
+        'imprints': [{'date': '2017-01-01', 'publisher': 'Springer'}],
+        'isbns': [{'value': '9783319000000'}],
+        'preprint_date': '2016-12-24',
+        'publication_info': [
+            {
+                'journal_record': {'$ref': 'http://localhost:5000/api/journals/4'},
+                'year': 2017,
+            },
+        ],
+        'references': [
+            {'record': {'$ref': 'http://localhost:5000/api/literature/5'}},
+            {'reference': {'title': {'title': 'Foo'}}},
+        ],
+        'refereed': True,
+        'self': {'$ref': 'http://localhost:5000/api/literature/6'},
+        'titles': [{'title': 'Bar'}],
+    },
+    {
+        '$schema': 'http://localhost:5000/schemas/records/institutions.json',
+        'ICN': ['CERN'],
+        'legacy_ICN': 'CERN',
+        'related_institutes': [
+            {'record': {'$ref': 'http://localhost:5000/api/institutions/7'}},
+        ],
+        'self': {'$ref': 'http://localhost:5000/api/institutions/8'},
+    },
+    {
+        '$schema': 'http://localhost:5000/schemas/records/journals.json',
+        'journal_title': {'title': 'Physical Review D'},
+        'short_title': 'Phys.Rev.D',
+        'title_variants': ['PRD'],
+    },
+    {
+        '$schema': 'http://localhost:5000/schemas/records/authors.json',
+        'advisors': [
+            {'record': {'$ref': 'http://localhost:5000/api/authors/9'}},
+        ],
+    },
+])
+def test_enhance_after_index_is_the_same_as_running_the_receivers_in_order(record):
+    expected = deepcopy(record)
+    populate_recid_from_ref(None, expected)
+    populate_bookautocomplete(None, expected)
+    populate_abstract_source_suggest(None, expected)
+    populate_affiliation_suggest(None, expected)
+    populate_author_count(None, expected)
+    populate_earliest_date(None, expected)
+    populate_inspire_document_type(None, expected)
+    populate_name_variations(None, expected)
+    populate_title_suggest(None, expected)
+    populate_citation_count(None, expected)
+    populate_display(None, expected)
+
+    result = deepcopy(record)
+    enhance_after_index(None, result)
+
+    assert expected == result
+
+
+@mock.patch('inspirehep.modules.records.receivers.get_ref_paths')
+def test_get_ref_tree(get_ref_paths):
+    get_ref_paths.return_value = frozenset([
+        ('authors', 'affiliations', 'record'),
+        ('authors', 'record'),
+        ('self',),
+    ])
+
+    expected = {
+        'authors': (False, {
+            'affiliations': (False, {'record': (True, {})}),
+            'record': (True, {}),
+        }),
+        'self': (True, {}),
+    }
+    result = get_ref_tree('http://localhost:5000/schemas/records/test_get_ref_tree.json')
+
+    assert expected == result
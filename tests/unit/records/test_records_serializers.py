@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+from __future__ import absolute_import, division, print_function
+
+from mock import PropertyMock, patch
+
+from inspirehep.modules.records.serializers.json_literature import get_display_fields
+from inspirehep.modules.records.wrappers import LiteratureRecord
+
+
+@patch.object(LiteratureRecord, 'admin_tools', new_callable=PropertyMock, return_value=[])
+@patch('inspirehep.modules.records.wrappers.replace_refs')
+def test_get_display_fields_adds_the_conference_information_to_display(replace_refs, admin_tools):
+    replace_refs.side_effect = lambda obj, source: obj
+    record = {
+        '_display': {'number_of_authors': 1},
+        'publication_info': [
+            {'conference_record': {'$ref': 'http://localhost:5000/api/conferences/1'}},
+        ],
+    }
+    references = {
+        ('con', '1'): {'control_number': 1, 'titles': [{'title': 'Conference'}]},
+    }
+
+    expected = {
+        'admin_tools': [],
+        'conference_info': [
+            {
+                'conference_recid': 1,
+                'conference_title': 'Conference',
+                'parent_recid': None,
+                'parent_title': '',
+                'page_start': None,
+                'page_end': None,
+                'artid': None,
+            },
+        ],
+        'number_of_authors': 1,
+    }
+    result = get_display_fields(record, references)
+
+    assert expected == result
+    assert record['_display'] == {'number_of_authors': 1}
@@ -25,7 +25,13 @@ from __future__ import absolute_import, division, print_function
 from flask import current_app
 from mock import patch
 
-from inspirehep.modules.records.tasks import update_links
+from inspirehep.modules.records.tasks import (
+    INDEX_QUEUE,
+    INDEX_QUEUE_BATCH_SIZE,
+    process_index_queue,
+    get_ref_containment_documents,
+    update_links,
+)
 
 
 def test_update_links():
@@ -146,3 +152,54 @@ def test_update_links_ignores_non_whitelisted_paths():
                 'record': {'$ref': 'http://localhost:5000/record/1'},
             }
         }
+
+
+def test_update_links_returns_whether_a_reference_was_updated():
+    config = {
+        'INSPIRE_REF_UPDATER_WHITELISTS': {
+            'literature': [
+                'record',
+            ],
+        },
+    }
+
+    with patch.dict(current_app.config, config):
+        record = {
+            '$schema': 'http://localhost:5000/schemas/record/hep.json',
+            'record': {
+                '$ref': 'http://localhost:5000/record/1',
+            },
+        }
+
+        assert update_links(record, 'http://localhost:5000/record/1', 'http://localhost:5000/record/2')
+        assert not update_links(record, 'http://localhost:5000/record/1', 'http://localhost:5000/record/2')
+
+
+def test_get_ref_containment_documents():
+    ref = {'$ref': 'http://localhost:5000/record/1'}
+
+    expected = [
+        {'authors': {'record': ref}},
+        {'authors': {'record': [ref]}},
+        {'authors': [{'record': ref}]},
+        {'authors': [{'record': [ref]}]},
+    ]
+    result = get_ref_containment_documents(('authors', 'record'), 'http://localhost:5000/record/1')
+
+    assert expected == result
+
+
+@patch('inspirehep.modules.records.tasks._schedule_index_queue')
+@patch('inspirehep.modules.records.tasks.index_records_in_bulk')
+@patch('inspirehep.modules.records.tasks.StrictRedis')
+def test_process_index_queue_processes_a_batch_and_schedules_the_rest(
+        mock_redis, mock_index_records_in_bulk, mock_schedule_index_queue):
+    r = mock_redis.from_url.return_value
+    r.hscan.return_value = (42, {'uuid-1': '1'})
+    mock_index_records_in_bulk.return_value = (1, [])
+
+    process_index_queue()
+
+    r.hscan.assert_called_once_with(INDEX_QUEUE, count=INDEX_QUEUE_BATCH_SIZE)
+    assert not r.hgetall.called
+    mock_schedule_index_queue.assert_called_once_with(r)
@@ -22,7 +22,16 @@
 
 from __future__ import absolute_import, division, print_function
 
-from inspirehep.modules.records.utils import get_endpoint_from_record
+import pytest
+from mock import Mock, mock_open, patch
+
+from inspirehep.modules.records.utils import (
+    FailedToOpenUrlPath,
+    download_files,
+    get_endpoint_from_record,
+    get_ref_paths,
+    iter_values_at_path,
+)
 
 
 def test_get_endpoint_from_record():
@@ -43,3 +52,94 @@ def test_get_endpoint_from_record_supports_relative_urls():
     result = get_endpoint_from_record(record)
 
     assert expected == result
+
+
+def test_get_ref_paths():
+    schema = 'http://localhost:5000/schemas/records/hep.json'
+    result = get_ref_paths(schema)
+
+    assert ('self',) in result
+    assert ('deleted_records',) in result
+    assert ('authors', 'record') in result
+    assert ('authors', 'affiliations', 'record') in result
+    assert ('references', 'record') in result
+    assert ('titles',) not in result
+
+
+def test_get_ref_paths_follows_schema_references():
+    schemas = {
+        'foo.json': {
+            'properties': {
+                'bar': {'$ref': 'elements/bar.json'},
+                'baz': {'items': {'$ref': 'elements/bar.json#/properties/qux'}},
+            },
+        },
+        'elements/bar.json': {
+            'properties': {
+                'qux': {'$ref': 'json_reference.json'},
+            },
+        },
+        'elements/json_reference.json': {
+            'properties': {
+                '$ref': {'type': 'string'},
+            },
+        },
+    }
+
+    with patch('inspirehep.modules.records.utils.load_schema', schemas.__getitem__):
+        result = get_ref_paths('http://localhost:5000/schemas/records/foo.json')
+
+    assert result == {('bar', 'qux'), ('baz',)}
+
+
+def test_get_ref_paths_returns_none_if_the_schema_cannot_be_loaded():
+    with patch('inspirehep.modules.records.utils.load_schema', side_effect=IOError):
+        assert get_ref_paths('http://localhost:5000/schemas/records/missing.json') is None
+
+
+def test_iter_values_at_path_traverses_lists():
+    json = {
+        'authors': [
+            {'affiliations': [{'record': 1}, {'value': 'CERN'}]},
+            {'affiliations': {'record': 2}},
+        ],
+    }
+
+    expected = [1, 2]
+    result = [
+        parent[key] for parent, key
+        in iter_values_at_path(json, ('authors', 'affiliations', 'record'))
+    ]
+
+    assert expected == result
+
+
+@patch('inspirehep.modules.records.utils.open', mock_open(read_data='dummy body'))
+def test_download_files_downloads_each_file_once():
+    downloads = download_files(['/tmp/graph.png', '/tmp/graph.png'], workers=4)
+
+    assert list(downloads) == ['/tmp/graph.png']
+
+    stream, checksum, size = downloads['/tmp/graph.png']
+
+    assert stream.read() == 'dummy body'
+    assert checksum == 'md5:b9cce9bf45065f56d417ec5370dd12f3'
+    assert size == 10
+
+
+@patch('inspirehep.modules.records.utils._download_file')
+def test_download_files_closes_the_downloaded_files_on_failure(mock_download_file):
+    downloaded = Mock()
+
+    def download_file(url):
+        if url == '/tmp/b.png':
+            raise FailedToOpenUrlPath(path=url, msg='not found')
+        return downloaded, 'md5:0', 0
+
+    mock_download_file.side_effect = download_file
+
+    with pytest.raises(FailedToOpenUrlPath):
+        download_files(['/tmp/a.png', '/tmp/b.png', '/tmp/c.png'], workers=1)
+
+    downloaded.close.assert_called_once_with()
+    assert mock_download_file.call_count == 2
@@ -22,7 +22,12 @@
 
 from __future__ import absolute_import, division, print_function
 
-from inspirehep.modules.records.wrappers import LiteratureRecord
+from mock import patch
+
+from inspirehep.modules.records.wrappers import (
+    LiteratureRecord,
+    get_publication_info_references,
+)
 
 
 def test_literature_record_external_system_identifiers():
@@ -64,3 +69,72 @@ def test_literature_record_external_system_identifiers():
     result = record.external_system_identifiers
 
     assert expected == result
+
+
+@patch('inspirehep.modules.records.wrappers.get_es_records_by_pids')
+def test_get_publication_info_references(get_es_records_by_pids):
+    get_es_records_by_pids.return_value = {
+        ('con', '1'): {'control_number': 1, 'titles': [{'title': 'Conference'}]},
+    }
+    records = [
+        {
+            'publication_info': [
+                {
+                    'conference_record': {'$ref': 'http://localhost:5000/api/conferences/1'},
+                    'parent_record': {'$ref': 'http://localhost:5000/api/literature/2'},
+                },
+            ],
+        },
+        {
+            'publication_info': [
+                {
+                    'conference_record': {'$ref': 'http://localhost:5000/api/conferences/1'},
+                },
+            ],
+        },
+        {},
+    ]
+
+    expected = {
+        ('con', '1'): {'control_number': 1, 'titles': [{'title': 'Conference'}]},
+        ('lit', '2'): None,
+    }
+    result = get_publication_info_references(records)
+
+    assert expected == result
+    get_es_records_by_pids.assert_called_once_with(
+        {('con', '1'), ('lit', '2')}, _source=['control_number', 'titles'])
+
+
+@patch('inspirehep.modules.records.wrappers.replace_refs')
+def test_literature_record_get_conference_information_uses_the_references(replace_refs):
+    replace_refs.side_effect = lambda obj, source: obj
+    record = LiteratureRecord({
+        'publication_info': [
+            {
+                'conference_record': {'$ref': 'http://localhost:5000/api/conferences/1'},
+                'parent_record': {'$ref': 'http://localhost:5000/api/literature/2'},
+                'page_start': '1',
+            },
+        ],
+    })
+    references = {
+        ('con', '1'): {'control_number': 1, 'titles': [{'title': 'Conference'}]},
+        ('lit', '2'): {'control_number': 2, 'titles': [{'title': 'Proceedings, Conference'}]},
+    }
+
+    expected = [
+        {
+            'conference_recid': 1,
+            'conference_title': 'Conference',
+            'parent_recid': 2,
+            'parent_title': 'Conference',
+            'page_start': '1',
+            'page_end': None,
+            'artid': None,
+        },
+    ]
+    result = record.get_conference_information(references)
+
+    assert expected == result
+    replace_refs.assert_called_once_with([{}], 'es')
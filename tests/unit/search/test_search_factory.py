@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+from __future__ import absolute_import, division, print_function
+
+from elasticsearch_dsl import Search
+from mock import Mock
+
+from inspirehep.modules.records.serializers import (
+    json_literature_brief_v1_search,
+)
+from inspirehep.modules.search.search_factory import select_source
+
+
+def test_select_source_only_excludes_the_references_from_brief_results(request_context):
+    view = Mock()
+    view.match_serializers.return_value = json_literature_brief_v1_search
+
+    search = select_source(view, Search(), 'records-hep')
+
+    assert search.to_dict()['_source'] == {'exclude': ['references']}
+
+
+def test_select_source_fetches_the_full_records_for_other_formats(request_context):
+    view = Mock()
+    view.match_serializers.return_value = Mock()
+
+    search = select_source(view, Search(), 'records-hep')
+
+    assert '_source' not in search.to_dict()
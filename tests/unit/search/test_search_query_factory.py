@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+from __future__ import absolute_import, division, print_function
+
+import mock
+from flask import current_app
+
+from inspirehep.modules.search.query_factory import (
+    clear_query_cache,
+    get_query_cache_stats,
+    normalize_query,
+    parse_query,
+)
+
+
+def test_normalize_query_collapses_whitespace():
+    assert normalize_query(' find  t   higgs ') == 'find t higgs'
+
+
+def test_normalize_query_keeps_whitespace_in_quotes():
+    assert normalize_query(' t "higgs  boson" ') == 't "higgs  boson"'
+
+
+@mock.patch('inspirehep.modules.search.query_factory.inspire_query_parser.parse_query')
+def test_parse_query_is_cached_by_normalized_query(mock_parse_query):
+    clear_query_cache()
+    mock_parse_query.return_value = {'match': {'titles.full_title': 'higgs'}}
+
+    first = parse_query('find t higgs')
+    second = parse_query(' find  t higgs')
+
+    assert first == second
+    assert first is not second
+    mock_parse_query.assert_called_once_with('find t higgs')
+
+    stats = get_query_cache_stats()
+
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+
+
+@mock.patch('inspirehep.modules.search.query_factory.inspire_query_parser.parse_query')
+def test_parse_query_returns_a_copy(mock_parse_query):
+    clear_query_cache()
+    mock_parse_query.return_value = {'bool': {'must': [{'match_all': {}}]}}
+
+    parse_query('a E.Witten.1')['bool']['must'].append({'match_all': {}})
+
+    expected = {'bool': {'must': [{'match_all': {}}]}}
+    result = parse_query('a E.Witten.1')
+
+    assert expected == result
+
+
+@mock.patch('inspirehep.modules.search.query_factory.inspire_query_parser.parse_query')
+def test_parse_query_does_not_cache_relative_dates(mock_parse_query):
+    clear_query_cache()
+    mock_parse_query.return_value = {'match_all': {}}
+
+    parse_query('de today')
+    parse_query('de today')
+
+    assert mock_parse_query.call_count == 2
+    assert get_query_cache_stats()['uncacheable'] == 2
+
+
+@mock.patch('inspirehep.modules.search.query_factory.current_cache')
+@mock.patch('inspirehep.modules.search.query_factory.inspire_query_parser.parse_query')
+def test_parse_query_uses_redis(mock_parse_query, mock_current_cache):
+    clear_query_cache()
+    mock_current_cache.get.return_value = {'match_all': {}}
+
+    config = {'SEARCH_QUERY_CACHE_REDIS': True}
+
+    with mock.patch.dict(current_app.config, config):
+        result = parse_query('find t higgs')
+
+    assert result == {'match_all': {}}
+    assert get_query_cache_stats()['redis_hits'] == 1
+    mock_parse_query.assert_not_called()
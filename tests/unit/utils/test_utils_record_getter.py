@@ -23,6 +23,9 @@
 from __future__ import absolute_import, division, print_function
 
 import pytest
+from elasticsearch import ConnectionError, NotFoundError
+from flask import g
+from mock import Mock, patch
 
 from inspirehep.utils import record_getter
 
@@ -40,3 +43,124 @@ def test_error_decorator():
 
     with pytest.raises(record_getter.RecordGetterError):
         badfn(None, None)
+
+
+@patch('inspirehep.utils.record_getter.PersistentIdentifier')
+@patch('inspirehep.utils.record_getter.current_cache')
+def test_get_object_uuids_queries_only_the_pids_not_in_the_caches(mock_cache, mock_pid, request_context):
+    g.pid_cache = {'pid:lit:1': 'uuid-1'}
+    mock_cache.get_many.return_value = ['uuid-2', None]
+    mock_pid.query.filter.return_value.all.return_value = [
+        Mock(pid_value='3', object_uuid='uuid-3'),
+    ]
+    record_getter.pid_cache_stats.clear()
+
+    expected = {'1': 'uuid-1', '2': 'uuid-2', '3': 'uuid-3'}
+    result = record_getter.get_object_uuids('lit', [1, 2, 3])
+
+    assert expected == result
+    mock_cache.get_many.assert_called_once_with('pid:lit:2', 'pid:lit:3')
+    mock_cache.set_many.assert_called_once_with({'pid:lit:3': 'uuid-3'}, timeout=3600)
+    assert g.pid_cache == {'pid:lit:1': 'uuid-1', 'pid:lit:2': 'uuid-2', 'pid:lit:3': 'uuid-3'}
+
+    expected = {
+        'request_hits': 1,
+        'redis_hits': 1,
+        'misses': 1,
+        'queries_saved': 2,
+    }
+    result = record_getter.get_pid_cache_stats()
+
+    assert expected == result
+
+    del g.pid_cache
+
+
+@patch('inspirehep.utils.record_getter.PersistentIdentifier')
+@patch('inspirehep.utils.record_getter.current_cache')
+def test_get_object_uuids_keeps_no_cache_outside_of_requests(mock_cache, mock_pid):
+    mock_cache.get_many.return_value = [None]
+    mock_pid.query.filter.return_value.all.return_value = [
+        Mock(pid_value='1', object_uuid='uuid-1'),
+    ]
+
+    record_getter.get_object_uuids('lit', [1])
+
+    assert 'pid_cache' not in g
+
+
+@patch('inspirehep.utils.record_getter.current_cache')
+@patch('inspirehep.utils.record_getter.db')
+def test_invalidate_pid_cache(mock_db, mock_cache, request_context):
+    mock_db.session.info = {}
+    g.pid_cache = {'pid:lit:1': 'uuid-1', 'pid_type:uuid-1': 'lit', 'pid:lit:2': 'uuid-2'}
+
+    record_getter.invalidate_pid_cache('lit', 1, 'uuid-1')
+
+    assert g.pid_cache == {'pid:lit:2': 'uuid-2'}
+    assert not mock_cache.delete_many.called
+
+    record_getter.invalidate_pid_cache_after_commit(mock_db.session)
+
+    mock_cache.delete_many.assert_called_once_with('pid:lit:1', 'pid_type:uuid-1')
+    assert mock_db.session.info == {}
+
+    del g.pid_cache
+
+
+@patch('inspirehep.utils.record_getter.current_cache')
+def test_invalidate_pid_cache_after_commit_waits_for_the_outermost_transaction(mock_cache):
+    keys = {'pid:lit:1'}
+    session = Mock(info={record_getter.PID_CACHE_KEYS_TO_INVALIDATE: keys})
+    session.transaction.nested = True
+
+    record_getter.invalidate_pid_cache_after_commit(session)
+
+    assert not mock_cache.delete_many.called
+    assert session.info == {record_getter.PID_CACHE_KEYS_TO_INVALIDATE: keys}
+
+
+@patch('inspirehep.utils.record_getter.es')
+@patch('inspirehep.utils.record_getter.get_object_uuids')
+@patch('inspirehep.utils.record_getter.import_string')
+@patch('inspirehep.utils.record_getter.get_endpoint_from_pid_type')
+def test_get_es_records_by_pids_returns_nothing_when_elasticsearch_fails(
+        mock_endpoint, mock_import_string, mock_get_object_uuids, mock_es):
+    mock_endpoint.return_value = 'literature'
+    mock_get_object_uuids.return_value = {'1': 'uuid-1'}
+    mock_es.mget.side_effect = ConnectionError('N/A', 'unreachable', None)
+
+    assert record_getter.get_es_records_by_pids([('lit', 1)]) == {}
+
+
+@patch('inspirehep.utils.record_getter.get_object_uuid')
+def test_call_with_object_uuid_retries_with_the_uuid_from_the_db(mock_get_object_uuid):
+    mock_get_object_uuid.side_effect = ['stale-uuid', 'uuid']
+    f = Mock(side_effect=[NotFoundError(404, 'not found'), 'record'])
+
+    assert record_getter._call_with_object_uuid('lit', 1, f) == 'record'
+    mock_get_object_uuid.assert_called_with('lit', 1, use_cache=False)
+    f.assert_called_with('uuid')
+
+
+@patch('inspirehep.utils.record_getter.get_object_uuid')
+def test_call_with_object_uuid_does_not_retry_with_the_same_uuid(mock_get_object_uuid):
+    mock_get_object_uuid.return_value = 'uuid'
+    f = Mock(side_effect=NotFoundError(404, 'not found'))
+
+    with pytest.raises(NotFoundError):
+        record_getter._call_with_object_uuid('lit', 1, f)
+
+    assert f.call_count == 1
+
+
+@patch('inspirehep.utils.record_getter.get_object_uuid')
+def test_call_with_object_uuid_does_not_retry_on_other_errors(mock_get_object_uuid):
+    mock_get_object_uuid.return_value = 'uuid'
+    f = Mock(side_effect=ConnectionError('N/A', 'unreachable', None))
+
+    with pytest.raises(ConnectionError):
+        record_getter._call_with_object_uuid('lit', 1, f)
+
+    assert f.call_count == 1
+    mock_get_object_uuid.assert_called_once_with('lit', 1)
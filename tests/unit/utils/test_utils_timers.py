@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of INSPIRE.
+# Copyright (C) 2014-2017 CERN.
+#
+# INSPIRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# INSPIRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with INSPIRE. If not, see <http://www.gnu.org/licenses/>.
+#
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as an Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+
+from __future__ import absolute_import, division, print_function
+
+import mock
+
+from inspirehep.utils.timers import (
+    StageTimer,
+    get_stage_stats,
+    timed,
+    timed_stage,
+)
+
+
+@mock.patch('inspirehep.utils.timers.time.time')
+def test_stage_timer_counts_nested_stages_exclusively(mock_time):
+    mock_time.side_effect = [0, 1, 4, 10]
+    timer = StageTimer()
+
+    with timer.stage('outer'):
+        with timer.stage('inner'):
+            pass
+
+    assert timer.times == {'outer': 7, 'inner': 3}
+    assert timer.counts == {'outer': 1, 'inner': 1}
+
+
+@mock.patch('inspirehep.utils.timers.time.time')
+def test_stage_timer_as_stats(mock_time):
+    mock_time.side_effect = [0, 2, 2, 3]
+    timer = StageTimer()
+
+    with timer.stage('insert'):
+        pass
+    with timer.stage('insert'):
+        pass
+
+    expected = {'insert_time': 3, 'insert_count': 2}
+    result = timer.as_stats()
+
+    assert expected == result
+
+
+def test_timed_stage_without_active_timer_does_nothing():
+    with timed_stage('insert'):
+        pass
+
+
+def test_timed_collects_in_the_active_timer_only():
+    @timed('stage')
+    def func(value):
+        return value
+
+    timer = StageTimer()
+    with timer.activate():
+        assert func(42) == 42
+    assert func(43) == 43
+
+    assert timer.counts == {'stage': 1}
+
+
+def test_get_stage_stats():
+    stats = {
+        'records': 10,
+        'insert_time': 1.5,
+        'insert_count': 10,
+        'index_time': 3.0,
+        'index_count': 1,
+    }
+
+    expected = [('index', 3.0, 1), ('insert', 1.5, 10)]
+    result = get_stage_stats(stats)
+
+    assert expected == result